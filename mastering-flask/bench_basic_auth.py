@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+测量并发HTTP Basic认证下API的响应时间
+用法: python bench_basic_auth.py [并发数] [每个线程的请求数]
+分别测量三种配置下GET /api/v1.0/posts/的p50和p99：
+    inline: 在请求线程中执行bcrypt，不缓存（以前的行为）
+    pool: bcrypt在线程池中执行
+    pool+cache: 线程池，并缓存Basic认证成功的结果
+"""
+import sys
+import threading
+import time
+from base64 import b64encode
+from webapp import create_app
+from webapp.models import db, User
+from webapp.extensions import admin, rest_api
+
+MODES = [
+    ('inline', {'PASSWORD_POOL_SIZE': 0, 'PASSWORD_CACHE_TIMEOUT': 0}),
+    ('pool', {'PASSWORD_POOL_SIZE': 4, 'PASSWORD_CACHE_TIMEOUT': 0}),
+    ('pool+cache', {'PASSWORD_POOL_SIZE': 4, 'PASSWORD_CACHE_TIMEOUT': 60}),
+]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100.0), len(values) - 1)]
+
+
+def run(app, concurrency, requests):
+    headers = {
+        'Authorization': 'Basic ' + b64encode(b'bench:secret'),
+        'Accept': 'application/json'
+    }
+    timings = []
+    lock = threading.Lock()
+
+    def worker():
+        client = app.test_client()
+        for _ in range(requests):
+            start = time.time()
+            response = client.get('/api/v1.0/posts/', headers=headers)
+            elapsed = time.time() - start
+            assert response.status_code == 200, response.status_code
+            with lock:
+                timings.append(elapsed * 1000)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return timings
+
+
+def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    for name, settings in MODES:
+        admin._views = []
+        rest_api.resources = []
+        app = create_app('test')
+        app.config.update(settings)
+        app.config['SERVER_NAME'] = 'localhost'
+        with app.app_context():
+            db.app = app
+            db.create_all()
+            user = User('bench')
+            user.email = 'bench@example.com'
+            user.password = 'secret'
+            user.confirmed = True
+            db.session.add(user)
+            db.session.commit()
+            db.session.remove()
+
+            timings = run(app, concurrency, requests)
+            print('%-10s p50 %8.1fms  p99 %8.1fms'
+                  % (name, percentile(timings, 50), percentile(timings, 99)))
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
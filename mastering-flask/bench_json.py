@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+比较 /api/v1.0/posts/ 响应的大小和编码耗时：
+    jsonify: 以前的写法，flask.jsonify缩进输出
+    其余各列: encoding模块中能够导入的编码器，紧凑输出
+用法: python bench_json.py
+文章对象只在内存中构造，只比较序列化和编码的CPU时间(time.clock)。
+"""
+import datetime
+import time
+from flask import jsonify
+from webapp import create_app
+from webapp.models import Post
+from webapp.encoding import BACKENDS, load_backend
+from webapp.serializers import serialize_page, page_response
+from webapp.extensions import admin, rest_api
+
+REPEAT = 200
+
+
+class Page(object):
+    # serialize_page需要的分页对象
+    total = 1000
+    has_prev = has_next = False
+
+
+def make_posts(count):
+    now = datetime.datetime.utcnow()
+    posts = []
+    for i in range(1, count + 1):
+        p = Post(u'post title %d' % i)
+        p.id = i
+        p.text = u'<p>body of post %d, lorem ipsum dolor sit amet</p>' % i
+        p.publish_date = now - datetime.timedelta(minutes=i)
+        p.user_id = i % 50 + 1
+        p.comment_count = i % 7
+        posts.append(p)
+    return posts
+
+
+def measure(app, build):
+    with app.test_request_context('/api/v1.0/posts/'):
+        size = len(build().get_data())
+        start = time.clock()
+        for _ in range(REPEAT):
+            build().get_data()
+        return size, (time.clock() - start) / REPEAT * 1000
+
+
+def main():
+    admin._views = []
+    rest_api.resources = []
+    app = create_app('test')
+    backends = []
+    for name in BACKENDS:
+        try:
+            load_backend(name)
+            backends.append(name)
+        except ImportError:
+            pass
+
+    print('%-8s %-10s %10s %10s' % ('posts', 'encoder', 'bytes', 'cpu ms'))
+    for count in (10, 30, 100):
+        posts = make_posts(count)
+        size, cpu = measure(app, lambda: jsonify(
+            serialize_page('posts', posts, Page(), 'api.get_posts')))
+        print('%-8d %-10s %10d %10.3f' % (count, 'jsonify', size, cpu))
+        for name in backends:
+            app.config['JSON_BACKEND'] = name
+            app.extensions.pop('json_backend', None)
+            size, cpu = measure(app, lambda: page_response(
+                'posts', posts, Page(), 'api.get_posts'))
+            print('%-8d %-10s %10d %10.3f' % (count, name, size, cpu))
+
+
+if __name__ == '__main__':
+    main()
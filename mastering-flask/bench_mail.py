@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+测量邮件的发送速度
+用法: python bench_mail.py [邮件数]
+在本地启动一个SMTP服务器，分别测量两种方式发送完所有邮件的速度(封/秒)：
+    thread: 每封邮件一个线程、一个SMTP连接（以前的行为）
+    queue: 发送队列，常驻线程复用SMTP连接
+"""
+import asyncore
+import smtpd
+import sys
+import threading
+import time
+from flask_mail import Message
+from webapp import create_app
+from webapp.extensions import admin, rest_api, mail
+
+
+class CountingSMTPServer(smtpd.SMTPServer):
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.port = self.socket.getsockname()[1]
+        # smtpd默认的backlog只有5，以前的方式会同时发起几百个连接
+        self.listen(1024)
+        self.received = 0
+        self.connections = 0
+
+    def handle_accept(self):
+        self.connections += 1
+        smtpd.SMTPServer.handle_accept(self)
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.received += 1
+
+
+def send_thread(app, msg):
+    # 以前的send_email：每封邮件启动一个线程，mail.send每次新建连接
+    def send():
+        with app.app_context():
+            mail.send(msg)
+    thread = threading.Thread(target=send)
+    thread.start()
+
+
+def send_queue(app, msg):
+    app.extensions['mail_queue'].put(msg)
+
+
+def run(name, send, count, workers):
+    admin._views = []
+    rest_api.resources = []
+    app = create_app('test')
+    app.config.update(MAIL_QUEUE_WORKERS=workers)
+    server = CountingSMTPServer()
+    state = app.extensions['mail']
+    state.suppress = False
+    state.server, state.port = '127.0.0.1', server.port
+    state.username = state.password = None
+
+    loop = threading.Thread(target=asyncore.loop,
+                            kwargs={'timeout': 0.01, 'map': asyncore.socket_map})
+    loop.daemon = True
+    loop.start()
+
+    with app.app_context():
+        start = time.time()
+        for i in range(count):
+            send(app, Message('bench', sender='bench@example.com',
+                              recipients=['user%d@example.com' % i],
+                              body='hello %d' % i))
+        while server.received < count:
+            time.sleep(0.001)
+        elapsed = time.time() - start
+    app.extensions['mail_queue'].close()
+    server.close()
+    loop.join()
+    print('%-6s %6d mails %8.1f mails/s  %5d connections'
+          % (name, count, count / elapsed, server.connections))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    run('thread', send_thread, count, 0)
+    run('queue', send_queue, count, 4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+比较序列化1000篇文章的耗时：
+    url_for: 以前的写法，每个链接调用一次url_for(..., _external=True)
+    template: 每个endpoint只生成一次URL模板，之后只填入id
+用法: python bench_serializers.py
+文章对象只在内存中构造，不访问数据库，只比较序列化本身的开销。
+"""
+import datetime
+import time
+from flask import url_for
+from webapp import create_app
+from webapp.models import Post
+from webapp.serializers import serialize_page
+from webapp.extensions import admin, rest_api
+
+COUNT = 1000
+REPEAT = 20
+
+
+class Page(object):
+    # serialize_page需要的分页对象，只有一页
+    total = COUNT
+    has_prev = has_next = False
+
+
+def legacy_to_json(post):
+    return {
+        'url': url_for('api.get_post', id=post.id, _external=True),
+        'title': post.title,
+        'text': post.text,
+        'publish_date': post.publish_date,
+        'author': url_for('api.get_user', id=post.user_id, _external=True),
+        'comments': url_for('api.get_post_comments', id=post.id,
+                            _external=True),
+        'comment_count': post.comment_count
+    }
+
+
+def make_posts():
+    now = datetime.datetime.utcnow()
+    posts = []
+    for i in range(1, COUNT + 1):
+        p = Post('post %d' % i)
+        p.id = i
+        p.text = 'body of post %d' % i
+        p.publish_date = now
+        p.user_id = i % 50 + 1
+        p.comment_count = 0
+        posts.append(p)
+    return posts
+
+
+def timing(func):
+    start = time.time()
+    for _ in range(REPEAT):
+        func()
+    return (time.time() - start) / REPEAT * 1000
+
+
+def main():
+    admin._views = []
+    rest_api.resources = []
+    app = create_app('test')
+    posts = make_posts()
+    # 每次序列化都在新的请求上下文中进行，URL模板的生成也计入耗时
+    with app.test_request_context('/api/v1.0/posts/'):
+        assert [legacy_to_json(p) for p in posts] == \
+            serialize_page('posts', posts, Page(), 'api.get_posts')['posts']
+
+    def before():
+        with app.test_request_context('/api/v1.0/posts/'):
+            [legacy_to_json(p) for p in posts]
+
+    def after():
+        with app.test_request_context('/api/v1.0/posts/'):
+            serialize_page('posts', posts, Page(), 'api.get_posts')
+
+    print('%d posts, average of %d runs' % (COUNT, REPEAT))
+    print('url_for:  %8.2f ms' % timing(before))
+    print('template: %8.2f ms' % timing(after))
+
+
+if __name__ == '__main__':
+    main()
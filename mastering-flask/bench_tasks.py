@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+测量Celery任务的吞吐量
+用法: python bench_tasks.py [任务数]
+使用进程内的memory://消息队列，在后台线程中启动一个worker(solo池)，
+发布N个multiply任务，等待全部执行完，分别测量两种方式的吞吐量(个/秒)：
+    push: 每个任务push/pop一次应用上下文（以前的行为）
+    reuse: CELERY_REUSE_APP_CONTEXT，worker共用一个应用上下文
+并输出TaskMetrics记录的平均排队时间、执行时间和进出应用上下文的时间。
+"""
+import sys
+import time
+# 注册start_worker需要的celery.ping任务
+import celery.contrib.testing.tasks
+from celery.contrib.testing.worker import start_worker
+from celery_runner import make_celery
+from webapp import create_app
+from webapp.extensions import admin, rest_api
+from webapp.taskmetrics import format_stats
+
+
+def run(name, count, reuse):
+    admin._views = []
+    rest_api.resources = []
+    app = create_app('test')
+    app.config.update(CELERY_BROKER_URL='memory://',
+                      CELERY_RESULT_BACKEND='cache+memory://',
+                      CELERY_IGNORE_RESULT=True,
+                      CELERY_REUSE_APP_CONTEXT=reuse,
+                      TASK_METRICS_INTERVAL=0)
+    celery = make_celery(app)
+    task = celery.tasks['webapp.tasks.multiply']
+    metrics = app.extensions['task_metrics']
+
+    with start_worker(celery, pool='solo', perform_ping_check=False):
+        start = time.time()
+        for i in range(count):
+            task.delay(i, 2)
+        published = time.time()
+        while metrics.snapshot().get(task.name, {}).get('succeeded', 0) < count:
+            time.sleep(0.001)
+        elapsed = time.time() - start
+    print('%-6s %6d tasks %8.1f tasks/s  (publish %8.1f tasks/s)'
+          % (name, count, count / elapsed, count / (published - start)))
+    print('       %s' % format_stats(metrics.snapshot()[task.name]))
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    run('push', count, False)
+    run('reuse', count, True)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+比较关注时间线第一页的两种查询方式：
+    join: posts JOIN follows，读取时再排序
+    fanout: 直接读取写扩散后的timelines表
+用法: python bench_timeline.py
+数据写入临时的SQLite数据库，读者分别关注10/100/1000个作者，每个作者20篇文章。
+"""
+import datetime
+import os
+import tempfile
+import time
+from webapp import create_app
+from webapp.models import db, User, Post, Follow
+from webapp.timeline import rebuild_timelines
+from webapp.extensions import admin, rest_api
+
+POSTS_PER_AUTHOR = 20
+REPEAT = 50
+
+
+def seed(authors):
+    users = User.__table__
+    posts = Post.__table__
+    follows = Follow.__table__
+    now = datetime.datetime.utcnow()
+    # 使用Core的executemany批量插入，1号用户为读者
+    db.session.execute(users.insert(), [
+        {'id': i, 'username': 'user%d' % i, 'follower_count': 1}
+        for i in range(1, authors + 2)
+    ])
+    db.session.execute(follows.insert(), [
+        {'follower_id': 1, 'following_id': i, 'timestamp': now}
+        for i in range(2, authors + 2)
+    ])
+    db.session.execute(posts.insert(), [
+        {'title': 'post %d-%d' % (i, j), 'user_id': i,
+         'publish_date': now - datetime.timedelta(minutes=i * j)}
+        for i in range(2, authors + 2) for j in range(POSTS_PER_AUTHOR)
+    ])
+    db.session.commit()
+    rebuild_timelines()
+
+
+def timing(app, reader, fanout):
+    app.config['TIMELINE_FANOUT'] = fanout
+    start = time.time()
+    for _ in range(REPEAT):
+        Post.listing(reader.following_posts).limit(
+            app.config['PAGINATION_POST_PER_PAGE']).all()
+    return (time.time() - start) / REPEAT * 1000
+
+
+def main():
+    for authors in (10, 100, 1000):
+        admin._views = []
+        rest_api.resources = []
+        fd, path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        app = create_app('test')
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+        with app.app_context():
+            db.app = app
+            db.create_all()
+            seed(authors)
+            reader = User.query.get(1)
+            join = timing(app, reader, False)
+            fanout = timing(app, reader, True)
+            print('following %4d authors: join %.2fms, fanout %.2fms'
+                  % (authors, join, fanout))
+            db.session.remove()
+            db.drop_all()
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,7 @@ from celery import Celery
 #   Did you remember to import the module containing this task?
 #   Or maybe you're using relative imports?
 from webapp.tasks import log
+from webapp.taskmetrics import context_task
 
 
 def make_celery(app):
@@ -18,25 +19,13 @@ def make_celery(app):
         backend=app.config['CELERY_RESULT_BACKEND']
     )
 
-    # http://kronosapiens.github.io/blog/2014/08/14/understanding-contexts-in-flask.html
-    # 运行Celery任务会报下面的错误：
-    # RuntimeError: Application was not able to create a URL adapter for request independent URL generation.
-    # You might be able to fix this by setting the SERVER_NAME config variable.
-    # 原因是weekly-digest任务中渲染digest.html模板时，url_for()函数需要上下文环境。
-    # 另外，不能把SERVER_NAME = 'localhost:5000'添加到DevConfig中，会导致所有的路由都不能正常访问.
-    app.config['SERVER_NAME'] = 'localhost:5000'
+    # 任务中生成链接时在SITE_URL对应的请求上下文中调用url_for(见webapp/digest.py)，
+    # 不要设置SERVER_NAME，否则所有的路由都只匹配这个主机名
     celery.conf.update(app.config)
 
-    TaskBase = celery.Task
-
-    class ContextTask(TaskBase):
-        abstract = True
-
-        def __call__(self, *args, **kwargs):
-            with app.app_context():
-                return TaskBase.__call__(self, *args, **kwargs)
-
-    celery.Task = ContextTask
+    # 任务在应用上下文中执行并记录监控指标，
+    # CELERY_REUSE_APP_CONTEXT为True时不再为每个任务push/pop应用上下文
+    celery.Task = context_task(celery.Task, app)
 
     return celery
 
@@ -1,10 +1,19 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
+import time
+import datetime
 from flask_script import Manager, Server
 from flask_script.commands import ShowUrls, Clean
 from flask_migrate import Migrate, MigrateCommand, upgrade
 from webapp import create_app
-from webapp.models import db, User, Post, Tag, Comment, Role, Follow
+from webapp.models import db, User, Post, Tag, Comment, Role, Follow, \
+    check_counters
+from webapp.timeline import rebuild_timelines
+from webapp.seeding import seed_database
+from webapp.search import reindex as reindex_search
+from webapp.rendering import render_posts as render_all_posts
+from webapp.export import export as export_lines, parse_since
 
 # 保证在全局作用域中的所有代码执行之前，启动覆盖检测
 COV = None
@@ -41,17 +50,23 @@ def make_shell_context():
                 Role=Role, Follow=Follow)
 
 
+# 批量生成模拟数据，例如生成压力测试用的百万级数据：
+# python manage.py insert_data --users 100000 --posts 1000000 --comments 3000000
 @manager.command
-def insert_data():
+def insert_data(users=100, tags=10, posts=100, comments=1000, follows=10,
+                seed=0, batch_size=5000, end=None):
+    """Bulk insert deterministic fake data."""
     # 不需要在这里创建库，应该使用数据库升级命令`db upgrade`来创建库
     # db.create_all()
-
-    # 注意调用顺序
-    Role.generate_fake()
-    User.generate_fake()
-    Tag.generate_fake()
-    Post.generate_fake()
-    Comment.generate_fake(1000)
+    # --end 2018-01-01 指定模拟数据中最晚的时间，默认为seeding.DEFAULT_END
+    if end:
+        end = datetime.datetime.strptime(end, '%Y-%m-%d')
+    start = time.time()
+    result = seed_database(int(users), int(tags), int(posts), int(comments),
+                           int(follows), int(seed), int(batch_size), end)
+    for table in ('users', 'tags', 'posts', 'comments', 'follows'):
+        print('%-10s %d' % (table, result[table]))
+    print('completed in %.1fs' % (time.time() - start))
 
 
 @manager.command
@@ -67,6 +82,67 @@ def clear_data():
     db.session.commit()
 
 
+# 检查冗余保存的计数是否与实际数量一致，调用方法：python manage.py verify_counters --repair
+@manager.command
+def verify_counters(repair=False):
+    """Check the denormalized counters, fix the drifted rows with --repair."""
+    drift = check_counters(repair=repair)
+    for column in sorted(drift):
+        print('%s: %d rows drifted' % (column, drift[column]))
+    if repair:
+        print('repaired')
+
+
+# 开启TIMELINE_FANOUT之前，先用这个命令根据现有的关注关系生成所有人的时间线
+@manager.command
+def rebuild_timeline():
+    """Rebuild the materialized follow timelines of all users."""
+    print('%d timeline entries' % rebuild_timelines())
+
+
+# 重建全文检索的索引，数据库迁移创建索引表之后需要执行一次
+@manager.command
+def reindex(batch_size=1000):
+    """Rebuild the full-text search index in batches."""
+    print('%d documents indexed' % reindex_search(int(batch_size)))
+
+
+# 重新渲染文章正文：迁移之后，或者增加了rendering.RENDERER_VERSION之后执行一次
+@manager.command
+def render_posts(batch_size=500, force=False):
+    """Re-render the HTML, excerpt and plain text of stale posts."""
+    print('%d posts rendered' % render_all_posts(int(batch_size), force))
+
+
+# 旧的命令名，c6f1d83a9e20迁移中提到的就是它，现在和render_posts相同
+@manager.command
+def backfill_text(batch_size=500):
+    """Fill in the precomputed plain text of existing posts."""
+    render_posts(batch_size)
+
+
+# 导出文章、评论、用户或关注关系，例如导出某一时刻以后发表的文章：
+# python manage.py export posts --format csv --since 2018-01-01 --output posts.csv
+@manager.command
+def export(kind, format='ndjson', since=None, output=None, batch_size=1000):
+    """Stream posts, comments, users or follows as NDJSON or CSV."""
+    if since:
+        since = parse_since(since)
+    out = open(output, 'wb') if output else sys.stdout
+    count = 0
+    try:
+        for line in export_lines(kind, format, since, int(batch_size)):
+            out.write(line)
+            count += 1
+    finally:
+        if output:
+            out.close()
+    # CSV的第一行是列名
+    if format == 'csv':
+        count -= 1
+    sys.stderr.write('%d rows exported\n' % count)
+
+
 # test命令添加coverage参数,Flask-Script根据参数名确定选项名，并据此向函数中传入True或False
 # 调用参数的方法： python manage.py test --coverage
 @manager.command
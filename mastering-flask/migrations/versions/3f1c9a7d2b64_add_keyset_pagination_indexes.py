@@ -0,0 +1,34 @@
+"""add keyset pagination indexes
+
+Revision ID: 3f1c9a7d2b64
+Revises: 28c303190ba1
+Create Date: 2026-10-18 10:12:31.482913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9a7d2b64'
+down_revision = '28c303190ba1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_posts_user_id_publish_date', 'posts',
+                    ['user_id', 'publish_date'], unique=False)
+    op.create_index('ix_comments_post_id_date', 'comments',
+                    ['post_id', 'date'], unique=False)
+    op.create_index('ix_follows_following_id_timestamp', 'follows',
+                    ['following_id', 'timestamp'], unique=False)
+    op.create_index('ix_follows_follower_id_timestamp', 'follows',
+                    ['follower_id', 'timestamp'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_follows_follower_id_timestamp', table_name='follows')
+    op.drop_index('ix_follows_following_id_timestamp', table_name='follows')
+    op.drop_index('ix_comments_post_id_date', table_name='comments')
+    op.drop_index('ix_posts_user_id_publish_date', table_name='posts')
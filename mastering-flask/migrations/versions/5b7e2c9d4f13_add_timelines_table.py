@@ -0,0 +1,41 @@
+"""add timelines table
+
+Revision ID: 5b7e2c9d4f13
+Revises: 8d2e4b6a1c57
+Create Date: 2026-10-18 14:05:12.371640
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b7e2c9d4f13'
+down_revision = '8d2e4b6a1c57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The table stays empty until TIMELINE_FANOUT is enabled;
+    # run `manage.py rebuild_timeline` once before turning it on.
+    op.create_table('timelines',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('author_id', sa.Integer(), nullable=True),
+    sa.Column('publish_date', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['author_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'post_id')
+    )
+    op.create_index(op.f('ix_timelines_post_id'), 'timelines', ['post_id'],
+                    unique=False)
+    op.create_index('ix_timelines_user_id_publish_date', 'timelines',
+                    ['user_id', 'publish_date', 'post_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_timelines_user_id_publish_date', table_name='timelines')
+    op.drop_index(op.f('ix_timelines_post_id'), table_name='timelines')
+    op.drop_table('timelines')
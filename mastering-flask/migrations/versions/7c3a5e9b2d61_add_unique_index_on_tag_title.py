@@ -0,0 +1,54 @@
+"""add unique index on tag title
+
+Revision ID: 7c3a5e9b2d61
+Revises: e2b97d4c1a58
+Create Date: 2026-10-18 21:26:52.704318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c3a5e9b2d61'
+down_revision = 'e2b97d4c1a58'
+branch_labels = None
+depends_on = None
+
+
+tags = sa.table('tags', sa.column('id'), sa.column('title'))
+posts_tags = sa.table('posts_tags', sa.column('post_id'), sa.column('tag_id'))
+
+
+def upgrade():
+    conn = op.get_bind()
+    # merge tags with the same title into the one with the smallest id
+    keep = {}
+    duplicates = {}
+    for id, title in conn.execute(
+            sa.select([tags.c.id, tags.c.title]).order_by(tags.c.id)):
+        if title in keep:
+            duplicates[id] = keep[title]
+        else:
+            keep[title] = id
+    if duplicates:
+        affected = set(duplicates.values()) | set(duplicates)
+        pairs = set()
+        for post_id, tag_id in conn.execute(
+                sa.select([posts_tags.c.post_id, posts_tags.c.tag_id]).where(
+                    posts_tags.c.tag_id.in_(affected))):
+            pairs.add((post_id, duplicates.get(tag_id, tag_id)))
+        # rewrite the links of the affected tags without duplicate pairs
+        conn.execute(posts_tags.delete().where(
+            posts_tags.c.tag_id.in_(affected)))
+        if pairs:
+            conn.execute(posts_tags.insert(), [
+                {'post_id': post_id, 'tag_id': tag_id}
+                for post_id, tag_id in pairs])
+        conn.execute(tags.delete().where(tags.c.id.in_(duplicates)))
+
+    op.create_index(op.f('ix_tags_title'), 'tags', ['title'], unique=True)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_tags_title'), table_name='tags')
@@ -0,0 +1,65 @@
+"""add denormalized counter columns
+
+Revision ID: 8d2e4b6a1c57
+Revises: 3f1c9a7d2b64
+Create Date: 2026-10-18 11:02:47.193520
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2e4b6a1c57'
+down_revision = '3f1c9a7d2b64'
+branch_labels = None
+depends_on = None
+
+
+users = sa.table('users', sa.column('id'), sa.column('post_count'),
+                 sa.column('comment_count'), sa.column('follower_count'),
+                 sa.column('following_count'))
+posts = sa.table('posts', sa.column('id'), sa.column('user_id'),
+                 sa.column('comment_count'))
+comments = sa.table('comments', sa.column('id'), sa.column('user_id'),
+                    sa.column('post_id'), sa.column('disabled', sa.Boolean()))
+follows = sa.table('follows', sa.column('follower_id'),
+                   sa.column('following_id'))
+
+
+def upgrade():
+    for column in ('post_count', 'comment_count', 'follower_count',
+                   'following_count'):
+        op.add_column('users', sa.Column(column, sa.Integer(),
+                                         server_default='0', nullable=False))
+    op.add_column('posts', sa.Column('comment_count', sa.Integer(),
+                                     server_default='0', nullable=False))
+
+    # backfill the counters, disabled comments are not counted
+    visible = sa.or_(comments.c.disabled == None,
+                     comments.c.disabled == False)
+    op.execute(users.update().values(
+        post_count=sa.select([sa.func.count(posts.c.id)]).where(
+            posts.c.user_id == users.c.id).as_scalar(),
+        comment_count=sa.select([sa.func.count(comments.c.id)]).where(
+            sa.and_(comments.c.user_id == users.c.id, visible)).as_scalar(),
+        follower_count=sa.select([sa.func.count()]).select_from(
+            follows).where(follows.c.following_id == users.c.id).as_scalar(),
+        following_count=sa.select([sa.func.count()]).select_from(
+            follows).where(follows.c.follower_id == users.c.id).as_scalar()
+    ))
+    op.execute(posts.update().values(
+        comment_count=sa.select([sa.func.count(comments.c.id)]).where(
+            sa.and_(comments.c.post_id == posts.c.id, visible)).as_scalar()
+    ))
+
+
+def downgrade():
+    # SQLite has no DROP COLUMN, recreate the tables in batch mode
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.drop_column('comment_count')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('following_count')
+        batch_op.drop_column('follower_count')
+        batch_op.drop_column('comment_count')
+        batch_op.drop_column('post_count')
@@ -0,0 +1,26 @@
+"""add comment user_id index
+
+Revision ID: 9a5d3f7e1b42
+Revises: 7c3a5e9b2d61
+Create Date: 2026-10-18 23:41:07.215390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a5d3f7e1b42'
+down_revision = '7c3a5e9b2d61'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # bulk moderation selects comments by author
+    op.create_index('ix_comments_user_id', 'comments', ['user_id'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_comments_user_id', table_name='comments')
@@ -0,0 +1,34 @@
+"""add full-text search index
+
+Revision ID: a4c8e1f07d35
+Revises: 5b7e2c9d4f13
+Create Date: 2026-10-18 16:40:27.905113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c8e1f07d35'
+down_revision = '5b7e2c9d4f13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # FTS5 only exists in SQLite; other databases fall back to LIKE queries.
+    # The index is created empty, run `manage.py reindex` to fill it.
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+        "title, body, tags, kind UNINDEXED, ref_id UNINDEXED, "
+        "post_id UNINDEXED, tokenize='unicode61 remove_diacritics 2')"
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute("DROP TABLE IF EXISTS search_index")
@@ -0,0 +1,42 @@
+"""index visible comments by post
+
+Revision ID: b8e3c1d5f702
+Revises: 9a5d3f7e1b42
+Create Date: 2026-10-19 00:27:44.908163
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8e3c1d5f702'
+down_revision = '9a5d3f7e1b42'
+branch_labels = None
+depends_on = None
+
+
+comments = sa.table('comments', sa.column('disabled', sa.Boolean()))
+
+
+def upgrade():
+    # old rows may have NULL, which always meant "not disabled"; make the
+    # column NOT NULL so visible comments can be matched with disabled = false
+    op.execute(comments.update().where(comments.c.disabled == None).values(
+        disabled=False))
+    # SQLite cannot alter columns, recreate the table in batch mode
+    with op.batch_alter_table('comments') as batch_op:
+        batch_op.alter_column('disabled', existing_type=sa.Boolean(),
+                              nullable=False, server_default='0')
+    op.drop_index('ix_comments_post_id_date', table_name='comments')
+    op.create_index('ix_comments_post_id_disabled_date', 'comments',
+                    ['post_id', 'disabled', 'date'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_comments_post_id_disabled_date', table_name='comments')
+    op.create_index('ix_comments_post_id_date', 'comments',
+                    ['post_id', 'date'], unique=False)
+    with op.batch_alter_table('comments') as batch_op:
+        batch_op.alter_column('disabled', existing_type=sa.Boolean(),
+                              nullable=True, server_default=None)
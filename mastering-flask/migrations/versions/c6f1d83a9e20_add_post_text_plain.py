@@ -0,0 +1,27 @@
+"""add precomputed plain text column for posts
+
+Revision ID: c6f1d83a9e20
+Revises: a4c8e1f07d35
+Create Date: 2026-10-18 19:12:40.381644
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6f1d83a9e20'
+down_revision = 'a4c8e1f07d35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the column is filled on save; run `manage.py backfill_text` once
+    # for the existing posts
+    op.add_column('posts', sa.Column('text_plain', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.drop_column('text_plain')
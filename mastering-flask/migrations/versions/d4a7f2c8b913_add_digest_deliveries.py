@@ -0,0 +1,31 @@
+"""add digest deliveries
+
+Revision ID: d4a7f2c8b913
+Revises: b8e3c1d5f702
+Create Date: 2026-10-19 10:12:44.508213
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a7f2c8b913'
+down_revision = 'b8e3c1d5f702'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # one row per recipient and week, so a re-run digest skips them
+    op.create_table('digest_deliveries',
+    sa.Column('week', sa.Date(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('sent_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('week', 'user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('digest_deliveries')
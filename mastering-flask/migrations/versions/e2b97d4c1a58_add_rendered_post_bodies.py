@@ -0,0 +1,32 @@
+"""add pre-rendered html and excerpt columns for posts
+
+Revision ID: e2b97d4c1a58
+Revises: c6f1d83a9e20
+Create Date: 2026-10-18 20:05:13.527906
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b97d4c1a58'
+down_revision = 'c6f1d83a9e20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the columns are filled on save; run `manage.py render_posts` once
+    # for the existing posts
+    op.add_column('posts', sa.Column('text_html', sa.Text(), nullable=True))
+    op.add_column('posts', sa.Column('excerpt', sa.Text(), nullable=True))
+    op.add_column('posts', sa.Column('render_version', sa.Integer(),
+                                     nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.drop_column('render_version')
+        batch_op.drop_column('excerpt')
+        batch_op.drop_column('text_html')
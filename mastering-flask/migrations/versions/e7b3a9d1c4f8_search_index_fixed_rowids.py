@@ -0,0 +1,42 @@
+"""give search index rows fixed rowids
+
+Revision ID: e7b3a9d1c4f8
+Revises: d4a7f2c8b913
+Create Date: 2026-10-19 15:02:31.447120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b3a9d1c4f8'
+down_revision = 'd4a7f2c8b913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Rows are now addressed by rowid = ref_id * 2 + (kind == 'comment'),
+    # because filters on the UNINDEXED columns scan the whole table.
+    # Renumber the existing rows, keeping one row per document.
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute(
+        "CREATE TEMP TABLE search_index_copy AS "
+        "SELECT max(rowid), title, body, tags, kind, ref_id, post_id "
+        "FROM search_index GROUP BY kind, ref_id"
+    )
+    op.execute("DELETE FROM search_index")
+    op.execute(
+        "INSERT INTO search_index "
+        "(rowid, title, body, tags, kind, ref_id, post_id) "
+        "SELECT ref_id * 2 + (kind = 'comment'), title, body, tags, kind, "
+        "ref_id, post_id FROM search_index_copy"
+    )
+    op.execute("DROP TABLE search_index_copy")
+
+
+def downgrade():
+    # the previous code works with any rowids
+    pass
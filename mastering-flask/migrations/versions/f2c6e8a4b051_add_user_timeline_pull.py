@@ -0,0 +1,31 @@
+"""add user timeline_pull flag
+
+Revision ID: f2c6e8a4b051
+Revises: e7b3a9d1c4f8
+Create Date: 2026-10-19 16:20:05.113842
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c6e8a4b051'
+down_revision = 'e7b3a9d1c4f8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # authors whose posts were not fanned out are merged at read time;
+    # 1000 is the default TIMELINE_FANOUT_LIMIT, `manage.py rebuild_timeline`
+    # recomputes the flag with the configured limit
+    op.add_column('users', sa.Column('timeline_pull', sa.Boolean(),
+                                     server_default='0', nullable=False))
+    op.execute("UPDATE users SET timeline_pull = 1 "
+               "WHERE follower_count > 1000")
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('timeline_pull')
@@ -6,6 +6,8 @@ from webapp import create_app
 
 # 默认使用 default 配置
 app = create_app(os.environ.get('FLASK_CONFIG', 'default'))
+# bcrypt在gevent的线程池中执行，不阻塞hub
+app.config['PASSWORD_POOL_GEVENT'] = True
 
 server = WSGIServer(('', 5000), app)
 server.serve_forever()
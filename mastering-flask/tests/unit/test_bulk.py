@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import unittest
+import json
+import datetime
+from base64 import b64encode
+from webapp import create_app
+from webapp.models import db, User, Post, Comment, TimelineEntry, \
+    check_counters
+from webapp import bulk
+from webapp.search import search
+from webapp.pagecache import validators, post_tag, POSTS
+from webapp.extensions import admin, rest_api
+
+
+class BulkTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Bug workarounds: Flask Admin和Flask Restful扩展中，
+        # 它们会为应用生成蓝图对象并在内部保存起来，但在应用销毁时不会主动将其移除。
+        admin._views = []
+        rest_api.resources = []
+
+        self.app = create_app('test')
+        self.app.config['TIMELINE_FANOUT'] = True
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+
+        db.app = self.app
+        db.create_all()
+
+        self.author = User('author')
+        self.author.email = 'author@example.com'
+        self.author.password = 'cat'
+        self.author.confirmed = True
+        self.reader = User('reader')
+        db.session.add_all([self.author, self.reader])
+        db.session.commit()
+        self.reader.follow(self.author)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def post(self, url, items):
+        return self.client.post(url, data=json.dumps(items), headers={
+            'Authorization': 'Basic ' + b64encode('author:cat'),
+            'Content-Type': 'application/json'})
+
+    def test_bulk_posts(self):
+        etag = validators(POSTS).etag
+        response = self.post('/api/v1.0/posts/batch', [
+            {'title': 'one', 'text': '<p>first searchable</p>'},
+            {'title': 'bad'},
+            {'title': 'two', 'text': 'second *post*'},
+            'not an object'
+        ])
+        self.assertEqual(response.status_code, 201)
+        data = json.loads(response.data)
+        self.assertEqual(data['created'], 2)
+        self.assertEqual([r['status'] for r in data['results']],
+                         [201, 400, 201, 400])
+        ids = [r['id'] for r in data['results'] if r['status'] == 201]
+        posts = [Post.query.get(id) for id in ids]
+        self.assertEqual([p.title for p in posts], ['one', 'two'])
+        self.assertTrue(data['results'][0]['url'].endswith(
+            '/api/v1.0/posts/%d' % ids[0]))
+        # 预先渲染的正文、计数、时间线和全文索引都和逐条写入时一样
+        self.assertEqual(posts[1].text_html, u'<p>second <em>post</em></p>')
+        self.assertEqual(self.author.post_count, 2)
+        self.assertFalse(any(check_counters().values()))
+        self.assertEqual(TimelineEntry.query.filter_by(
+            user_id=self.reader.id).count(), 2)
+        self.assertEqual([hit.post.id for hit in search('searchable').items],
+                         [ids[0]])
+        # 事务提交后文章列表的缓存失效
+        self.assertNotEqual(validators(POSTS).etag, etag)
+
+    def test_same_user_and_time(self):
+        # 同一用户同一时刻的其他文章(并发的批次、只精确到秒的DATETIME)不影响结果
+        class FrozenDatetime(datetime.datetime):
+            @classmethod
+            def utcnow(cls):
+                return datetime.datetime(2018, 1, 1)
+
+        class Clock(object):
+            datetime = FrozenDatetime
+
+        bulk.datetime = Clock
+        try:
+            first = bulk.insert_posts(self.author.id, [Post('a'), Post('b')])
+            second = bulk.insert_posts(self.author.id, [Post('c')])
+            db.session.commit()
+        finally:
+            bulk.datetime = datetime
+        self.assertEqual([Post.query.get(id).title for id in first + second],
+                         ['a', 'b', 'c'])
+        self.assertFalse(any(check_counters().values()))
+
+    def test_bulk_comments(self):
+        p1, p2 = Post('p1'), Post('p2')
+        for p in (p1, p2):
+            p.user = self.author
+        db.session.add_all([p1, p2])
+        db.session.commit()
+        etag = validators(post_tag(p2.id)).etag
+
+        response = self.post('/api/v1.0/posts/%d/comments/batch' % p1.id, [
+            {'name': 'a', 'text': 'hello'}, {'name': 'b', 'text': 'world'}])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.data)['created'], 2)
+
+        response = self.post('/api/v1.0/comments/batch', [
+            {'name': 'c', 'text': 'to p2', 'post_id': p2.id},
+            {'name': 'd', 'text': 'missing post', 'post_id': 999},
+            {'name': 'e', 'text': 'to p1', 'post_id': p1.id},
+            {'name': 'f', 'post_id': p1.id}])
+        data = json.loads(response.data)
+        self.assertEqual([r['status'] for r in data['results']],
+                         [201, 404, 201, 400])
+        comment = Comment.query.get(data['results'][0]['id'])
+        self.assertEqual((comment.text, comment.post_id, comment.user_id),
+                         ('to p2', p2.id, self.author.id))
+        self.assertEqual((p1.comment_count, p2.comment_count), (3, 1))
+        self.assertEqual(self.author.comment_count, 4)
+        self.assertFalse(any(check_counters().values()))
+        self.assertNotEqual(validators(post_tag(p2.id)).etag, etag)
+
+        response = self.post('/api/v1.0/posts/999/comments/batch',
+                             [{'name': 'a', 'text': 'b'}])
+        self.assertEqual(response.status_code, 404)
+
+    def test_batch_limits(self):
+        self.app.config['API_BATCH_LIMIT'] = 2
+        for items in ([], {'title': 'x'}, [{'title': 't', 'text': 'x'}] * 3):
+            response = self.post('/api/v1.0/posts/batch', items)
+            self.assertEqual(response.status_code, 400)
+        response = self.post('/api/v1.0/posts/batch', [{'title': 'x'}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data)['created'], 0)
+        self.assertEqual(Post.query.count(), 0)
+
+        response = self.client.post(
+            '/api/v1.0/posts/batch', data=json.dumps([{'title': 't',
+                                                       'text': 'x'}]),
+            headers={'Authorization': 'Basic Og==',
+                     'Content-Type': 'application/json'})
+        self.assertEqual(response.status_code, 401)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import unittest
+import json
+import datetime
+from base64 import b64encode
+from sqlalchemy import event
+from webapp import create_app
+from webapp.models import db, User, Post, Comment, Role
+from webapp.extensions import admin, rest_api
+
+
+class CommentVisibilityTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Bug workarounds: Flask Admin和Flask Restful扩展中，
+        # 它们会为应用生成蓝图对象并在内部保存起来，但在应用销毁时不会主动将其移除。
+        admin._views = []
+        rest_api.resources = []
+
+        self.app = create_app('test')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+
+        db.app = self.app
+        db.create_all()
+
+        self.admin = self.add_user('boss')
+        self.admin.roles.append(Role('admin'))
+        self.reader = self.add_user('reader')
+        self.post = Post('spammed')
+        self.post.text = 'body'
+        self.post.user = self.admin
+        db.session.add(self.post)
+        now = datetime.datetime.utcnow()
+        for i in range(6):
+            c = Comment('comment %d' % i)
+            c.text = 'visible %d' % i if i % 3 == 0 else 'spam %d' % i
+            c.disabled = i % 3 != 0
+            c.date = now + datetime.timedelta(seconds=i)
+            c.user = self.reader
+            c.post = self.post
+            db.session.add(c)
+        db.session.commit()
+
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self.record_statement)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self.record_statement)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def record_statement(self, conn, cursor, statement, parameters, context,
+                         executemany):
+        self.statements.append(statement)
+
+    def add_user(self, username):
+        user = User(username)
+        user.email = '%s@example.com' % username
+        user.password = 'cat'
+        user.confirmed = True
+        db.session.add(user)
+        return user
+
+    def get_json(self, url, username=None):
+        auth = b64encode(username + ':cat') if username else 'Og=='
+        response = self.client.get(url, headers={
+            'Authorization': 'Basic ' + auth})
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data)
+
+    def test_api_hides_disabled_comments(self):
+        data = self.get_json('/api/v1.0/posts/%d/comments/?page=1'
+                             % self.post.id)
+        self.assertEqual([c['text'] for c in data['comments']],
+                         ['visible 0', 'visible 3'])
+        self.assertEqual(data['count'], 2)
+        data = self.get_json('/api/v1.0/comments/', 'reader')
+        self.assertEqual(len(data['comments']), 2)
+        self.assertEqual(data['count'], 2)
+
+        # 管理员仍然能看到所有评论
+        data = self.get_json('/api/v1.0/posts/%d/comments/' % self.post.id,
+                             'boss')
+        self.assertEqual(len(data['comments']), 6)
+        self.assertEqual(data['count'], 6)
+
+    def test_etag_depends_on_admin(self):
+        url = '/api/v1.0/posts/%d/comments/' % self.post.id
+        response = self.client.get(url, headers={
+            'Authorization': 'Basic ' + b64encode('reader:cat')})
+        self.assertIn('Authorization', response.headers['Vary'])
+        # 普通用户拿到的ETag不能让管理员得到304
+        response = self.client.get(url, headers={
+            'Authorization': 'Basic ' + b64encode('boss:cat'),
+            'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.data)['comments']), 6)
+        self.assertIn('Authorization', response.headers['Vary'])
+
+    def test_post_comment_total_uses_counter(self):
+        del self.statements[:]
+        self.get_json('/api/v1.0/posts/%d/comments/' % self.post.id)
+        self.assertFalse([s for s in self.statements
+                          if 'count(' in s.lower() and 'comments' in s])
+
+    def test_post_page(self):
+        response = self.client.get('/blog/post/%d' % self.post.id)
+        page = response.get_data(as_text=True)
+        self.assertIn('visible 3', page)
+        self.assertNotIn('spam 1', page)
+        self.assertNotIn('disabled by admin', page)
+
+        self.client.post('/auth/login', data={
+            'username_or_email': 'boss', 'password': 'cat'})
+        page = self.client.get('/blog/post/%d' % self.post.id).get_data(
+            as_text=True)
+        self.assertIn('spam 4', page)
+        self.assertIn('disabled by admin', page)
+
+    def test_visible_comments_use_index(self):
+        query = self.post.comments.filter(Comment.disabled == False) \
+            .order_by(Comment.date, Comment.id).limit(10)
+        compiled = query.statement.compile(db.engine,
+                                           compile_kwargs={'literal_binds': True})
+        plan = db.session.execute('EXPLAIN QUERY PLAN %s' % compiled).fetchall()
+        self.assertIn('ix_comments_post_id_disabled_date',
+                      ' '.join(str(row) for row in plan))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import unittest
+import datetime
+import json
+from base64 import b64encode
+from flask import url_for
+from sqlalchemy import event
+from webapp import create_app
+from webapp.models import db, User, Post, Comment
+from webapp.extensions import admin, rest_api
+
+
+class ConditionalGetTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Bug workarounds: Flask Admin和Flask Restful扩展中，
+        # 它们会为应用生成蓝图对象并在内部保存起来，但在应用销毁时不会主动将其移除。
+        admin._views = []
+        rest_api.resources = []
+
+        self.app = create_app('test')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+
+        db.app = self.app
+        db.create_all()
+
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self.record_statement)
+
+        u = User('author')
+        u.email = 'author@example.com'
+        u.confirmed = True
+        now = datetime.datetime.utcnow()
+        for i in range(3):
+            p = Post('post %d' % i)
+            p.text = 'body of post %d' % i
+            p.publish_date = now - datetime.timedelta(minutes=i)
+            p.user = u
+            db.session.add(p)
+        c = Comment(name='comment')
+        c.text = 'first'
+        c.post = p
+        c.user = u
+        db.session.add(c)
+        db.session.commit()
+        self.post_id = p.id
+        self.comment_id = c.id
+        db.session.remove()
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self.record_statement)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def record_statement(self, conn, cursor, statement, parameters, context,
+                         executemany):
+        self.statements.append(statement)
+
+    def get(self, url, **headers):
+        # 匿名访问API
+        headers['Authorization'] = 'Basic ' + b64encode(':')
+        headers['Accept'] = 'application/json'
+        del self.statements[:]
+        return self.client.get(url, headers=headers)
+
+    def assert_cached(self, url):
+        """第一次请求返回200和校验值，带着校验值再次请求返回304"""
+        response = self.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        response = self.get(url, **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, '')
+        return etag
+
+    def test_single_resources_are_validated_without_queries(self):
+        for url in (url_for('api.get_post', id=self.post_id),
+                    url_for('api.get_comment', id=self.comment_id),
+                    url_for('api.get_post_comments', id=self.post_id),
+                    url_for('api.get_user', id=1)):
+            self.assert_cached(url)
+            self.assertEqual(self.statements, [])
+
+        url = url_for('api.get_post', id=self.post_id)
+        response = self.get(url)
+        response = self.get(url, **{
+            'If-Modified-Since': response.headers['Last-Modified']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_changes_produce_new_validators(self):
+        post_url = url_for('api.get_post', id=self.post_id)
+        list_url = url_for('api.get_posts')
+        comments_url = url_for('api.get_post_comments', id=self.post_id)
+        etags = dict((url, self.assert_cached(url))
+                     for url in (post_url, list_url, comments_url))
+
+        # 查禁评论不改变publish_date，但改变了文章的comment_count
+        comment = Comment.query.get(self.comment_id)
+        comment.disabled = True
+        db.session.commit()
+        for url, etag in etags.items():
+            response = self.get(url, **{'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+        response = self.get(post_url, **{'If-None-Match': etags[post_url]})
+        self.assertEqual(json.loads(response.data)['comment_count'], 0)
+
+        # 编辑其他文章只影响列表
+        etags = dict((url, self.assert_cached(url))
+                     for url in (post_url, list_url))
+        post = Post.query.filter_by(title='post 0').first()
+        post.text = 'edited'
+        db.session.commit()
+        self.assertEqual(self.get(post_url, **{
+            'If-None-Match': etags[post_url]}).status_code, 304)
+        self.assertEqual(self.get(list_url, **{
+            'If-None-Match': etags[list_url]}).status_code, 200)
+
+    def test_requires_shared_cache(self):
+        # 其他进程中的修改不会改变进程内缓存中的版本号，不能返回304
+        self.app.config['CACHE_SINGLE_PROCESS'] = False
+        for url in (url_for('api.get_post', id=self.post_id),
+                    '/api/post/%d' % self.post_id):
+            response = self.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('ETag', response.headers)
+            response = self.get(url, **{'If-Modified-Since':
+                                        'Tue, 01 Jan 2030 00:00:00 GMT'})
+            self.assertEqual(response.status_code, 200)
+
+    def test_rest_post_api(self):
+        url = '/api/post/%d' % self.post_id
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(url, headers={
+            'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_blog_pages(self):
+        self.app.config['PAGE_CACHE_TIMEOUT'] = 60
+        url = url_for('blog.post', post_id=self.post_id)
+        response = self.client.get(url)
+        etag = response.headers['ETag']
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        post = Post.query.get(self.post_id)
+        post.title = 'changed'
+        db.session.commit()
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('changed', response.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import unittest
+from webapp import create_app
+from webapp.models import db, User, Post, Comment, check_counters
+from webapp.extensions import admin, rest_api
+
+
+class CountersTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Bug workarounds: Flask Admin和Flask Restful扩展中，
+        # 它们会为应用生成蓝图对象并在内部保存起来，但在应用销毁时不会主动将其移除。
+        admin._views = []
+        rest_api.resources = []
+
+        self.app = create_app('test')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        db.app = self.app
+        db.create_all()
+
+        self.u1 = User('john')
+        self.u1.email = 'john@example.com'
+        self.u2 = User('susan')
+        self.u2.email = 'susan@example.com'
+        self.post = Post('title')
+        self.post.text = 'body'
+        self.post.user = self.u1
+        db.session.add_all([self.u1, self.u2, self.post])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_comment(self, user):
+        c = Comment('name')
+        c.text = 'text'
+        c.user = user
+        c.post = self.post
+        db.session.add(c)
+        db.session.commit()
+        return c
+
+    def test_post_count(self):
+        self.assertEqual(self.u1.post_count, 1)
+        p = Post('another')
+        p.user = self.u1
+        db.session.add(p)
+        db.session.commit()
+        self.assertEqual(self.u1.post_count, 2)
+        db.session.delete(p)
+        db.session.commit()
+        self.assertEqual(self.u1.post_count, 1)
+
+    def test_comment_count_and_moderation(self):
+        c1 = self.add_comment(self.u2)
+        self.add_comment(self.u2)
+        self.assertEqual(self.post.comment_count, 2)
+        self.assertEqual(self.u2.comment_count, 2)
+
+        # 被查禁的评论不计入
+        c1.disabled = True
+        db.session.commit()
+        self.assertEqual(self.post.comment_count, 1)
+        self.assertEqual(self.u2.comment_count, 1)
+        c1.disabled = False
+        db.session.commit()
+        self.assertEqual(self.post.comment_count, 2)
+
+        db.session.delete(c1)
+        db.session.commit()
+        self.assertEqual(self.post.comment_count, 1)
+        self.assertEqual(self.u2.comment_count, 1)
+
+    def test_follow_counts(self):
+        self.u1.follow(self.u2)
+        self.assertEqual(self.u1.following_count, 1)
+        self.assertEqual(self.u2.follower_count, 1)
+        self.u1.unfollow(self.u2)
+        self.assertEqual(self.u1.following_count, 0)
+        self.assertEqual(self.u2.follower_count, 0)
+
+    def test_check_counters_repairs_drift(self):
+        self.add_comment(self.u2)
+        self.assertFalse(any(check_counters().values()))
+
+        db.session.execute(User.__table__.update().values(post_count=7))
+        db.session.commit()
+        drift = check_counters()
+        self.assertEqual(drift['users.post_count'], 2)
+        check_counters(repair=True)
+        self.assertFalse(any(check_counters().values()))
+        self.assertEqual(User.query.get(self.u1.id).post_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
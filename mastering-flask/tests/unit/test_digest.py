@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+import unittest
+import datetime
+import flask_mail
+from webapp import create_app
+from webapp.models import db, User, Post, DigestDelivery
+from webapp.digest import DigestError, week_range, build_digest, \
+    load_digest, recipient_chunks, send_digests
+from webapp.caching import get_cache
+from webapp.extensions import admin, rest_api, mail
+
+
+class DigestTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Bug workarounds: Flask Admin和Flask Restful扩展中，
+        # 它们会为应用生成蓝图对象并在内部保存起来，但在应用销毁时不会主动将其移除。
+        admin._views = []
+        rest_api.resources = []
+
+        self.app = create_app('test')
+        # 链接由SITE_URL生成，与SERVER_NAME无关
+        self.app.config['SERVER_NAME'] = None
+        self.app.config['SITE_URL'] = 'http://blog.example.com'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        db.app = self.app
+        db.create_all()
+
+        self.start, self.end = week_range(datetime.datetime(2018, 3, 7, 12))
+        self.alice = self.add_user('alice')
+        self.bob = self.add_user('bob')
+        self.reader = self.add_user('reader')
+        self.fan = self.add_user('fan')
+        self.pending = self.add_user('pending', confirmed=False)
+        self.idle = self.add_user('idle')
+        for user in (self.reader, self.pending):
+            user.follow(self.alice)
+        self.fan.follow(self.alice)
+        self.fan.follow(self.bob)
+        self.idle.follow(self.reader)
+        db.session.commit()
+
+        self.add_post(self.alice, 'alice old', -1)
+        self.add_post(self.alice, 'alice 1', 1)
+        self.add_post(self.alice, 'alice 2', 3)
+        self.add_post(self.bob, 'bob 1', 2)
+        self.add_post(self.bob, 'bob next', 8)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_user(self, username, confirmed=True):
+        user = User(username)
+        user.email = '%s@example.com' % username
+        user.confirmed = confirmed
+        db.session.add(user)
+        db.session.commit()
+        return user
+
+    def add_post(self, user, title, days):
+        p = Post(title)
+        p.text = u'**%s** body' % title
+        p.publish_date = self.start + datetime.timedelta(days=days)
+        p.user = user
+        db.session.add(p)
+        db.session.commit()
+        return p
+
+    def test_week_range(self):
+        self.assertEqual(self.start, datetime.datetime(2018, 3, 5))
+        self.assertEqual(self.end, datetime.datetime(2018, 3, 12))
+        # 周日属于同一周，下周一属于下一周
+        self.assertEqual(week_range(datetime.datetime(2018, 3, 11, 23))[0],
+                         self.start)
+        self.assertEqual(week_range(self.end)[0], self.end)
+
+    def test_build_digest(self):
+        self.app.config['DIGEST_BATCH_SIZE'] = 1
+        authors = build_digest(self.start, self.end)
+        self.assertEqual(sorted(authors), [self.alice.id, self.bob.id])
+        self.assertEqual([p['title'] for p in authors[self.alice.id]],
+                         ['alice 1', 'alice 2'])
+        post = authors[self.bob.id][0]
+        self.assertEqual(post['excerpt'], u'<p><strong>bob 1</strong> body</p>')
+        self.assertTrue(post['url'].startswith('http://blog.example.com/'))
+        # 结果保存在缓存中，子任务不需要重新查询
+        self.assertEqual(
+            get_cache().get('digest:%s' % self.start.date().isoformat()),
+            authors)
+
+    def test_load_digest_rebuilds_missing(self):
+        authors = load_digest(self.start)
+        self.assertEqual(sorted(authors), [self.alice.id, self.bob.id])
+
+    def test_recipient_chunks(self):
+        chunks = list(recipient_chunks(self.start, self.end, chunk_size=1))
+        # 未确认email的用户、关注的人本周没有文章的用户不在其中
+        self.assertEqual(chunks, [[self.reader.id], [self.fan.id]])
+        self.assertEqual(list(recipient_chunks(self.start, self.end)),
+                         [[self.reader.id, self.fan.id]])
+
+    def test_send_digests(self):
+        build_digest(self.start, self.end)
+        with mail.record_messages() as outbox:
+            sent = send_digests(self.start, [self.reader.id, self.fan.id,
+                                             self.pending.id, self.idle.id])
+        self.assertEqual(sent, 2)
+        self.assertEqual([m.recipients for m in outbox],
+                         [['reader@example.com'], ['fan@example.com']])
+        # 每个人只收到关注的作者的文章，新的在前
+        self.assertIn('alice 2', outbox[0].body)
+        self.assertNotIn('bob 1', outbox[0].body)
+        body = outbox[1].body
+        self.assertTrue(body.index('alice 2') < body.index('bob 1') <
+                        body.index('alice 1'))
+        self.assertNotIn('alice old', body)
+        self.assertNotIn('bob next', body)
+        self.assertIn('http://blog.example.com/', outbox[1].html)
+
+    def test_send_failure_reports_remaining(self):
+        build_digest(self.start, self.end)
+        original = flask_mail.Connection.send
+        calls = []
+
+        def send(conn, message, envelope_from=None):
+            calls.append(message)
+            if len(calls) == 2:
+                raise IOError('connection lost')
+            return original(conn, message, envelope_from)
+
+        flask_mail.Connection.send = send
+        try:
+            with self.assertRaises(DigestError) as cm:
+                send_digests(self.start, [self.reader.id, self.fan.id])
+        finally:
+            flask_mail.Connection.send = original
+        self.assertEqual(cm.exception.remaining, [self.fan.id])
+
+        # 重试时只发给还没有收到的收件人
+        with mail.record_messages() as outbox:
+            self.assertEqual(send_digests(self.start,
+                                          [self.reader.id, self.fan.id]), 1)
+        self.assertEqual(outbox[0].recipients, ['fan@example.com'])
+
+    def test_send_digests_once_per_week(self):
+        build_digest(self.start, self.end)
+        send_digests(self.start, [self.reader.id])
+        with mail.record_messages() as outbox:
+            sent = send_digests(self.start, [self.reader.id, self.fan.id])
+            self.assertEqual(send_digests(self.start, [self.fan.id]), 0)
+        self.assertEqual(sent, 1)
+        self.assertEqual([m.recipients for m in outbox], [['fan@example.com']])
+        self.assertEqual(DigestDelivery.query.count(), 2)
+
+        # 下一周重新发送
+        start, end = week_range(self.end)
+        self.add_post(self.alice, 'alice later', 9)
+        build_digest(start, end)
+        with mail.record_messages() as outbox:
+            self.assertEqual(send_digests(start, [self.reader.id]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import unittest
+import asyncore
+import Queue
+import smtpd
+import socket
+import threading
+import time
+from flask_mail import Message
+from webapp import create_app
+from webapp.email import send_email
+from webapp.extensions import admin, rest_api, mail
+
+
+class CountingSMTPServer(smtpd.SMTPServer):
+    """本地的SMTP服务器，记录收到的邮件和建立的连接数"""
+
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.port = self.socket.getsockname()[1]
+        self.messages = []
+        self.connections = 0
+
+    def handle_accept(self):
+        self.connections += 1
+        smtpd.SMTPServer.handle_accept(self)
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.messages.append((rcpttos, data))
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+class EmailTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Bug workarounds: Flask Admin和Flask Restful扩展中，
+        # 它们会为应用生成蓝图对象并在内部保存起来，但在应用销毁时不会主动将其移除。
+        admin._views = []
+        rest_api.resources = []
+
+        self.app = create_app('test')
+        self.app.config.update(MAIL_QUEUE_WORKERS=2, MAIL_IDLE_TIMEOUT=0.5,
+                               MAIL_RETRY_DELAY=0.01, MAIL_MAX_RETRIES=2)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        self.server = CountingSMTPServer()
+        self.loop = threading.Thread(
+            target=asyncore.loop, kwargs={'timeout': 0.05,
+                                          'map': asyncore.socket_map})
+        self.loop.daemon = True
+        self.loop.start()
+        # 测试时Flask-Mail默认不真正发送，这里改为发送到本地的服务器
+        state = self.app.extensions['mail']
+        state.suppress = False
+        state.server = '127.0.0.1'
+        state.port = self.server.port
+        state.username = state.password = None
+        self.queue = self.app.extensions['mail_queue']
+
+    def tearDown(self):
+        self.queue.close()
+        self.server.close()
+        self.loop.join(1)
+        self.app_context.pop()
+
+    def send(self, count):
+        for i in range(count):
+            send_email('user%d@example.com' % i, 'Confirm Your Account',
+                       'auth/email/confirm', user={'username': 'u%d' % i},
+                       token='token')
+
+    def test_queue_reuses_connections(self):
+        self.send(20)
+        self.assertTrue(wait_until(lambda: len(self.server.messages) == 20))
+        self.assertEqual(self.queue.sent, 20)
+        # 每个线程只建立了一个SMTP连接
+        self.assertLessEqual(self.server.connections, 2)
+        self.assertEqual(sorted(to for to, data in self.server.messages),
+                         sorted([['user%d@example.com' % i]
+                                 for i in range(20)]))
+        self.assertIn('u3', ''.join(data for to, data in self.server.messages))
+
+    def test_batch_size_limits_connection_reuse(self):
+        self.app.config.update(MAIL_QUEUE_WORKERS=1, MAIL_BATCH_SIZE=5)
+        self.send(12)
+        self.assertTrue(wait_until(lambda: len(self.server.messages) == 12))
+        self.assertEqual(self.server.connections, 3)
+
+    def test_full_queue_after_batch(self):
+        self.app.config['MAIL_BATCH_SIZE'] = 1
+        self.queue._queue = Queue.Queue(1)
+        sender = self.app.config['MAIL_SENDER']
+        first = Message('first', sender=sender, recipients=['a@example.com'])
+        second = Message('second', sender=sender,
+                         recipients=['b@example.com'])
+        self.queue._queue.put((first, 0))
+        item = self.queue._queue.get()
+        self.queue._queue.put((second, 0))
+        take = self.queue._take
+
+        def take_and_refill(timeout):
+            # 取出一封后请求线程马上又把队列填满
+            item = take(timeout)
+            self.queue._queue.put_nowait((second, 0))
+            return item
+        self.queue._take = take_and_refill
+
+        def deliver():
+            with self.app.app_context():
+                self.queue._deliver(item)
+        worker = threading.Thread(target=deliver)
+        worker.daemon = True
+        worker.start()
+        worker.join(2)
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(self.queue.sent, 1)
+        self.assertEqual(self.queue._queue.qsize(), 1)
+
+    def test_retry_then_give_up(self):
+        # 连接一个没有监听的端口，每次都失败
+        self.app.logger.disabled = True
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        self.app.extensions['mail'].port = sock.getsockname()[1]
+        sock.close()
+        self.send(1)
+        self.assertTrue(wait_until(lambda: self.queue.failed == 1))
+        self.assertEqual(self.queue.sent, 0)
+
+    def test_send_inline(self):
+        self.app.config['MAIL_QUEUE_WORKERS'] = 0
+        self.app.extensions['mail'].suppress = True
+        with mail.record_messages() as outbox:
+            self.send(1)
+            self.assertEqual(len(outbox), 1)
+            self.assertEqual(outbox[0].recipients, ['user0@example.com'])
+
+
+if __name__ == '__main__':
+    unittest.main()
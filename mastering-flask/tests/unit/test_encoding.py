@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import unittest
+import datetime
+import json
+from flask import jsonify
+from webapp import create_app
+from webapp.models import db, User, Post
+from webapp.encoding import dumps, load_backend, list_response
+from webapp.extensions import admin, rest_api
+
+
+class EncodingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Bug workarounds: Flask Admin和Flask Restful扩展中，
+        # 它们会为应用生成蓝图对象并在内部保存起来，但在应用销毁时不会主动将其移除。
+        admin._views = []
+        rest_api.resources = []
+
+        self.app = create_app('test')
+        self.app.config['JSON_BACKEND'] = 'json'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+
+        db.app = self.app
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_compatible_with_jsonify(self):
+        data = {'date': datetime.datetime(2018, 1, 2, 3, 4, 5),
+                'text': u'中文', 'list': [1, None, True, 1.5]}
+        with self.app.test_request_context('/'):
+            expected = json.loads(jsonify(data).get_data())
+            encoded = dumps(data)
+        # 紧凑输出：不缩进，分隔符后面没有空格
+        self.assertNotIn('\n', encoded)
+        self.assertNotIn('": ', encoded)
+        self.assertNotIn(', ', encoded.replace('Tue, 02', ''))
+        self.assertEqual(json.loads(encoded), expected)
+        self.assertEqual(expected['date'], 'Tue, 02 Jan 2018 03:04:05 GMT')
+
+    def test_unavailable_backend(self):
+        self.assertEqual(load_backend('json')[0], 'json')
+        self.assertRaises(KeyError, load_backend, 'nonexistent')
+
+    def test_streaming_list(self):
+        u = User('author')
+        for i in range(5):
+            p = Post('post %d' % i)
+            p.text = 'text'
+            p.publish_date = datetime.datetime(2018, 1, 1, 0, i)
+            p.user = u
+            db.session.add(p)
+        db.session.commit()
+        posts = Post.query.order_by(Post.id).all()
+
+        results = []
+        for threshold in (0, 3):
+            self.app.config['JSON_STREAM_MIN_ITEMS'] = threshold
+            with self.app.test_request_context('/'):
+                response = list_response('posts', posts, {'count': 5})
+                self.assertEqual(response.is_streamed, bool(threshold))
+                results.append(json.loads(response.get_data()))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(len(results[0]['posts']), 5)
+
+    def test_api_responses_are_compact(self):
+        response = self.client.get('/api/v1.0/posts/', headers={
+            'Authorization': 'Basic Og=='})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(': ', response.data)
+        self.assertEqual(response.mimetype, 'application/json')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import unittest
+import csv
+import datetime
+import json
+from webapp import create_app
+from webapp.models import db, User, Post, Comment
+from webapp.export import export, parse_since
+from webapp.extensions import admin, rest_api
+
+
+class ExportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Bug workarounds: Flask Admin和Flask Restful扩展中，
+        # 它们会为应用生成蓝图对象并在内部保存起来，但在应用销毁时不会主动将其移除。
+        admin._views = []
+        rest_api.resources = []
+
+        self.app = create_app('test')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+
+        db.app = self.app
+        db.create_all()
+
+        self.u1 = User('alice')
+        self.u2 = User('bob')
+        start = datetime.datetime(2018, 1, 1)
+        for i in range(5):
+            p = Post(u'文章 %d' % i)
+            p.text = 'text, "quoted"\nline %d' % i
+            p.publish_date = start + datetime.timedelta(days=i)
+            p.user = self.u1
+            db.session.add(p)
+        db.session.flush()
+        post = Post.query.first()
+        for i, disabled in enumerate((False, True, False)):
+            c = Comment('reader %d' % i)
+            c.text = 'comment %d' % i
+            c.post = post
+            c.disabled = disabled
+            db.session.add(c)
+        self.u1.follow(self.u2)
+        self.u2.follow(self.u1)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def ndjson(self, kind, **kwargs):
+        return [json.loads(line) for line in export(kind, **kwargs)]
+
+    def test_ndjson_batches(self):
+        # 每批2行，5篇文章要分3批读取
+        posts = self.ndjson('posts', batch_size=2)
+        self.assertEqual([p['id'] for p in posts], [1, 2, 3, 4, 5])
+        self.assertEqual(posts[0]['title'], u'文章 0')
+        self.assertEqual(posts[0]['publish_date'], '2018-01-01T00:00:00')
+
+        users = self.ndjson('users', batch_size=1)
+        self.assertEqual([u['username'] for u in users], ['alice', 'bob'])
+        self.assertNotIn('email', users[0])
+        self.assertNotIn('password_hash', users[0])
+
+        # 关注关系的主键是两列
+        follows = self.ndjson('follows', batch_size=1)
+        self.assertEqual(sorted((f['follower_id'], f['following_id'])
+                                for f in follows), [(1, 2), (2, 1)])
+
+    def test_hidden_comments_are_skipped(self):
+        comments = self.ndjson('comments', batch_size=1)
+        self.assertEqual([c['text'] for c in comments],
+                         ['comment 0', 'comment 2'])
+
+    def test_since(self):
+        posts = self.ndjson('posts', since=parse_since('2018-01-03'))
+        self.assertEqual([p['id'] for p in posts], [3, 4, 5])
+        self.assertRaises(ValueError, parse_since, 'yesterday')
+
+    def test_csv(self):
+        rows = list(csv.reader(''.join(export('posts', 'csv')).splitlines(True)))
+        self.assertEqual(rows[0][:3], ['id', 'title', 'text'])
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[1][1].decode('utf-8'), u'文章 0')
+        self.assertEqual(rows[1][2], 'text, "quoted"\nline 0')
+
+    def test_endpoint_streams(self):
+        headers = {'Authorization': 'Basic Og=='}
+        response = self.client.get('/api/v1.0/export/posts?since=2018-01-04',
+                                   headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.get_data().splitlines()
+        self.assertEqual([json.loads(l)['id'] for l in lines], [4, 5])
+
+        response = self.client.get('/api/v1.0/export/follows?format=csv',
+                                   headers=headers)
+        self.assertEqual(response.mimetype, 'text/csv')
+        self.assertEqual(len(response.get_data().splitlines()), 3)
+
+        for url in ('/api/v1.0/export/passwords',
+                    '/api/v1.0/export/posts?format=xml',
+                    '/api/v1.0/export/posts?since=soon'):
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+import unittest
+import json
+from base64 import b64encode
+from sqlalchemy import event
+from webapp import create_app
+from webapp.models import db, User, Post, Comment, Role, check_counters
+from webapp.moderation import moderate, disable_user_comments
+from webapp.search import search
+from webapp.pagecache import validators, post_tag, comment_tag
+from webapp.controllers.admin.forms import ModerationForm
+from webapp.extensions import admin, rest_api
+
+
+class ModerationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Bug workarounds: Flask Admin和Flask Restful扩展中，
+        # 它们会为应用生成蓝图对象并在内部保存起来，但在应用销毁时不会主动将其移除。
+        admin._views = []
+        rest_api.resources = []
+
+        self.app = create_app('test')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+
+        db.app = self.app
+        db.create_all()
+
+        self.admin = self.add_user('boss')
+        self.admin.roles.append(Role('admin'))
+        self.spammer = self.add_user('spammer')
+        self.reader = self.add_user('reader')
+        self.post1 = Post('first')
+        self.post2 = Post('second')
+        for post in (self.post1, self.post2):
+            post.text = 'body'
+            post.user = self.admin
+        db.session.add_all([self.post1, self.post2])
+        self.spam = [self.add_comment(self.spammer, post, 'Buy CHEAP pills %d' % i)
+                     for i, post in enumerate([self.post1, self.post1,
+                                               self.post2])]
+        self.good = self.add_comment(self.reader, self.post1, 'nice post')
+        self.odd = self.add_comment(self.reader, self.post2, '100% _cheap_')
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_user(self, username):
+        user = User(username)
+        user.email = '%s@example.com' % username
+        user.password = 'cat'
+        user.confirmed = True
+        db.session.add(user)
+        return user
+
+    def add_comment(self, user, post, text):
+        comment = Comment('title')
+        comment.text = text
+        comment.user = user
+        comment.post = post
+        db.session.add(comment)
+        return comment
+
+    def assertCountersConsistent(self):
+        self.assertEqual(set(check_counters().values()), set([0]))
+
+    def post_json(self, url, data, username='boss'):
+        return self.client.post(url, data=json.dumps(data), headers={
+            'Authorization': 'Basic ' + b64encode(username + ':cat'),
+            'Content-Type': 'application/json'})
+
+    def test_disable_and_enable_by_pattern(self):
+        etag = validators(post_tag(self.post1.id)).etag
+        self.assertEqual(moderate('disable', pattern='cheap pills'), 3)
+        db.session.commit()
+        self.assertEqual([c.disabled for c in self.spam], [True] * 3)
+        self.assertFalse(self.good.disabled)
+        self.assertEqual(self.post1.comment_count, 1)
+        self.assertEqual(self.spammer.comment_count, 0)
+        self.assertCountersConsistent()
+        self.assertNotEqual(validators(post_tag(self.post1.id)).etag, etag)
+        self.assertEqual(search('pills', 1, 10).total, 0)
+
+        # 已经处于目标状态的评论不重复计数
+        self.assertEqual(moderate('disable', user_id=self.spammer.id), 0)
+        self.assertEqual(moderate('enable', ids=[self.spam[0].id,
+                                                 self.good.id]), 1)
+        db.session.commit()
+        self.assertEqual(self.post1.comment_count, 2)
+        self.assertCountersConsistent()
+        self.assertEqual(search('pills', 1, 10).total, 1)
+
+    def test_pattern_wildcards_are_literal(self):
+        self.assertEqual(moderate('disable', pattern='0% _c'), 1)
+        db.session.commit()
+        self.assertTrue(self.odd.disabled)
+
+    def test_combined_conditions_and_delete(self):
+        etag = validators(comment_tag(self.spam[2].id)).etag
+        self.assertEqual(moderate('delete', user_id=self.spammer.id,
+                                  post_id=self.post2.id), 1)
+        db.session.commit()
+        self.assertIsNone(Comment.query.get(self.spam[2].id))
+        self.assertEqual(self.post2.comment_count, 1)
+        self.assertEqual(self.spammer.comment_count, 2)
+        self.assertCountersConsistent()
+        self.assertNotEqual(validators(comment_tag(self.spam[2].id)).etag,
+                            etag)
+
+        # 删除被查禁的评论不改变计数
+        moderate('disable', ids=[self.good.id])
+        moderate('delete', ids=[self.good.id])
+        db.session.commit()
+        self.assertEqual(self.post1.comment_count, 2)
+        self.assertCountersConsistent()
+
+    def test_concurrent_change(self):
+        taken = self.spam[0]
+        done = []
+
+        def disable_elsewhere(conn, cursor, statement, parameters, context,
+                              executemany):
+            # 查询评论之后、修改之前，另一个事务已经查禁了其中一条评论
+            if statement.startswith('SELECT comments.id') and not done:
+                done.append(True)
+                raw = conn.connection.cursor()
+                raw.execute('UPDATE comments SET disabled = 1 WHERE id = ?',
+                            (taken.id,))
+                for table, id in (('posts', taken.post_id),
+                                  ('users', taken.user_id)):
+                    raw.execute('UPDATE %s SET comment_count = '
+                                'comment_count - 1 WHERE id = ?' % table,
+                                (id,))
+        event.listen(db.engine, 'after_cursor_execute', disable_elsewhere)
+
+        try:
+            self.assertEqual(moderate('disable', pattern='cheap'), 3)
+        finally:
+            event.remove(db.engine, 'after_cursor_execute', disable_elsewhere)
+        db.session.commit()
+        self.assertCountersConsistent()
+        self.assertEqual(self.post1.comment_count, 1)
+        self.assertEqual(self.spammer.comment_count, 0)
+
+    def test_requires_selection(self):
+        self.assertRaises(ValueError, moderate, 'disable')
+        self.assertRaises(ValueError, moderate, 'ban', ids=[1])
+
+    def test_disable_user_comments(self):
+        self.assertEqual(disable_user_comments(self.spammer.id), 3)
+        db.session.commit()
+        self.assertEqual(self.spammer.comment_count, 0)
+        self.assertEqual((self.post1.comment_count, self.post2.comment_count),
+                         (1, 1))
+        self.assertCountersConsistent()
+
+    def test_api(self):
+        response = self.post_json('/api/v1.0/comments/moderate',
+                                  {'action': 'disable', 'pattern': 'pills',
+                                   'post': self.post1.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['count'], 2)
+        self.assertEqual(self.post1.comment_count, 1)
+
+        response = self.post_json(
+            '/api/v1.0/users/%d/comments/disable' % self.spammer.id, {})
+        self.assertEqual(json.loads(response.data)['count'], 1)
+        self.assertCountersConsistent()
+
+        for data in ({'action': 'disable'}, {'action': 'ban', 'ids': [1]},
+                     {'action': 'enable', 'ids': ['1']}, []):
+            response = self.post_json('/api/v1.0/comments/moderate', data)
+            self.assertEqual(response.status_code, 400)
+        response = self.post_json('/api/v1.0/comments/moderate',
+                                  {'action': 'enable', 'ids': [1]},
+                                  username='reader')
+        self.assertEqual(response.status_code, 403)
+
+    def test_blog_views(self):
+        response = self.client.post('/auth/login', data={
+            'username_or_email': 'boss', 'password': 'cat'})
+        self.assertEqual(response.status_code, 302)
+        response = self.client.get('/blog/moderate/disable/%d' % self.good.id)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(self.good.disabled)
+        response = self.client.get('/blog/moderate/disable-user/%d'
+                                   % self.spam[0].id)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.post1.comment_count, 0)
+        self.assertCountersConsistent()
+        self.assertEqual(self.client.get('/blog/moderate/enable/999').status_code,
+                         404)
+
+    def test_admin_actions(self):
+        self.client.post('/auth/login', data={
+            'username_or_email': 'boss', 'password': 'cat'})
+        response = self.client.post('/admin/comment/action/', data={
+            'action': 'disable', 'rowid': [str(self.good.id)]})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(self.good.disabled)
+        spam_id = self.spam[2].id
+        response = self.client.post('/admin/comment/moderate/', data={
+            'action': 'delete', 'pattern': 'pills', 'user_id': '',
+            'post_id': str(self.post2.id)})
+        self.assertEqual(response.status_code, 302)
+        self.assertIsNone(Comment.query.get(spam_id))
+        # 没有任何条件时表单校验失败(测试中不能渲染Flask-Admin的页面，直接校验表单)
+        with self.app.test_request_context('/', method='POST', data={
+                'action': 'delete', 'pattern': '', 'user_id': '',
+                'post_id': ''}):
+            self.assertFalse(ModerationForm().validate())
+        self.assertEqual(Comment.query.count(), 4)
+        self.assertCountersConsistent()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import unittest
+import datetime
+from flask import url_for
+from sqlalchemy import event
+from webapp import create_app
+from webapp.models import db, User, Post, Tag, Comment
+from webapp.caching import cache_is_shared
+from webapp.extensions import admin, rest_api
+
+
+class PageCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Bug workarounds: Flask Admin和Flask Restful扩展中，
+        # 它们会为应用生成蓝图对象并在内部保存起来，但在应用销毁时不会主动将其移除。
+        admin._views = []
+        rest_api.resources = []
+
+        self.app = create_app('test')
+        self.app.config['PAGE_CACHE_TIMEOUT'] = 60
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client(use_cookies=True)
+
+        db.app = self.app
+        db.create_all()
+
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self.record_statement)
+
+        self.user = User('author')
+        self.user.email = 'author@example.com'
+        self.user.password = 'author'
+        self.user.confirmed = True
+        python = Tag('python')
+        now = datetime.datetime.utcnow()
+        self.posts = []
+        for i in range(2):
+            p = Post('post %d' % i)
+            p.text = 'body of post %d' % i
+            p.publish_date = now - datetime.timedelta(minutes=i)
+            p.user = self.user
+            p.tags = [python]
+            db.session.add(p)
+            self.posts.append(p)
+        db.session.commit()
+        self.post_ids = [p.id for p in self.posts]
+        db.session.remove()
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self.record_statement)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def record_statement(self, conn, cursor, statement, parameters, context,
+                         executemany):
+        self.statements.append(statement)
+
+    def get(self, url):
+        del self.statements[:]
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.headers.get('X-Page-Cache')
+
+    def comment(self, post_id):
+        c = Comment(name='reader')
+        c.text = 'nice'
+        c.post = Post.query.get(post_id)
+        c.user = c.post.user
+        db.session.add(c)
+        db.session.commit()
+        db.session.remove()
+
+    def test_anonymous_hits_do_not_touch_the_database(self):
+        for url in (url_for('blog.home'), url_for('blog.tag', tag_name='python'),
+                    url_for('blog.user', username='author'),
+                    url_for('blog.post', post_id=self.post_ids[0])):
+            self.assertEqual(self.get(url), 'MISS')
+            self.assertEqual(self.get(url), 'HIT')
+            self.assertEqual(self.statements, [])
+        # 查询参数不同的页面分别缓存
+        self.assertEqual(self.get(url_for('blog.home', page=2)), 'MISS')
+
+    def test_invalidation_by_dependency(self):
+        first = url_for('blog.post', post_id=self.post_ids[0])
+        second = url_for('blog.post', post_id=self.post_ids[1])
+        home = url_for('blog.home')
+        for url in (first, second, home):
+            self.get(url)
+
+        # 评论只影响显示了这篇文章的页面
+        self.comment(self.post_ids[0])
+        self.assertEqual(self.get(second), 'HIT')
+        self.assertEqual(self.get(first), 'MISS')
+        self.assertIn('Comments (1)', self.client.get(first).data)
+        self.assertEqual(self.get(home), 'MISS')
+
+        # 作者资料变化时，显示作者的页面都失效
+        user = User.query.filter_by(username='author').first()
+        user.username = 'writer'
+        db.session.commit()
+        self.assertEqual(self.get(second), 'MISS')
+        self.assertIn('writer', self.client.get(second).data)
+
+        # 新文章改变了首页列表和侧边栏
+        self.get(second)
+        p = Post('post 2')
+        p.text = 'new'
+        p.publish_date = datetime.datetime.utcnow()
+        p.user = user
+        db.session.add(p)
+        db.session.commit()
+        self.assertEqual(self.get(second), 'MISS')
+        self.assertIn('post 2', self.client.get(home).data)
+
+    def test_requires_shared_cache(self):
+        # 多进程部署没有共享缓存时，其他进程看不到失效，不缓存页面
+        self.app.config['CACHE_SINGLE_PROCESS'] = False
+        url = url_for('blog.post', post_id=self.post_ids[0])
+        self.assertIsNone(self.get(url))
+        self.assertIsNone(self.get(url))
+        self.app.config['CACHE_TYPE'] = 'simple'
+        self.assertFalse(cache_is_shared())
+        self.app.config['CACHE_TYPE'] = 'redis'
+        self.assertTrue(cache_is_shared())
+
+    def test_logged_in_users_bypass_cache(self):
+        url = url_for('blog.post', post_id=self.post_ids[0])
+        self.get(url)
+        self.client.post(url_for('auth.login'), data=dict(
+            username_or_email='author', password='author'))
+        response = self.client.get(url)
+        self.assertNotIn('X-Page-Cache', response.headers)
+        self.assertIn('Edit', response.data)
+        self.client.get(url_for('auth.logout'))
+        # 登出后带有闪现消息的页面也不缓存
+        response = self.client.get(url)
+        self.assertNotIn('Edit</span>', response.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
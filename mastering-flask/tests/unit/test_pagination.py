@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import unittest
+import json
+import datetime
+from flask import url_for
+from webapp import create_app
+from webapp.models import db, User, Post
+from webapp.extensions import admin, rest_api
+from webapp.pagination import KeysetPagination, encode_cursor, decode_cursor
+
+
+class PaginationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Bug workarounds: Flask Admin和Flask Restful扩展中，
+        # 它们会为应用生成蓝图对象并在内部保存起来，但在应用销毁时不会主动将其移除。
+        admin._views = []
+        rest_api.resources = []
+
+        self.app = create_app('test')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+
+        db.app = self.app
+        db.create_all()
+
+        # 一部分文章的发布时间相同，检验排序键中的id能否区分它们
+        u = User('john')
+        u.email = 'john@example.com'
+        now = datetime.datetime.utcnow()
+        for i in range(23):
+            p = Post('post %d' % i)
+            p.text = 'body'
+            p.publish_date = now - datetime.timedelta(minutes=i // 3)
+            p.user = u
+            db.session.add(p)
+        db.session.commit()
+        self.expected = [p.id for p in Post.query.order_by(
+            Post.publish_date.desc(), Post.id.desc())]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_cursor_round_trip(self):
+        when = datetime.datetime(2018, 1, 2, 3, 4, 5, 6789)
+        token = encode_cursor('next', [when, 42])
+        self.assertEqual(decode_cursor(token, [Post.publish_date, Post.id]),
+                         ('next', [when, 42]))
+        self.assertEqual(decode_cursor('garbage', [Post.publish_date, Post.id]),
+                         (None, None))
+
+    def test_walk_forward_and_backward(self):
+        columns = [Post.publish_date, Post.id]
+        pages = []
+        cursor = None
+        while True:
+            pagination = KeysetPagination(Post.query, columns, 5, cursor=cursor,
+                                          with_total=False)
+            pages.append([p.id for p in pagination.items])
+            self.assertIsNone(pagination.total)
+            if not pagination.has_next:
+                break
+            cursor = pagination.next_cursor
+        self.assertEqual(sum(pages, []), self.expected)
+
+        # 从最后一页往回翻
+        cursor = pagination.prev_cursor
+        for page in reversed(pages[:-1]):
+            pagination = KeysetPagination(Post.query, columns, 5, cursor=cursor)
+            self.assertEqual([p.id for p in pagination.items], page)
+            cursor = pagination.prev_cursor
+        self.assertFalse(pagination.has_prev)
+
+        pagination = KeysetPagination(Post.query, columns, 5, last=True)
+        self.assertEqual([p.id for p in pagination.items], self.expected[-5:])
+
+    def test_api_cursor_links(self):
+        ids = []
+        url = url_for('api.get_posts', count=0)
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            json_response = json.loads(response.data.decode('utf-8'))
+            self.assertIsNone(json_response['count'])
+            ids.extend(int(p['url'].rsplit('/', 1)[-1])
+                       for p in json_response['posts'])
+            url = json_response['next']
+        self.assertEqual(ids, self.expected)
+
+        # 带page参数时仍然使用页码分页
+        response = self.client.get(url_for('api.get_posts', page=2))
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(json_response['count'], 23)
+        self.assertIn('page=3', json_response['next'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import unittest
+import datetime
+import time
+from flask import url_for
+from sqlalchemy import event
+from webapp import create_app
+from webapp.models import db, User, Post, Tag, Role
+from webapp.identity import load_user
+from webapp.sidebar import sidebar_data
+from webapp.extensions import admin, rest_api
+
+
+class QueryCountTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Bug workarounds: Flask Admin和Flask Restful扩展中，
+        # 它们会为应用生成蓝图对象并在内部保存起来，但在应用销毁时不会主动将其移除。
+        admin._views = []
+        rest_api.resources = []
+
+        self.app = create_app('test')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+
+        db.app = self.app
+        db.create_all()
+
+        # 记录每个请求执行的SQL语句条数
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self.record_statement)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self.record_statement)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def record_statement(self, conn, cursor, statement, parameters, context,
+                         executemany):
+        self.statements.append(statement)
+
+    def add_posts(self, count):
+        tags = [Tag('tag%d' % i) for i in range(3)]
+        now = datetime.datetime.utcnow()
+        for i in range(count):
+            # 每篇文章一个不同的作者，这样懒加载时每篇文章都会触发一次users查询
+            u = User('user%d' % i)
+            u.email = 'user%d@example.com' % i
+            p = Post('post %d' % i)
+            p.text = 'body of post %d' % i
+            p.publish_date = now - datetime.timedelta(minutes=i)
+            p.user = u
+            p.tags = tags[:i % 3 + 1]
+            db.session.add(p)
+        db.session.commit()
+        db.session.remove()
+
+    def count_statements(self, url):
+        del self.statements[:]
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(self.statements)
+
+    def test_home_query_count_is_constant(self):
+        self.add_posts(20)
+        # 先请求一次，让侧边栏数据进入缓存
+        self.count_statements(url_for('blog.home'))
+        counts = []
+        for per_page in (2, 5, 20):
+            self.app.config['PAGINATION_POST_PER_PAGE'] = per_page
+            counts.append(self.count_statements(url_for('blog.home')))
+        self.assertEqual(len(set(counts)), 1)
+
+    def test_api_posts_query_count_is_constant(self):
+        self.add_posts(20)
+        counts = []
+        for per_page in (2, 5, 20):
+            self.app.config['PAGINATION_POST_PER_PAGE'] = per_page
+            counts.append(self.count_statements(url_for('api.get_posts')))
+        self.assertEqual(len(set(counts)), 1)
+
+    def test_listing_loads_authors_and_tags(self):
+        self.add_posts(5)
+        posts = Post.listing().all()
+        del self.statements[:]
+        for post in posts:
+            post.user.username
+            [tag.title for tag in post.tags]
+        self.assertEqual(self.statements, [])
+        self.assertEqual([p.title for p in posts],
+                         ['post %d' % i for i in range(5)])
+
+    def test_sidebar_is_cached_and_invalidated(self):
+        self.add_posts(3)
+        recent, top_tags = sidebar_data()
+        self.assertEqual([p['title'] for p in recent],
+                         ['post 0', 'post 1', 'post 2'])
+        self.assertEqual(top_tags[0], {'id': 1, 'title': 'tag0', 'total': 3})
+
+        # 缓存命中时不访问数据库
+        del self.statements[:]
+        self.assertEqual(sidebar_data(), (recent, top_tags))
+        self.assertEqual(self.statements, [])
+
+        # 新文章提交后缓存失效
+        p = Post('newest')
+        p.publish_date = datetime.datetime.utcnow() + datetime.timedelta(1)
+        p.tags = [Tag.query.filter_by(title='tag2').first()]
+        db.session.add(p)
+        db.session.commit()
+        recent, top_tags = sidebar_data()
+        self.assertEqual(recent[0]['title'], 'newest')
+        self.assertEqual(top_tags[-1]['total'], 2)
+
+    def test_sidebar_expires_soon_without_shared_cache(self):
+        self.add_posts(1)
+        self.app.config.update(CACHE_SINGLE_PROCESS=False,
+                               SIDEBAR_LOCAL_CACHE_TIMEOUT=0.1)
+        self.assertEqual(len(sidebar_data()[0]), 1)
+        # 另一个进程发表的文章不会让本进程的缓存失效
+        db.engine.execute(Post.__table__.insert().values(
+            title='other', publish_date=datetime.datetime.utcnow()))
+        self.assertEqual(len(sidebar_data()[0]), 1)
+        time.sleep(0.2)
+        self.assertEqual(sidebar_data()[0][0]['title'], 'other')
+
+    def test_user_loader_is_cached_and_invalidated(self):
+        user = User('test')
+        user.confirmed = True
+        user.roles.append(Role('poster'))
+        db.session.add(user)
+        db.session.commit()
+        user_id = str(user.id)
+        # 第一次从数据库加载并写入快照
+        load_user(user_id)
+        db.session.remove()
+
+        # 快照命中时load_user和角色都不访问数据库
+        del self.statements[:]
+        user = load_user(user_id)
+        self.assertEqual(user.username, 'test')
+        self.assertTrue(user.confirmed)
+        self.assertEqual([r.name for r in user.roles], ['poster'])
+        self.assertEqual(self.statements, [])
+
+        # 还原的对象属于当前session，可以照常修改
+        user.name = 'Test'
+        user.roles.append(Role('admin'))
+        db.session.commit()
+        db.session.remove()
+        self.assertEqual(User.query.get(int(user_id)).name, 'Test')
+        db.session.remove()
+
+        # 角色变化后快照失效，重新从数据库加载
+        user = load_user(user_id)
+        self.assertEqual(sorted(r.name for r in user.roles),
+                         ['admin', 'poster'])
+        db.session.remove()
+
+        # 角色改名时，拥有该角色的用户的快照也失效
+        Role.query.filter_by(name='admin').first().name = 'administrator'
+        db.session.commit()
+        db.session.remove()
+        user = load_user(user_id)
+        self.assertEqual(sorted(r.name for r in user.roles),
+                         ['administrator', 'poster'])
+
+
+if __name__ == '__main__':
+    unittest.main()
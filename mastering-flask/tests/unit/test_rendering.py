@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+import unittest
+import json
+from webapp import create_app
+from webapp.models import db, User, Post
+from webapp.rendering import render_posts, render_html, excerpt, \
+    RENDERER_VERSION
+from webapp.extensions import admin, rest_api
+
+
+class RenderingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Bug workarounds: Flask Admin和Flask Restful扩展中，
+        # 它们会为应用生成蓝图对象并在内部保存起来，但在应用销毁时不会主动将其移除。
+        admin._views = []
+        rest_api.resources = []
+
+        self.app = create_app('test')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+
+        db.app = self.app
+        db.create_all()
+
+        self.user = User('author')
+        self.user.email = 'author@example.com'
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_post(self, text):
+        post = Post('title')
+        post.text = text
+        post.user = self.user
+        db.session.add(post)
+        db.session.commit()
+        return post
+
+    def test_plain_text_is_computed_on_save(self):
+        post = self.add_post(u'<p>Hello <b>wörld</b></p>')
+        self.assertEqual(post.text_plain, u'Hello wörld')
+        post.text = u'<i>edited</i>'
+        db.session.commit()
+        self.assertEqual(post.text_plain, u'edited')
+
+    def test_rest_api_serves_precomputed_text(self):
+        post = self.add_post(u'<p>Hello</p>')
+        # 直接修改数据库中的纯文本，接口输出这一列而不是重新解析正文
+        db.session.execute(Post.__table__.update().values(
+            text_plain=u'precomputed'))
+        db.session.commit()
+        response = self.client.get('/api/post/%d' % post.id)
+        self.assertEqual(json.loads(response.data)['text'], u'precomputed')
+        response = self.client.get('/api/post')
+        self.assertEqual(json.loads(response.data)[0]['text'], u'precomputed')
+
+    def test_render_posts(self):
+        posts = [self.add_post(u'<p>post %d</p>' % i) for i in range(5)]
+        self.add_post(None)
+        db.session.execute(Post.__table__.update().values(
+            text_plain=None, text_html=None, excerpt=None,
+            render_version=None))
+        db.session.commit()
+
+        # 迁移之前的文章没有纯文本时，接口仍然输出去掉标签后的正文
+        response = self.client.get('/api/post/%d' % posts[0].id)
+        self.assertEqual(json.loads(response.data)['text'], u'post 0')
+        # 页面也仍然显示原来的正文
+        response = self.client.get('/blog/post/%d' % posts[0].id)
+        self.assertIn('<p>post 0</p>', response.data)
+
+        self.assertEqual(render_posts(batch_size=2), 6)
+        self.assertEqual(render_posts(), 0)
+        db.session.expire_all()
+        self.assertEqual([p.text_plain for p in posts],
+                         [u'post %d' % i for i in range(5)])
+        self.assertEqual([p.render_version for p in posts],
+                         [RENDERER_VERSION] * 5)
+        # 渲染规则的版本变了，或者指定了force时重新渲染
+        self.assertEqual(render_posts(force=True), 6)
+
+    def test_render_html(self):
+        # 编辑器生成的HTML只做清理，其余的按Markdown转换
+        self.assertEqual(render_html(u'<p>a<script>b</script></p>'),
+                         u'<p>ab</p>')
+        self.assertEqual(render_html(u'Some *text*\n\n- item'),
+                         u'<p>Some <em>text</em></p>\n<ul>\n<li>item</li>\n</ul>')
+        self.assertEqual(render_html(u'<a href="x" onclick="y">link</a>'),
+                         u'<a href="x">link</a>')
+
+    def test_excerpt(self):
+        self.assertEqual(excerpt(u'<p>short &amp; sweet</p>'),
+                         u'<p>short &amp; sweet</p>')
+        html = u'<p>one <b>two three</b> four</p><p>five</p>'
+        self.assertEqual(excerpt(html, 12), u'<p>one <b>two...</b></p>')
+        self.assertEqual(excerpt(u'<p>a<br>b &amp; c d</p>', 7),
+                         u'<p>a<br>b &amp;...</p>')
+
+    def test_listing_pages_use_excerpt(self):
+        self.app.config['PAGE_CACHE_TIMEOUT'] = 0
+        post = self.add_post(u'<p>%s</p>' % (u'long text ' * 100))
+        self.assertTrue(post.excerpt.endswith(u'...</p>'))
+        response = self.client.get('/blog/')
+        self.assertIn(post.excerpt.encode('utf-8'), response.data)
+        response = self.client.get('/blog/post/%d' % post.id)
+        self.assertIn(post.text_html.encode('utf-8'), response.data)
+
+if __name__ == '__main__':
+    unittest.main()
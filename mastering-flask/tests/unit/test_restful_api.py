@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 import unittest
 import json
+import time
 from base64 import b64encode
 from flask import url_for
 from webapp import create_app
@@ -112,6 +113,46 @@ class UrlsTestCase(unittest.TestCase):
             headers=self.get_api_headers(token, ''))
         self.assertTrue(response.status_code == 200)
 
+    def test_token_revocation(self):
+        r = Role.query.filter_by(name='poster').first()
+        u = User('john')
+        u.email = 'john@example.com'
+        u.password = 'cat'
+        u.confirmed = True
+        u.roles.append(r)
+        db.session.add(u)
+        db.session.commit()
+        # 有效期不同，两个令牌也不同
+        tokens = [u.generate_auth_token(), u.generate_auth_token(60)]
+
+        # 验证过的令牌会被缓存，重复请求结果一样
+        for _ in range(2):
+            response = self.client.get(
+                url_for('api.get_posts'),
+                headers=self.get_api_headers(tokens[0], ''))
+            self.assertEqual(response.status_code, 200)
+
+        # 吊销当前令牌后不能再使用
+        response = self.client.delete(
+            url_for('api.revoke_current_token'),
+            headers=self.get_api_headers(tokens[0], ''))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(
+            url_for('api.get_posts'),
+            headers=self.get_api_headers(tokens[0], ''))
+        self.assertEqual(response.status_code, 401)
+        self.assertIsNotNone(User.verify_auth_token(tokens[1]))
+
+        # 修改密码后之前签发的令牌全部失效(iat只精确到秒，等到下一秒再修改)
+        time.sleep(1)
+        u = User.query.get(u.id)
+        u.password = 'dog'
+        db.session.commit()
+        self.assertIsNone(User.verify_auth_token(tokens[1]))
+
+        # 修改密码后立即签发的新令牌有效
+        self.assertEqual(User.verify_auth_token(u.generate_auth_token()).id, u.id)
+
     def test_anonymous(self):
         response = self.client.get(
             url_for('api.get_posts'),
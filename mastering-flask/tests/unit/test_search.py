@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import unittest
+import json
+from flask import url_for
+from webapp import create_app
+from webapp.models import db, User, Post, Tag, Comment
+from webapp.search import search, reindex, match_expression
+from webapp.extensions import admin, rest_api
+
+
+class SearchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Bug workarounds: Flask Admin和Flask Restful扩展中，
+        # 它们会为应用生成蓝图对象并在内部保存起来，但在应用销毁时不会主动将其移除。
+        admin._views = []
+        rest_api.resources = []
+
+        self.app = create_app('test')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+
+        db.app = self.app
+        db.create_all()
+
+        self.user = User('author')
+        python = Tag('python')
+        p1 = Post('Flask tips')
+        p1.text = '<p>Use the <b>application factory</b> pattern.</p>'
+        p1.tags = [python]
+        p2 = Post('Gardening')
+        p2.text = '<p>Tomatoes need sun.</p>'
+        for p in (p1, p2):
+            p.user = self.user
+            db.session.add(p)
+        db.session.commit()
+        self.p1, self.p2 = p1, p2
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def titles(self, q):
+        return [(hit.kind, hit.post.title) for hit in search(q).items]
+
+    def test_index_follows_changes(self):
+        self.assertEqual(self.titles('factory'), [('post', 'Flask tips')])
+        # HTML标签不会被索引
+        self.assertEqual(self.titles('b'), [])
+        # 标签也被索引
+        self.assertEqual(self.titles('python'), [('post', 'Flask tips')])
+
+        c = Comment(name='reader')
+        c.text = 'Tomatoes also like water'
+        c.post = self.p2
+        db.session.add(c)
+        db.session.commit()
+        self.assertEqual(sorted(self.titles('tomatoes')),
+                         [('comment', 'Gardening'), ('post', 'Gardening')])
+
+        # 查禁的评论不出现在结果中
+        c.disabled = True
+        db.session.commit()
+        self.assertEqual(self.titles('water'), [])
+
+        # 修改文章和标签后索引同步更新
+        self.p1.title = 'Django tips'
+        Tag.query.filter_by(title='python').first().title = 'snake'
+        db.session.commit()
+        self.assertEqual(self.titles('flask'), [])
+        self.assertEqual(self.titles('snake django'),
+                         [('post', 'Django tips')])
+
+        db.session.delete(self.p1)
+        db.session.commit()
+        self.assertEqual(self.titles('tips'), [])
+
+    def test_ranking_and_reindex(self):
+        p = Post('Sun')
+        p.text = 'nothing else'
+        p.user = self.user
+        db.session.add(p)
+        db.session.commit()
+        # 标题命中的排在正文命中的前面
+        self.assertEqual(self.titles('sun'),
+                         [('post', 'Sun'), ('post', 'Gardening')])
+        db.session.execute('DELETE FROM search_index')
+        db.session.commit()
+        self.assertEqual(self.titles('sun'), [])
+        self.assertEqual(reindex(batch_size=1), 3)
+        self.assertEqual(len(self.titles('sun')), 2)
+
+    def test_rows_are_addressed_by_rowid(self):
+        c = Comment(name='reader')
+        c.text = 'Water them daily'
+        c.post = self.p2
+        db.session.add(c)
+        db.session.commit()
+        rows = db.session.execute(
+            'SELECT rowid, kind, ref_id FROM search_index ORDER BY rowid')
+        self.assertEqual(sorted(rows.fetchall()), sorted([
+            (self.p1.id * 2, 'post', self.p1.id),
+            (self.p2.id * 2, 'post', self.p2.id),
+            (c.id * 2 + 1, 'comment', c.id)]))
+        # 按rowid定位，不扫描整个索引表
+        plan = db.session.execute(
+            'EXPLAIN QUERY PLAN DELETE FROM search_index WHERE rowid IN (2, 4)')
+        self.assertIn('INDEX 0:=', ' '.join(row[-1] for row in plan))
+
+        # 删除文章时它的评论也从索引中去掉
+        db.session.delete(self.p2)
+        db.session.commit()
+        self.assertEqual(self.titles('water'), [])
+        self.assertEqual(db.session.execute(
+            'SELECT count(*) FROM search_index').scalar(), 1)
+
+    def test_query_syntax_is_escaped(self):
+        self.assertEqual(match_expression('a "b" OR c*'), '"a" "b" "OR" "c"')
+        self.assertEqual(self.titles('"flask'), [('post', 'Flask tips')])
+        self.assertEqual(self.titles('  '), [])
+
+    def test_search_views(self):
+        response = self.client.get(url_for('blog.search', q='factory'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('<mark>factory</mark>', response.data)
+
+        response = self.client.get(url_for('api.search', q='sun'))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(data['results'][0]['title'], 'Gardening')
+        self.assertEqual(data['results'][0]['type'], 'post')
+
+        response = self.client.get(url_for('api.search'))
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import unittest
+import datetime
+from webapp import create_app
+from webapp.models import db, User, Post, Comment, Follow, Tag, \
+    check_counters
+from webapp import seeding
+from webapp.seeding import seed_database, FAKE_PASSWORD
+from webapp.pagecache import invalidate_pages
+from webapp.rendering import RENDERER_VERSION
+from webapp.extensions import admin, rest_api
+
+
+class SeedingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Bug workarounds: Flask Admin和Flask Restful扩展中，
+        # 它们会为应用生成蓝图对象并在内部保存起来，但在应用销毁时不会主动将其移除。
+        admin._views = []
+        rest_api.resources = []
+
+        self.app = create_app('test')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        db.app = self.app
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def seed(self):
+        return seed_database(users=20, tags=5, posts=50, comments=100,
+                             follows=3, seed=42, batch_size=7,
+                             end=datetime.datetime(2018, 1, 1))
+
+    def snapshot(self):
+        return (
+            [(p.id, p.title, p.user_id, p.publish_date,
+              sorted(t.id for t in p.tags)) for p in Post.query.order_by('id')],
+            [(c.post_id, c.user_id, c.date) for c in Comment.query.order_by('id')],
+            sorted((f.follower_id, f.following_id) for f in Follow.query)
+        )
+
+    def test_seed_database(self):
+        result = self.seed()
+        self.assertEqual(result['users'], 20)
+        self.assertEqual(User.query.count(), 20)
+        self.assertEqual(Tag.query.count(), 5)
+        self.assertEqual(Post.query.count(), 50)
+        self.assertEqual(Comment.query.count(), 100)
+        self.assertEqual(Follow.query.count(), result['follows'])
+        # 冗余计数在生成时已经统计好
+        self.assertFalse(any(check_counters().values()))
+        # 评论都在文章发布之后
+        for c in Comment.query:
+            self.assertGreaterEqual(c.date, c.post.publish_date)
+        # 正文已经预先渲染
+        self.assertEqual(Post.query.filter(
+            Post.render_version == RENDERER_VERSION).count(), 50)
+
+        admin_user = User.query.filter_by(username='admin').first()
+        self.assertTrue(admin_user.check_password('admin'))
+        self.assertEqual(sorted(r.name for r in admin_user.roles),
+                         ['admin', 'default', 'poster'])
+        fake = User.query.filter_by(username='user10').first()
+        self.assertTrue(fake.check_password(FAKE_PASSWORD))
+
+    def test_same_seed_same_data(self):
+        self.seed()
+        first = self.snapshot()
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        self.seed()
+        self.assertEqual(self.snapshot(), first)
+
+    def test_seed_again(self):
+        # 相同的种子生成相同的标签标题，再次运行时使用已有的标签
+        self.seed()
+        result = self.seed()
+        self.assertEqual(result['tags'], 0)
+        self.assertEqual(Tag.query.count(), 5)
+        self.assertEqual(User.query.count(), 40)
+        self.assertEqual(Post.query.count(), 100)
+        self.assertTrue(all(p.tags for p in Post.query))
+        self.assertFalse(any(check_counters().values()))
+
+    def test_cache_unavailable(self):
+        def unreachable(*tags):
+            raise IOError('cache unavailable')
+        self.app.logger.disabled = True
+        seeding.invalidate_pages = unreachable
+        try:
+            result = self.seed()
+        finally:
+            seeding.invalidate_pages = invalidate_pages
+        # 数据已经写入，缓存出错不影响返回结果
+        self.assertEqual(result['posts'], 50)
+        self.assertEqual(Post.query.count(), 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
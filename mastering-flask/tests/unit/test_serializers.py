@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import unittest
+from flask import url_for
+from webapp import create_app
+from webapp.models import Post, Comment
+from webapp.serializers import external_url
+from webapp.extensions import admin, rest_api
+
+
+class SerializerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Bug workarounds: Flask Admin和Flask Restful扩展中，
+        # 它们会为应用生成蓝图对象并在内部保存起来，但在应用销毁时不会主动将其移除。
+        admin._views = []
+        rest_api.resources = []
+
+        self.app = create_app('test')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    def test_urls_match_url_for(self):
+        for host in ('localhost', 'example.com:8080'):
+            with self.app.test_request_context(
+                    '/', base_url='https://%s/prefix' % host):
+                for endpoint in ('api.get_post', 'api.get_user',
+                                 'api.get_post_comments', 'api.get_comment'):
+                    for id in (1, 42, 1234567):
+                        self.assertEqual(
+                            external_url(endpoint, id),
+                            url_for(endpoint, id=id, _external=True))
+
+    def test_to_json_links(self):
+        post = Post('title')
+        post.id = 3
+        post.user_id = 7
+        comment = Comment(name='name')
+        comment.id = 5
+        comment.post_id = 3
+        comment.user_id = 7
+        with self.app.test_request_context('/'):
+            data = post.to_json()
+            self.assertEqual(data['url'], url_for(
+                'api.get_post', id=3, _external=True))
+            self.assertEqual(data['author'], url_for(
+                'api.get_user', id=7, _external=True))
+            self.assertEqual(comment.to_json()['post'], data['url'])
+
+
+if __name__ == '__main__':
+    unittest.main()
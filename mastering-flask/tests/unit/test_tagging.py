@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import unittest
+import json
+from webapp import create_app
+from webapp.models import db, User, Post, Tag, posts_tags_table
+from webapp.tagging import resolve_tags, add_tags
+from webapp.extensions import admin, rest_api
+
+
+class TaggingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Bug workarounds: Flask Admin和Flask Restful扩展中，
+        # 它们会为应用生成蓝图对象并在内部保存起来，但在应用销毁时不会主动将其移除。
+        admin._views = []
+        rest_api.resources = []
+
+        self.app = create_app('test')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+
+        db.app = self.app
+        db.create_all()
+
+        self.user = User('author')
+        self.user.password = 'secret'
+        db.session.add(self.user)
+        db.session.add(Tag('python'))
+        db.session.commit()
+        self.token = self.user.generate_auth_token(3600)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_resolve_tags(self):
+        tags = resolve_tags([u'flask', u' python', u'flask', u'', u'中文'])
+        self.assertEqual([t.title for t in tags], [u'flask', u'python', u'中文'])
+        self.assertEqual(tags[1].id, 1)
+        self.assertTrue(all(t.id for t in tags))
+        db.session.commit()
+        self.assertEqual(Tag.query.count(), 3)
+        # 再次解析时不会创建新的标签
+        self.assertEqual([t.id for t in resolve_tags(['flask', 'python'])],
+                         [tags[0].id, tags[1].id])
+        self.assertEqual(Tag.query.count(), 3)
+
+    def test_title_is_unique(self):
+        # 另一个请求已经写入的标签被忽略，不会违反唯一索引
+        db.session.execute(Tag.__table__.insert().values(title='race'))
+        self.assertEqual([t.title for t in resolve_tags(['race', 'python'])],
+                         ['race', 'python'])
+        self.assertEqual(Tag.query.filter_by(title='race').count(), 1)
+        db.session.add(Tag('race'))
+        self.assertRaises(Exception, db.session.commit)
+        db.session.rollback()
+
+    def test_add_tags_dedupes(self):
+        post = Post('title')
+        post.user = self.user
+        add_tags(post, ['python', 'flask'])
+        db.session.add(post)
+        db.session.commit()
+        add_tags(post, ['flask', 'web', 'python'])
+        db.session.commit()
+        self.assertEqual(sorted(t.title for t in post.tags),
+                         ['flask', 'python', 'web'])
+        self.assertEqual(db.session.execute(
+            db.select([db.func.count()]).select_from(posts_tags_table)
+        ).scalar(), 3)
+
+    def test_rest_put_does_not_duplicate_tags(self):
+        response = self.client.post('/api/post', data={
+            'token': self.token, 'title': 'rest', 'text': 'body',
+            'tags': ['python', 'new', 'python']})
+        self.assertEqual(response.status_code, 201)
+        post_id = json.loads(response.data)
+        response = self.client.put('/api/post/%d' % post_id, data={
+            'token': self.token, 'tags': ['new', 'other']})
+        self.assertEqual(response.status_code, 201)
+        post = Post.query.get(post_id)
+        self.assertEqual(sorted(t.title for t in post.tags),
+                         ['new', 'other', 'python'])
+
+    def test_batch_create(self):
+        response = self.client.post(
+            '/api/post/batch', content_type='application/json',
+            data=json.dumps({'token': self.token, 'posts': [
+                {'title': 'one', 'text': '<p>1</p>', 'tags': ['python', 'a']},
+                {'title': 'two', 'text': '<p>2</p>', 'tags': ['a', 'b', 'a']},
+                {'title': 'three', 'text': '<p>3</p>'}
+            ]}))
+        self.assertEqual(response.status_code, 201)
+        ids = json.loads(response.data)
+        self.assertEqual(len(ids), 3)
+        posts = [Post.query.get(id) for id in ids]
+        self.assertEqual([sorted(t.title for t in p.tags) for p in posts],
+                         [['a', 'python'], ['a', 'b'], []])
+        self.assertEqual(Tag.query.count(), 3)
+        self.assertEqual(self.user.post_count, 3)
+
+        for posts in ([], [{'title': 'no text'}], [{'title': 't', 'text': 'x',
+                                                     'tags': [1]}],
+                      [{'title': 't', 'text': 'x'}] * 101):
+            response = self.client.post(
+                '/api/post/batch', content_type='application/json',
+                data=json.dumps({'token': self.token, 'posts': posts}))
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            '/api/post/batch', content_type='application/json',
+            data=json.dumps({'token': 'bad', 'posts': [
+                {'title': 't', 'text': 'x'}]}))
+        self.assertEqual(response.status_code, 401)
+
+
+if __name__ == '__main__':
+    unittest.main()
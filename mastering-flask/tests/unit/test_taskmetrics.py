@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+import unittest
+import threading
+from celery import Celery
+from celery.exceptions import Retry
+from flask import g, _app_ctx_stack
+from webapp import create_app
+from webapp.models import db
+from webapp.taskmetrics import context_task, collect, prometheus, \
+    _stamp_sent_at
+from webapp.extensions import admin, rest_api
+
+
+class TaskMetricsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Bug workarounds: Flask Admin和Flask Restful扩展中，
+        # 它们会为应用生成蓝图对象并在内部保存起来，但在应用销毁时不会主动将其移除。
+        admin._views = []
+        rest_api.resources = []
+
+        self.app = create_app('test')
+        self.app.config['TASK_METRICS_INTERVAL'] = 0
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+
+        db.app = self.app
+        db.create_all()
+
+        self.metrics = self.app.extensions['task_metrics']
+        self.celery = Celery('test', broker='memory://')
+        self.celery.Task = context_task(self.celery.Task, self.app)
+        self.contexts = []
+
+        @self.celery.task(bind=True, shared=False)
+        def work(task, x, retry=False):
+            self.contexts.append((_app_ctx_stack.top, g.get('seen')))
+            g.seen = True
+            if retry:
+                raise task.retry(countdown=1)
+            return 10 / x
+
+        self.work = work
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def stats(self):
+        return self.metrics.snapshot()[self.work.name]
+
+    def run_in_thread(self, *calls):
+        # 新线程中没有应用上下文，与worker的情况相同
+        def run():
+            for args in calls:
+                try:
+                    self.work(*args)
+                except Exception:
+                    pass
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+
+    def test_counts_and_timings(self):
+        self.assertEqual(self.work(5), 2)
+        self.assertRaises(ZeroDivisionError, self.work, 0)
+        self.assertRaises(Retry, self.work, 1, True)
+        stats = self.stats()
+        self.assertEqual((stats['succeeded'], stats['failed'],
+                          stats['retried']), (1, 1, 1))
+        self.assertEqual(stats['runtime'][0], 3)
+        self.assertEqual(stats['context'][0], 3)
+        # 直接调用的任务没有经过消息队列
+        self.assertEqual(stats['queue_wait'][0], 0)
+
+    def test_stamp_sent_at(self):
+        headers = {'eta': None}
+        _stamp_sent_at(headers=headers)
+        self.assertIn('sent_at', headers)
+        # 延迟执行的任务不记录排队时间
+        headers = {'eta': '2018-01-01T00:00:00'}
+        _stamp_sent_at(headers=headers)
+        self.assertNotIn('sent_at', headers)
+
+    def test_push_context_per_task(self):
+        self.run_in_thread((1,), (2,))
+        (first, seen1), (second, seen2) = self.contexts
+        self.assertIsNot(first, second)
+        self.assertEqual((seen1, seen2), (None, None))
+
+    def test_reuse_context(self):
+        self.app.config['CELERY_REUSE_APP_CONTEXT'] = True
+        self.run_in_thread((1,), (0,), (2,))
+        contexts = [ctx for ctx, seen in self.contexts]
+        self.assertIs(contexts[0], contexts[1])
+        self.assertIs(contexts[1], contexts[2])
+        # g在任务之间不共享
+        self.assertEqual([seen for ctx, seen in self.contexts],
+                         [None, None, None])
+        self.assertEqual(self.stats()['succeeded'], 2)
+
+    def test_reuse_inside_existing_context(self):
+        # 已经在应用上下文中(例如测试或eager模式)时不复用，也不影响外面的上下文
+        self.app.config['CELERY_REUSE_APP_CONTEXT'] = True
+        self.work(1)
+        self.assertIs(_app_ctx_stack.top, self.app_context)
+        self.assertIsNot(self.contexts[0][0], self.app_context)
+
+    def test_flush_collect_and_endpoint(self):
+        self.work(1)
+        self.run_in_thread((0,))
+        self.metrics.flush()
+        totals = collect()
+        self.assertEqual(totals[self.work.name]['succeeded'], 1)
+        self.assertEqual(totals[self.work.name]['failed'], 1)
+        text = prometheus(totals)
+        self.assertIn('celery_task_total{task="%s",state="failed"} 1'
+                      % self.work.name, text)
+        self.assertIn('celery_task_runtime_seconds_count{task="%s"} 2'
+                      % self.work.name, text)
+
+        response = self.client.get('/api/v1.0/metrics/tasks',
+                                   headers={'Authorization': 'Basic Og=='})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        self.assertIn('state="succeeded"} 1', response.get_data(as_text=True))
+
+    def test_requires_shared_cache(self):
+        # worker的指标写在进程内缓存中时Web进程看不到，报错而不是返回空的结果
+        self.app.config['CACHE_SINGLE_PROCESS'] = False
+        self.work(1)
+        self.metrics.flush()
+        self.assertRaises(RuntimeError, collect)
+        response = self.client.get('/api/v1.0/metrics/tasks',
+                                   headers={'Authorization': 'Basic Og=='})
+        self.assertEqual(response.status_code, 503)
+
+
+if __name__ == '__main__':
+    unittest.main()
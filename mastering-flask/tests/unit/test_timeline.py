@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import unittest
+import datetime
+from webapp import create_app
+from webapp.models import db, User, Post, TimelineEntry
+from webapp.timeline import rebuild_timelines
+from webapp.extensions import admin, rest_api
+
+
+class TimelineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Bug workarounds: Flask Admin和Flask Restful扩展中，
+        # 它们会为应用生成蓝图对象并在内部保存起来，但在应用销毁时不会主动将其移除。
+        admin._views = []
+        rest_api.resources = []
+
+        self.app = create_app('test')
+        self.app.config['TIMELINE_FANOUT'] = True
+        self.app.config['TIMELINE_SIZE'] = 3
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        db.app = self.app
+        db.create_all()
+
+        self.reader = User('reader')
+        self.author = User('author')
+        self.star = User('star')
+        db.session.add_all([self.reader, self.author, self.star])
+        db.session.commit()
+        self.start = datetime.datetime.utcnow()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_post(self, user, minutes):
+        p = Post('%s %d' % (user.username, minutes))
+        p.publish_date = self.start + datetime.timedelta(minutes=minutes)
+        p.user = user
+        db.session.add(p)
+        db.session.commit()
+        return p
+
+    def timeline(self, user):
+        return [p.title for p in Post.listing(user.following_posts)]
+
+    def test_fanout_backfill_and_prune(self):
+        self.add_post(self.author, 1)
+        self.reader.follow(self.author)
+        # 关注时补进已有的文章
+        self.assertEqual(self.timeline(self.reader), ['author 1'])
+
+        # 新文章写入关注者的时间线，超过TIMELINE_SIZE的旧文章被裁掉
+        for minutes in (2, 3, 4):
+            self.add_post(self.author, minutes)
+        self.assertEqual(self.timeline(self.reader),
+                         ['author 4', 'author 3', 'author 2'])
+        self.assertEqual(TimelineEntry.query.count(), 3)
+
+        # 删除文章时从时间线中删除
+        db.session.delete(Post.query.filter_by(title='author 4').first())
+        db.session.commit()
+        self.assertEqual(self.timeline(self.reader), ['author 3', 'author 2'])
+
+        self.reader.unfollow(self.author)
+        self.assertEqual(self.timeline(self.reader), [])
+        self.assertEqual(TimelineEntry.query.count(), 0)
+
+    def test_pull_merge_for_popular_authors(self):
+        self.app.config['TIMELINE_FANOUT_LIMIT'] = 0
+        self.reader.follow(self.star)
+        self.add_post(self.star, 1)
+        # 关注者太多的作者不做写扩散，读取时合并
+        self.assertEqual(TimelineEntry.query.count(), 0)
+        self.assertEqual(self.timeline(self.reader), ['star 1'])
+
+    def test_crossing_fanout_limit(self):
+        self.app.config['TIMELINE_FANOUT_LIMIT'] = 1
+        self.add_post(self.author, 1)
+        self.reader.follow(self.author)
+        # 第二个关注者超过了上限，不再做写扩散
+        self.star.follow(self.author)
+        self.add_post(self.author, 2)
+        self.assertTrue(User.query.get(self.author.id).timeline_pull)
+        self.assertEqual(TimelineEntry.query.count(), 1)
+        for user in (self.reader, self.star):
+            self.assertEqual(self.timeline(user), ['author 2', 'author 1'])
+
+        # 关注者回落到上限以内，没有写扩散的文章仍然在时间线中
+        self.star.unfollow(self.author)
+        self.assertEqual(User.query.get(self.author.id).follower_count, 1)
+        self.assertEqual(self.timeline(self.reader), ['author 2', 'author 1'])
+
+        # 重建后恢复写扩散
+        rebuild_timelines()
+        self.assertFalse(User.query.get(self.author.id).timeline_pull)
+        self.add_post(self.author, 3)
+        self.assertEqual(TimelineEntry.query.count(), 3)
+        self.assertEqual(self.timeline(self.reader),
+                         ['author 3', 'author 2', 'author 1'])
+
+    def test_matches_join_query(self):
+        self.reader.follow(self.author)
+        self.reader.follow(self.star)
+        for minutes in range(5):
+            self.add_post(self.author if minutes % 2 else self.star, minutes)
+        self.app.config['TIMELINE_SIZE'] = 10
+        rebuild_timelines()
+        materialized = self.timeline(self.reader)
+        self.app.config['TIMELINE_FANOUT'] = False
+        self.assertEqual(materialized, self.timeline(self.reader))
+
+
+if __name__ == '__main__':
+    unittest.main()
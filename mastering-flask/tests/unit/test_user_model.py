@@ -24,6 +24,7 @@ class UserModelTestCase(unittest.TestCase):
         db.create_all()
 
     def tearDown(self):
+        self.app.extensions['last_seen'].close()
         db.session.remove()
         db.drop_all()
         self.app_context.pop()
@@ -52,6 +53,38 @@ class UserModelTestCase(unittest.TestCase):
         user02.password = 'cat'
         self.assertTrue(user01.password_hash != user02.password_hash)
 
+    def test_password_success_cache(self):
+        user = User('test')
+        user.password = 'cat'
+        db.session.add(user)
+        db.session.commit()
+        service = self.app.extensions['passwords']
+        self.assertTrue(user.check_password('cat', cache=True))
+        self.assertEqual(len(service.successes), 1)
+        # 缓存中只有摘要，没有明文密码
+        self.assertNotIn('cat', list(service.successes._data)[0])
+        self.assertFalse(user.check_password('dog', cache=True))
+        self.assertEqual(len(service.successes), 1)
+        # 修改密码后旧密码的缓存不再命中
+        user.password = 'dog'
+        self.assertFalse(user.check_password('cat', cache=True))
+        self.assertTrue(user.check_password('dog', cache=True))
+
+    def test_rehash_on_login(self):
+        self.app.config['BCRYPT_LOG_ROUNDS'] = 4
+        user = User('test')
+        user.password = 'cat'
+        old_hash = user.password_hash
+        self.assertTrue(user.check_password('cat', rehash=True))
+        self.assertEqual(user.password_hash, old_hash)
+
+        self.app.config['BCRYPT_LOG_ROUNDS'] = 5
+        self.assertFalse(user.check_password('dog', rehash=True))
+        self.assertEqual(user.password_hash, old_hash)
+        self.assertTrue(user.check_password('cat', rehash=True))
+        self.assertNotEqual(user.password_hash, old_hash)
+        self.assertTrue(user.check_password('cat'))
+
     def test_valid_confirmation_token(self):
         user = User('test')
         user.password = 'cat'
@@ -188,6 +221,54 @@ class UserModelTestCase(unittest.TestCase):
         db.session.commit()
         self.assertTrue(Follow.query.count() == 0)
 
+    def test_last_seen_tracker(self):
+        u1 = User('test1')
+        u2 = User('test2')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        old = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+        u1.last_seen = u2.last_seen = old
+        db.session.commit()
+
+        tracker = self.app.extensions['last_seen']
+        tracker.flush()
+        # 访问时间只记录在内存中，不会立即写数据库
+        tracker.touch(u1.id, u1.last_seen)
+        tracker.touch(u1.id, u1.last_seen)
+        tracker.touch(u2.id, u2.last_seen)
+        db.session.expire_all()
+        self.assertEqual(u1.last_seen, old)
+
+        # 刚更新过的用户不再记录
+        tracker.touch(u1.id, datetime.datetime.utcnow())
+
+        self.assertEqual(tracker.flush(), 2)
+        db.session.expire_all()
+        self.assertTrue(u1.last_seen > old)
+        self.assertTrue(u2.last_seen > old)
+        # 缓存的用户快照中还是旧的last_seen，刚写入过的用户也不再记录
+        tracker.touch(u1.id, old)
+        self.assertEqual(tracker.flush(), 0)
+
+    def test_last_seen_flushed_in_background(self):
+        u = User('test')
+        db.session.add(u)
+        db.session.commit()
+        old = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+        u.last_seen = old
+        db.session.commit()
+
+        # 没有后续请求，也由后台线程写入数据库
+        self.app.config['LAST_SEEN_FLUSH_INTERVAL'] = 0.05
+        self.app.extensions['last_seen'].touch(u.id, u.last_seen)
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            db.session.expire_all()
+            if u.last_seen > old:
+                break
+            time.sleep(0.05)
+        self.assertTrue(u.last_seen > old)
+
 
 if __name__ == '__main__':
     unittest.main()
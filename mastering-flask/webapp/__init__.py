@@ -12,10 +12,25 @@ from .controllers.main import main_blueprint
 from .controllers.auth import auth_blueprint
 from .controllers.api_1_0 import api_blueprint
 from .controllers.rest.auth import AuthApi
-from .controllers.rest.post import PostApi
+from .controllers.rest.post import PostApi, PostBatchApi
 from .controllers.admin import CustomView, CustomModelView, PostView, \
-    CustomFileAdmin
+    CommentView, CustomFileAdmin
 from .config import config
+from .activity import LastSeenTracker
+from .passwords import PasswordService
+from .email import MailQueue
+from .taskmetrics import TaskMetrics
+from .encoding import output_json
+# 导入timeline模块，注册维护关注时间线的session事件
+from . import timeline
+# 导入identity模块，注册Flask-Login的user_loader
+from . import identity
+# 导入search模块，注册维护全文索引的session事件
+from . import search
+# 导入pagecache模块，注册让整页缓存失效的session事件
+from . import pagecache
+# 导入rendering模块，注册预先计算正文纯文本的属性事件
+from . import rendering
 
 
 def create_app(config_name):
@@ -40,6 +55,10 @@ def create_app(config_name):
     login_manager.init_app(app)
     # init Principal
     principal.init_app(app)
+    # 批量写入用户的last_seen
+    LastSeenTracker(app)
+    # 在线程池中执行bcrypt
+    PasswordService(app)
 
     @identity_loaded.connect_via(app)
     def on_identity_loaded(sender, identity):
@@ -68,11 +87,13 @@ def create_app(config_name):
     admin.init_app(app)
     admin.add_view(CustomView(name='Custom'))
 
-    models = [User, Role, Comment, Tag]
+    models = [User, Role, Tag]
     for model in models:
         admin.add_view(CustomModelView(model, db.session, category='Models'))
     # 单独处理Post model，因为我们自定了CustomModelView的自类PostView
     admin.add_view(PostView(Post, db.session, category='Models'))
+    # 评论使用批量审核的CommentView
+    admin.add_view(CommentView(Comment, db.session, category='Models'))
 
     admin.add_view(CustomFileAdmin(
         os.path.join(os.path.dirname(__file__), 'static'),
@@ -85,6 +106,10 @@ def create_app(config_name):
 
     # init Flask-Mail
     mail.init_app(app)
+    # 异步发送邮件的队列
+    MailQueue(app)
+    # Celery任务的监控指标
+    TaskMetrics(app)
 
     # init Flask-Moment
     moment.init_app(app)
@@ -92,8 +117,11 @@ def create_app(config_name):
     ############################################################################
 
     # init RestApi
+    # Flask-RESTful的JSON输出与api_1_0使用同一个编码器
+    rest_api.representations['application/json'] = output_json
     rest_api.add_resource(PostApi, '/api/post', '/api/post/<int:post_id>',
                           endpoint='api')
+    rest_api.add_resource(PostBatchApi, '/api/post/batch')
     rest_api.add_resource(AuthApi, '/api/auth')
     rest_api.init_app(app)
 
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+用户最后访问时间(last_seen)的批量写入
+
+以前每个登录用户的每次请求都会执行一次UPDATE并commit，这是整个程序最频繁的写操作，
+SQLite下所有请求都要排队等待写锁。现在请求中只在内存里记录用户的访问时间，
+同一用户在LAST_SEEN_UPDATE_INTERVAL秒内只记录一次，
+由一个后台线程每隔LAST_SEEN_FLUSH_INTERVAL秒用一条executemany的UPDATE语句
+批量写入数据库，请求线程不用等待写入，没有新请求时记录的时间也不会一直留在内存中；
+进程退出时再写入一次。
+请求中的last_seen来自缓存的用户快照(见identity模块)，批量写入不会让快照更新，
+所以这里还要记住每个用户最近一次记录的时间，快照中的旧值不会让同一用户被反复记录。
+"""
+import atexit
+import datetime
+import threading
+from flask import current_app, has_app_context
+from sqlalchemy import bindparam
+from .caching import LRUCache
+from .models import db, User
+from .pagecache import invalidate_pages, user_tag
+
+
+class LastSeenTracker(object):
+    def __init__(self, app):
+        self.app = app
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._worker = None
+        # 最近记录过访问时间的用户，LAST_SEEN_UPDATE_INTERVAL秒后过期
+        self._recent = LRUCache(app.config['LRU_CACHE_SIZE'])
+        app.extensions['last_seen'] = self
+        atexit.register(self.close)
+
+    def _start(self):
+        # 第一次记录访问时才启动线程，避免预先fork的服务器把线程带到子进程中
+        with self._lock:
+            if self._worker is not None:
+                return
+            self._worker = threading.Thread(target=self._work,
+                                            name='last-seen-flush')
+            self._worker.daemon = True
+            self._worker.start()
+
+    def _work(self):
+        interval = self.app.config['LAST_SEEN_FLUSH_INTERVAL']
+        with self.app.app_context():
+            while not self._closed.wait(interval):
+                self.flush()
+
+    def close(self, timeout=5):
+        """停止后台线程，并写入内存中剩下的访问时间"""
+        self._closed.set()
+        if self._worker is not None:
+            self._worker.join(timeout)
+        self.flush()
+
+    def touch(self, user_id, last_seen=None):
+        """记录一次访问，last_seen为数据库中已有的值，足够新时直接忽略"""
+        now = datetime.datetime.utcnow()
+        seconds = self.app.config['LAST_SEEN_UPDATE_INTERVAL']
+        if last_seen is not None and \
+                now - last_seen < datetime.timedelta(seconds=seconds):
+            return
+        if self._recent.get(user_id) is not None:
+            return
+        if seconds:
+            self._recent.set(user_id, now, timeout=seconds)
+        if self._worker is None:
+            self._start()
+        with self._lock:
+            self._pending[user_id] = now
+
+    def flush(self):
+        """把内存中合并后的访问时间写入数据库，返回写入的用户数"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        users = User.__table__
+        try:
+            # 使用独立的连接，不影响当前请求中session的事务；
+            # 也不能在这里push应用上下文，否则上下文pop时会移除请求正在使用的session
+            db.get_engine(self.app).execute(
+                users.update().where(
+                    users.c.id == bindparam('user_id')
+                ).values(last_seen=bindparam('seen')),
+                [{'user_id': k, 'seen': v} for k, v in pending.items()]
+            )
+        except Exception:
+            self.app.logger.exception('Failed to flush last_seen')
+            # 写入失败时放回去，下次再试，保留较新的时间
+            with self._lock:
+                for user_id, seen in pending.items():
+                    if self._pending.get(user_id, seen) <= seen:
+                        self._pending[user_id] = seen
+            return 0
+        # 用户资料页面和API中的last_seen随之更新
+        if has_app_context():
+            invalidate_pages(*[user_tag(id) for id in pending])
+        return len(pending)
+
+
+def touch_last_seen(user):
+    current_app.extensions['last_seen'].touch(user.id, user.last_seen)
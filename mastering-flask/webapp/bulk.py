@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+文章和评论的批量写入
+
+迁移内容时客户端以前要为每篇文章、每条评论调用一次 POST /api/v1.0/posts/ 或
+POST /api/v1.0/posts/<id>/comments/，每次都要认证、commit并序列化一遍。
+批量接口先用Post.from_json/Comment.from_json逐条校验，再用Core的INSERT
+写入所有合法的条目，和其他修改一起在同一个事务中提交。
+
+Core语句不会触发session事件，ORM写入时由事件完成的工作在这里一并处理：
+冗余计数、关注时间线、全文索引，以及事务提交后整页缓存和侧边栏的失效。
+executemany拿不到每一行的主键，而按(user_id, 时间)回查会和同一用户并发的批次、
+或只精确到秒的DATETIME混淆，所以每个条目单独执行一条INSERT，从inserted_primary_key
+取得id；一批最多API_BATCH_LIMIT条，都在同一个事务中，不需要逐条commit。
+"""
+import collections
+import datetime
+from flask import current_app
+from sqlalchemy import bindparam
+from sqlalchemy.orm.util import identity_key
+from .models import db, Post, Comment, User
+from .timeline import push_post
+from .search import index_posts, index_comments
+from .pagecache import invalidate_after_commit, post_tag, user_tag, \
+    comment_tag, POSTS, COMMENTS
+from .sidebar import invalidate_sidebar_after_commit
+
+posts = Post.__table__
+comments = Comment.__table__
+users = User.__table__
+
+# 从from_json返回的对象中取出写入的字段，渲染结果由Post.text的set事件生成
+POST_COLUMNS = ('title', 'text', 'text_plain', 'text_html', 'excerpt',
+                'render_version')
+COMMENT_COLUMNS = ('name', 'text', 'post_id')
+
+
+def _insert_rows(conn, table, rows):
+    """逐行写入rows，按顺序返回新行的id"""
+    statement = table.insert()
+    return [conn.execute(statement, row).inserted_primary_key[0]
+            for row in rows]
+
+
+def _add_counts(session, model, column, counts):
+    """给多行的计数字段加上对应的数量，并让内存中的对象重新加载这个字段"""
+    counts = dict((id, n) for id, n in counts.items() if id is not None)
+    if not counts:
+        return
+    table = model.__table__
+    session.connection().execute(
+        table.update().where(table.c.id == bindparam('_id')).values(
+            {column: table.c[column] + bindparam('_n')}),
+        [{'_id': id, '_n': n} for id, n in counts.items()])
+    for id in counts:
+        obj = session.identity_map.get(identity_key(model, id))
+        if obj is not None:
+            session.expire(obj, [column])
+
+
+def insert_posts(user_id, new_posts):
+    """写入user_id发表的多篇文章(Post.from_json返回的对象)，返回新文章的id列表"""
+    if not new_posts:
+        return []
+    session = db.session()
+    conn = session.connection()
+    now = datetime.datetime.utcnow()
+    ids = _insert_rows(conn, posts, [
+        dict(((name, getattr(post, name)) for name in POST_COLUMNS),
+             user_id=user_id, publish_date=now)
+        for post in new_posts])
+
+    _add_counts(session, User, 'post_count', {user_id: len(ids)})
+    if current_app.config['TIMELINE_FANOUT'] and user_id is not None:
+        for id in ids:
+            push_post(conn, id, user_id, now)
+    index_posts(conn, ids)
+    invalidate_after_commit(session, POSTS, *[post_tag(id) for id in ids])
+    if user_id is not None:
+        invalidate_after_commit(session, user_tag(user_id))
+    invalidate_sidebar_after_commit(session)
+    return ids
+
+
+def insert_comments(user_id, new_comments):
+    """
+    写入user_id发表的多条评论(Comment.from_json返回的对象，post_id已经设置)，
+    返回新评论的id列表
+    """
+    if not new_comments:
+        return []
+    session = db.session()
+    conn = session.connection()
+    now = datetime.datetime.utcnow()
+    ids = _insert_rows(conn, comments, [
+        dict(((name, getattr(comment, name)) for name in COMMENT_COLUMNS),
+             user_id=user_id, date=now, disabled=False)
+        for comment in new_comments])
+
+    per_post = collections.Counter(c.post_id for c in new_comments)
+    _add_counts(session, Post, 'comment_count', per_post)
+    _add_counts(session, User, 'comment_count', {user_id: len(ids)})
+    index_comments(conn, ids)
+    invalidate_after_commit(
+        session, COMMENTS, *([post_tag(id) for id in per_post] +
+                             [comment_tag(id) for id in ids]))
+    if user_id is not None:
+        invalidate_after_commit(session, user_tag(user_id))
+    return ids
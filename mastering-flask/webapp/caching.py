@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+缓存后端
+
+配置了Redis等共享缓存(CACHE_TYPE不为null)时直接使用Flask-Cache的cache对象，
+多个进程共享同一份缓存；否则退回到每个应用实例各自持有的进程内LRU缓存。
+两者都提供get/get_many/set/delete/clear接口，调用方不需要区分。
+
+整页缓存等依赖版本号失效的功能要求所有进程看到同一份缓存，否则一个进程中的修改
+只会让这个进程的缓存失效。这些功能先用cache_is_shared()检查：多进程部署时
+必须配置共享缓存，只有一个进程(CACHE_SINGLE_PROCESS)时进程内缓存也可以。
+"""
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from .extensions import cache
+
+# Flask-Cache中只在进程内保存数据的缓存类型
+LOCAL_CACHE_TYPES = ('null', 'simple')
+
+
+class LRUCache(object):
+    """
+    线程安全的进程内LRU缓存，超过maxsize时淘汰最久未使用的条目，
+    maxsize为None时不限制大小
+    """
+
+    def __init__(self, maxsize=1024, default_timeout=300):
+        self.maxsize = maxsize
+        self.default_timeout = default_timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None:
+                return None
+            expires, value = item
+            if expires and expires < time.time():
+                return None
+            # 重新插入到末尾，表示最近使用过
+            self._data[key] = item
+            return value
+
+    def get_many(self, *keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = self.default_timeout
+        expires = time.time() + timeout if timeout else 0
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expires, value)
+            while self.maxsize is not None and len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+        return True
+
+    def __len__(self):
+        return len(self._data)
+
+
+def get_cache():
+    """返回当前应用使用的缓存对象"""
+    app = current_app._get_current_object()
+    if app.config.get('CACHE_TYPE', 'null') != 'null':
+        return cache
+    lru = app.extensions.get('lru_cache')
+    if lru is None:
+        lru = app.extensions.setdefault(
+            'lru_cache', LRUCache(app.config['LRU_CACHE_SIZE']))
+    return lru
+
+
+def cache_is_shared():
+    """当前应用的所有进程是否看到同一份缓存"""
+    config = current_app.config
+    return config['CACHE_SINGLE_PROCESS'] or \
+        config.get('CACHE_TYPE', 'null') not in LOCAL_CACHE_TYPES
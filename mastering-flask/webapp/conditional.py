@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+条件请求(ETag / Last-Modified)
+
+移动客户端不停地轮询 /api/v1.0/posts/，以前每次都要重新查询、序列化整个列表。
+这里的校验值来自整页缓存使用的依赖标签(见pagecache模块)：ETag是资源依赖的
+各个标签版本号的摘要，Last-Modified是其中最近一次变化的时间。版本号在事务提交后
+由session事件更新，编辑文章、查禁评论、计数变化这些不改变publish_date的修改
+同样会让校验值改变。请求中的If-None-Match或If-Modified-Since满足时，
+视图在渲染模板或调用to_json()之前直接返回304。
+版本号不在所有进程共享的缓存中时，其他进程中的修改不会改变这个进程算出的校验值，
+这时使用NoValidators，不返回304也不发送校验值。
+同一资源对不同身份的用户返回不同内容时(例如只有管理员能看到被查禁的评论)，
+身份作为variant计入ETag，并发送Vary: Authorization。
+"""
+import datetime
+import hashlib
+from flask import current_app, request
+from werkzeug.http import http_date, is_resource_modified, quote_etag
+
+
+class Validators(object):
+    """
+    由{标签: 版本号}计算出的ETag和Last-Modified。
+    Arguments:
+        versions: 资源依赖的标签及其当前的版本号
+        times: 每个版本号产生的时间(UNIX时间戳)
+        variant: 响应内容随用户身份变化时，区分不同身份的字符串
+    """
+
+    def __init__(self, versions, times, variant=None):
+        digest = hashlib.sha1()
+        for tag in sorted(versions):
+            digest.update(('%s=%s\n' % (tag, versions[tag])).encode('utf-8'))
+        if variant is not None:
+            digest.update(('variant=%s\n' % variant).encode('utf-8'))
+        self.etag = digest.hexdigest()
+        self.variant = variant
+        self.last_modified = datetime.datetime.utcfromtimestamp(
+            max(times or [0])).replace(microsecond=0)
+
+    def is_modified(self):
+        return is_resource_modified(request.environ, self.etag,
+                                    last_modified=self.last_modified)
+
+    def not_modified(self):
+        """请求的条件满足时返回304响应，否则返回None"""
+        if self.is_modified():
+            return None
+        return self.apply(current_app.response_class(status=304))
+
+    def headers(self):
+        """校验值对应的响应头；no-cache表示客户端每次使用前都要向服务器确认"""
+        headers = {
+            'ETag': quote_etag(self.etag),
+            'Last-Modified': http_date(self.last_modified),
+            'Cache-Control': 'no-cache'
+        }
+        if self.variant is not None:
+            # 共享的缓存不能把一个用户看到的内容返回给另一个用户
+            headers['Vary'] = 'Authorization'
+        return headers
+
+    def apply(self, response):
+        for name, value in self.headers().items():
+            response.headers[name] = value
+        return response
+
+
+class NoValidators(object):
+    """无法可靠地计算校验值时使用，不返回304，也不添加响应头"""
+    etag = None
+    last_modified = None
+
+    def is_modified(self):
+        return True
+
+    def not_modified(self):
+        return None
+
+    def headers(self):
+        return {}
+
+    def apply(self, response):
+        return response
@@ -18,12 +18,67 @@ class Config(object):
     # 配置侧边栏显示最新发布的文章，以及最常用的标签的个数
     TOP_POSTS_NUM = 10
     TOP_TAGS_NUM = 10
+    # 侧边栏数据的缓存时间（秒），文章或标签变化时缓存会被立即删除
+    SIDEBAR_CACHE_TIMEOUT = 600
+    # 没有共享缓存的多进程部署中，其他进程的修改不会让本进程的侧边栏缓存失效，
+    # 这时只缓存这么多秒
+    SIDEBAR_LOCAL_CACHE_TIMEOUT = 5
+    # 匿名用户整页缓存的时间（秒），页面依赖的文章、用户等变化时立即失效，为0时不缓存
+    PAGE_CACHE_TIMEOUT = 300
+    # 没有配置Redis时使用的进程内LRU缓存的最大条目数
+    LRU_CACHE_SIZE = 1024
+    # 应用只运行在一个进程中时设为True，没有共享缓存时整页缓存、ETag和任务指标
+    # 也使用进程内缓存；多进程部署(包括单独运行的Celery worker)必须配置Redis等共享缓存，
+    # 否则整页缓存和ETag不启用，任务指标接口返回503
+    CACHE_SINGLE_PROCESS = False
+    # 同一用户的last_seen最多每隔多少秒更新一次
+    LAST_SEEN_UPDATE_INTERVAL = 60
+    # 内存中记录的last_seen每隔多少秒批量写入一次数据库
+    LAST_SEEN_FLUSH_INTERVAL = 30
+    # 关注时间线的写扩散：发表文章时把文章写入每个关注者的时间线
+    TIMELINE_FANOUT = False
+    # 关注者超过这个数目的作者不做写扩散，读取时间线时再合并他们的文章
+    TIMELINE_FANOUT_LIMIT = 1000
+    # 每个用户的时间线最多保存的文章数
+    TIMELINE_SIZE = 800
+    # 登录用户快照(id、角色等)的缓存时间（秒），角色、email等变化时快照立即失效
+    USER_CACHE_TIMEOUT = 300
+    # 进程内缓存的已验证API令牌的最大条目数
+    TOKEN_CACHE_SIZE = 4096
+    # API令牌的最长有效期（秒），按用户吊销令牌的记录保存这么久
+    TOKEN_MAX_AGE = 3600
+    # bcrypt的工作因子，修改后用户下次登录时密码会按新的工作因子重新散列
+    BCRYPT_LOG_ROUNDS = 12
+    # 执行bcrypt的线程池大小，为0时在请求线程中直接执行
+    PASSWORD_POOL_SIZE = 4
+    # 等待执行bcrypt的请求的上限，超过时返回503
+    PASSWORD_MAX_PENDING = 64
+    # 使用gevent服务器时设为True，bcrypt在gevent的线程池中执行
+    PASSWORD_POOL_GEVENT = False
+    # HTTP Basic认证成功的结果在进程内缓存的时间（秒）和最大条目数
+    PASSWORD_CACHE_TIMEOUT = 60
+    PASSWORD_CACHE_SIZE = 1024
     # 分页，每页显示的文章数
     PAGINATION_POST_PER_PAGE = 10
     # 分页，每页显示的关注者数目
     PAGINATION_FOLLOWERS_PER_PAGE = 50
     # 分页，每页显示的评论数
     PAGINATION_COMMENTS_PER_PAGE = 30
+    # 分页，每页显示的检索结果数
+    PAGINATION_SEARCH_PER_PAGE = 20
+    # 页面上的列表是否使用游标分页（不再计算总数和页码，翻到多深的页速度都一样）
+    # API的列表接口默认就使用游标分页，请求中带page参数时才使用页码分页
+    PAGINATION_USE_CURSOR = False
+
+    # API响应使用的JSON编码器：None为自动选择(orjson、ujson、标准库json)
+    JSON_BACKEND = None
+    # 列表接口的条目数不少于这个值时使用流式响应，为0时不使用
+    JSON_STREAM_MIN_ITEMS = 100
+
+    # 导出接口每次从数据库读取的行数
+    EXPORT_BATCH_SIZE = 1000
+    # 批量接口一次请求最多提交的条目数
+    API_BATCH_LIMIT = 100
 
     # Flask-Mail
     # 单元测试时需要，因此移到基类来
@@ -33,6 +88,42 @@ class Config(object):
     MAIL_PASSWORD = 'xxx'
     MAIL_SUBJECT_PREFIX = '[Blog]'
     MAIL_SENDER = 'Blog Admin <xxx@163.com>'
+    # 发送邮件的方式：'thread'为进程内的发送队列，'celery'为交给Celery的worker发送
+    MAIL_BACKEND = 'thread'
+    # 发送队列的线程数，为0时在请求线程中直接发送
+    MAIL_QUEUE_WORKERS = 2
+    # 发送队列中最多等待的邮件数
+    MAIL_QUEUE_SIZE = 1000
+    # 一个SMTP连接最多连续发送的邮件数
+    MAIL_BATCH_SIZE = 100
+    # 队列空闲这么久(秒)之后关闭SMTP连接
+    MAIL_IDLE_TIMEOUT = 1
+    # SMTP连接上每次读写的超时时间(秒)
+    MAIL_TIMEOUT = 30
+    # 发送失败后的重试次数，第n次重试之前等待 MAIL_RETRY_DELAY * 2^n 秒
+    MAIL_MAX_RETRIES = 3
+    MAIL_RETRY_DELAY = 5
+
+    # 站点的外部地址，邮件等请求之外生成的链接使用
+    SITE_URL = 'http://localhost:5000'
+    # 每周摘要：每次读取的文章数、每个子任务发送的收件人数、每次派发的子任务数
+    DIGEST_BATCH_SIZE = 500
+    DIGEST_CHUNK_SIZE = 500
+    DIGEST_GROUP_SIZE = 20
+    # 整理好的本周文章在缓存中保存的时间（秒）
+    DIGEST_CACHE_TIMEOUT = 86400
+    # 每个worker执行send_digest子任务的速率上限
+    DIGEST_RATE_LIMIT = '30/m'
+    CELERY_ANNOTATIONS = {
+        'webapp.tasks.send_digest': {'rate_limit': DIGEST_RATE_LIMIT}
+    }
+
+    # Celery任务的监控指标每隔多少秒写一次日志和缓存，为0时只在进程退出时写
+    TASK_METRICS_INTERVAL = 60
+    # 缓存中每个进程的指标保存的时间（秒），进程退出后过这么久不再计入
+    TASK_METRICS_TIMEOUT = 600
+    # worker中的任务共用一个应用上下文，不再为每个任务push/pop
+    CELERY_REUSE_APP_CONTEXT = False
 
     # Flask-SQLAlchemy
     # 启用缓慢查询记录功能
@@ -49,6 +140,13 @@ class ProductConfig(Config):
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(
         basedir, os.path.pardir, 'data-product.sqlite')
 
+    # Flask-Cache
+    # 多个进程共享的缓存，整页缓存的失效对所有进程可见
+    CACHE_TYPE = 'redis'
+    CACHE_REDIS_HOST = 'localhost'
+    CACHE_REDIS_PORT = '6379'
+    CACHE_REDIS_DB = '0'
+
     @classmethod
     def init_app(cls, app):
         Config.init_app(app)
@@ -83,10 +181,10 @@ class DevConfig(Config):
             'schedule': datetime.timedelta(seconds=30),
             'args': ("Message",)
         },
-        # 每周六上午10点执行：crontab(day_of_week=6, hour='10')
+        # 每周六上午10点执行
         'weekly-digest': {
             'task': 'webapp.tasks.digest',
-            'schedule': crontab(minute='*/1')  # test: 每一分钟执行一次
+            'schedule': crontab(day_of_week=6, hour=10, minute=0)
         },
     }
 
@@ -140,6 +238,13 @@ class TestConfig(Config):
     CACHE_TYPE = 'null'
     # 当使用的缓存类型为null时，不让抛出警告信息
     CACHE_NO_NULL_WARNING = True
+    # 测试在一个进程中运行，使用进程内缓存
+    CACHE_SINGLE_PROCESS = True
+    # 其他测试需要统计每个请求执行的查询，默认关闭整页缓存
+    PAGE_CACHE_TIMEOUT = 0
+
+    # 在请求线程中直接发送邮件
+    MAIL_QUEUE_WORKERS = 0
 
     # WTForms不进行CSRF检查
     WTF_CSRF_ENABLED = False
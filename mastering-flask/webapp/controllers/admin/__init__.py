@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
+from flask import flash, redirect, url_for
 from flask_admin import BaseView, expose
+from flask_admin.actions import action
 from flask_admin.contrib.sqla import ModelView
 from flask_admin.contrib.fileadmin import FileAdmin
 from flask_login import login_required, current_user
 from ...extensions import admin_permission
-from .forms import CKTextAreaField
+from ...models import db, Comment
+from ...moderation import moderate, disable_user_comments
+from .forms import CKTextAreaField, ModerationForm
 
 
 class CustomView(BaseView):
@@ -34,6 +38,58 @@ class PostView(CustomModelView):
     edit_template = 'admin/post_edit.html'
 
 
+class CommentView(CustomModelView):
+    """评论的批量审核：列表中选中的评论，或者按条件选出的评论"""
+    column_list = ('user', 'post', 'name', 'text', 'date', 'disabled')
+    column_searchable_list = ('text', 'name')
+    column_filters = ('disabled', 'date', 'user_id', 'post_id')
+    list_template = 'admin/comment_list.html'
+
+    def _moderate(self, action, ids):
+        count = moderate(action, ids=[int(id) for id in ids])
+        db.session.commit()
+        flash('%d comments were %sd.' % (count, action), 'success')
+
+    @action('enable', 'Enable')
+    def action_enable(self, ids):
+        self._moderate('enable', ids)
+
+    @action('disable', 'Disable')
+    def action_disable(self, ids):
+        self._moderate('disable', ids)
+
+    # 代替Flask-Admin逐条加载再删除的默认操作
+    @action('delete', 'Delete',
+            'Are you sure you want to delete selected records?')
+    def action_delete(self, ids):
+        self._moderate('delete', ids)
+
+    @action('disable_users', 'Disable all by these users',
+            'Disable every comment written by the authors of the selected '
+            'comments?')
+    def action_disable_users(self, ids):
+        user_ids = set(user_id for user_id, in db.session.query(
+            Comment.user_id).filter(Comment.id.in_([int(id) for id in ids])))
+        user_ids.discard(None)
+        count = sum(disable_user_comments(user_id) for user_id in user_ids)
+        db.session.commit()
+        flash('%d comments were disabled.' % count, 'success')
+
+    @expose('/moderate/', methods=('GET', 'POST'))
+    def moderate_view(self):
+        form = ModerationForm()
+        if form.validate_on_submit():
+            count = moderate(form.action.data,
+                             user_id=form.user_id.data,
+                             post_id=form.post_id.data,
+                             pattern=form.pattern.data or None)
+            db.session.commit()
+            flash('%d comments were %sd.' % (count, form.action.data),
+                  'success')
+            return redirect(url_for('.index_view'))
+        return self.render('admin/comment_moderate.html', form=form)
+
+
 class CustomFileAdmin(FileAdmin):
     def is_accessible(self):
         return current_user.is_authenticated and admin_permission.can()
@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
-from wtforms import TextAreaField, widgets
+from flask_wtf import FlaskForm
+from wtforms import TextAreaField, StringField, IntegerField, SelectField, \
+    widgets
+from wtforms.validators import Optional, Length, ValidationError
 
 
 class CKTextAreaWidget(widgets.TextArea):
@@ -10,3 +13,17 @@ class CKTextAreaWidget(widgets.TextArea):
 
 class CKTextAreaField(TextAreaField):
     widget = CKTextAreaWidget()
+
+
+class ModerationForm(FlaskForm):
+    action = SelectField('Action', choices=[
+        ('disable', 'Disable'), ('enable', 'Enable'), ('delete', 'Delete')])
+    user_id = IntegerField('User id', validators=[Optional()])
+    post_id = IntegerField('Post id', validators=[Optional()])
+    pattern = StringField('Text contains', validators=[Length(max=255)])
+
+    def validate_pattern(self, field):
+        # 至少要有一个条件，不能一次处理所有评论
+        if self.user_id.data is None and self.post_id.data is None \
+                and not field.data:
+            raise ValidationError('Select comments by user, post or text.')
@@ -6,5 +6,6 @@ api_blueprint = Blueprint('api', __name__,
                            url_prefix='/api/v1.0')
 
 
-from . import authentication, errors, posts, users, comments
+from . import authentication, errors, posts, users, comments, search, \
+    export, batch, metrics
 
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
-from flask import g, jsonify
+from flask import g, request
 from flask_httpauth import HTTPBasicAuth
 from ...models import User, AnonymousUser
+from ...tokens import revoke_token
+from ...encoding import json_response
 from . import api_blueprint
 from .errors import unauthorized, forbidden
 
@@ -30,7 +32,8 @@ def verify_password(username_or_token, password):
         return False
     g.current_user = user
     g.token_used = False
-    return user.check_password(password)
+    # 每个请求都带着密码，校验成功的结果会缓存一段时间
+    return user.check_password(password, cache=True)
 
 
 # Flask-HTTPAuth错误处理程序
@@ -55,5 +58,14 @@ def before_request():
 def get_token():
     if g.current_user.is_anonymous or g.token_used:
         return unauthorized('Invalid credentials')
-    return jsonify({'token': g.current_user.generate_auth_token(),
-                    'expiration': 600})
+    return json_response({'token': g.current_user.generate_auth_token(),
+                          'expiration': 600})
+
+
+# 注销：吊销本次请求使用的令牌，令牌在过期之前就不能再使用了
+@api_blueprint.route('/token', methods=['DELETE'])
+def revoke_current_token():
+    if g.current_user.is_anonymous or not g.token_used:
+        return unauthorized('Invalid credentials')
+    revoke_token(request.authorization.username)
+    return json_response({'revoked': True})
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+from flask import request, g, current_app
+from ...models import db, Post, Comment
+from ...bulk import insert_posts, insert_comments
+from ...serializers import external_url
+from ...encoding import json_response
+from ...exceptions import ValidationError
+from . import api_blueprint
+from .errors import bad_request, unauthorized
+
+
+def _batch_items():
+    """请求的主体应为1到API_BATCH_LIMIT个对象组成的数组，否则返回None"""
+    items = request.get_json(silent=True)
+    limit = current_app.config['API_BATCH_LIMIT']
+    if not isinstance(items, list) or not 0 < len(items) <= limit:
+        return None
+    return items
+
+
+def _parse(items, from_json):
+    """逐条校验，返回(合法条目的[(序号, 条目, 对象)], 每个条目的结果列表)"""
+    valid = []
+    results = [None] * len(items)
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[i] = {'status': 400, 'message': 'item is not an object'}
+            continue
+        try:
+            valid.append((i, item, from_json(item)))
+        except ValidationError as e:
+            results[i] = {'status': 400, 'message': e.args[0]}
+    return valid, results
+
+
+def _respond(results, valid, ids, endpoint):
+    # 新建资源的id按顺序对应校验通过的条目
+    for (i, item, obj), id in zip(valid, ids):
+        results[i] = {'status': 201, 'id': id,
+                      'url': external_url(endpoint, id)}
+    created = len(ids)
+    return json_response({'results': results, 'created': created},
+                         201 if created else 400)
+
+
+def _batch_error():
+    return bad_request('expected a list of 1 to %d objects'
+                       % current_app.config['API_BATCH_LIMIT'])
+
+
+# 批量发表文章：主体为文章的数组，格式与 POST /posts/ 相同
+@api_blueprint.route('/posts/batch', methods=['POST'])
+def new_posts():
+    if g.current_user.is_anonymous:
+        return unauthorized('Invalid credentials')
+    items = _batch_items()
+    if items is None:
+        return _batch_error()
+    valid, results = _parse(items, Post.from_json)
+    ids = insert_posts(g.current_user.id, [post for i, item, post in valid])
+    db.session.commit()
+    return _respond(results, valid, ids, 'api.get_post')
+
+
+def _post_id(item):
+    post_id = item.get('post_id')
+    return post_id if type(post_id) in (int, long) else None
+
+
+def _new_comments(items, post_id=None):
+    valid, results = _parse(items, Comment.from_json)
+    if post_id is None:
+        # 每条评论用post_id指定所属的文章，不存在的文章用一条IN查询找出
+        requested = set(_post_id(item) for i, item, comment in valid)
+        requested.discard(None)
+        existing = set(id for id, in db.session.query(Post.id).filter(
+            Post.id.in_(requested))) if requested else set()
+        found = []
+        for i, item, comment in valid:
+            if _post_id(item) in existing:
+                comment.post_id = _post_id(item)
+                found.append((i, item, comment))
+            else:
+                results[i] = {'status': 404, 'message': 'post not found'}
+        valid = found
+    else:
+        for i, item, comment in valid:
+            comment.post_id = post_id
+    ids = insert_comments(g.current_user.id,
+                          [comment for i, item, comment in valid])
+    db.session.commit()
+    return _respond(results, valid, ids, 'api.get_comment')
+
+
+# 批量发表某篇文章的评论：主体为评论的数组，格式与 POST /posts/<id>/comments/ 相同
+@api_blueprint.route('/posts/<int:id>/comments/batch', methods=['POST'])
+def new_post_comments(id):
+    if g.current_user.is_anonymous:
+        return unauthorized('Invalid credentials')
+    post = Post.query.get_or_404(id)
+    items = _batch_items()
+    if items is None:
+        return _batch_error()
+    return _new_comments(items, post.id)
+
+
+# 批量发表多篇文章的评论：每条评论用post_id指定所属的文章
+@api_blueprint.route('/comments/batch', methods=['POST'])
+def new_comments():
+    if g.current_user.is_anonymous:
+        return unauthorized('Invalid credentials')
+    items = _batch_items()
+    if items is None:
+        return _batch_error()
+    return _new_comments(items)
@@ -1,64 +1,84 @@
 # -*- coding: utf-8 -*-
-from flask import jsonify, request, g, url_for, current_app
-from ...models import db, Post, Comment
+from flask import request, g, url_for, current_app
+from ...models import db, Post, Comment, User
+from ...pagination import paginate
+from ...serializers import page_response
+from ...pagecache import validators, post_tag, comment_tag, COMMENTS
+from ...moderation import ACTIONS, moderate, disable_user_comments
+from ...encoding import json_response
 from . import api_blueprint
+from .errors import bad_request, forbidden
+
+
+def _is_admin(user):
+    return not user.is_anonymous and \
+        any(role.name == 'admin' for role in user.roles)
+
+
+def _variant():
+    # 管理员和其他用户看到的评论列表不同，ETag也要不同
+    return 'admin' if _is_admin(g.current_user) else 'public'
+
+
+def _visible(query):
+    # 只有管理员能看到被查禁的评论
+    if _is_admin(g.current_user):
+        return query
+    return query.filter(Comment.disabled == False)
 
 
 @api_blueprint.route('/comments/')
 def get_comments():
-    page = request.args.get('page', 1, type=int)
-    pagination = Comment.query.order_by(Comment.date.desc()).paginate(
-        page,
-        per_page=current_app.config['PAGINATION_COMMENTS_PER_PAGE'],
-        error_out=False
+    pagination = paginate(
+        _visible(Comment.query),
+        [Comment.date, Comment.id],
+        current_app.config['PAGINATION_COMMENTS_PER_PAGE'],
+        cursor_mode='page' not in request.args,
+        with_total=request.args.get('count', 1, type=int) != 0
     )
     comments = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_comments', page=page-1, _external=True)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_comments', page=page+1, _external=True)
-
-    return jsonify({
-        'comments': [comment.to_json() for comment in comments],
-        'prev': prev,
-        'next': next,
-        'count': pagination.total
-    })
+    checks = validators(COMMENTS,
+                        *[comment_tag(comment.id) for comment in comments],
+                        variant=_variant())
+    response = checks.not_modified()
+    if response:
+        return response
+    return checks.apply(page_response(
+        'comments', comments, pagination, 'api.get_comments'))
 
 
 @api_blueprint.route('/comments/<int:id>')
 def get_comment(id):
+    checks = validators(comment_tag(id))
+    response = checks.not_modified()
+    if response:
+        return response
     comment = Comment.query.get_or_404(id)
-    return jsonify(comment.to_json())
+    return checks.apply(json_response(comment.to_json()))
 
 
 @api_blueprint.route('/posts/<int:id>/comments/')
 def get_post_comments(id):
+    # 评论的任何变化都会让所属文章的标签失效，304时不访问数据库
+    checks = validators(post_tag(id), variant=_variant())
+    response = checks.not_modified()
+    if response:
+        return response
     post = Post.query.get_or_404(id)
-    page = request.args.get('page', 1, type=int)
-    pagination = post.comments.order_by(Comment.date.asc()).paginate(
-        page,
-        per_page=current_app.config['PAGINATION_COMMENTS_PER_PAGE'],
-        error_out=False
+    # 未被查禁的评论数就是文章的评论计数，不需要COUNT
+    total = None if _is_admin(g.current_user) else post.comment_count
+    pagination = paginate(
+        _visible(post.comments),
+        [Comment.date, Comment.id],
+        current_app.config['PAGINATION_COMMENTS_PER_PAGE'],
+        descending=False,
+        cursor_mode='page' not in request.args,
+        with_total=request.args.get('count', 1, type=int) != 0,
+        total=total
     )
     comments = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_post_comments', id=id, page=page-1,
-                       _external=True)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_post_comments', id=id, page=page+1,
-                       _external=True)
-
-    return jsonify({
-        'comments': [comment.to_json() for comment in comments],
-        'prev': prev,
-        'next': next,
-        'count': pagination.total
-    })
+    return checks.apply(page_response(
+        'comments', comments, pagination, 'api.get_post_comments', id=id))
 
 
 @api_blueprint.route('/posts/<int:id>/comments/', methods=['POST'])
@@ -73,5 +93,56 @@ def new_post_comment(id):
     # 1. 新建的资源，
     # 2. 201状态码，
     # 3. 把Location首部的值设为刚创建的这个资源的URL
-    return jsonify(comment.to_json()), 201, \
+    return json_response(comment.to_json()), 201, \
         {'Location': url_for('api.get_comment', id=comment.id, _external=True)}
+
+
+def _optional_int(data, name):
+    value = data.get(name)
+    if value is not None and (isinstance(value, bool) or
+                              not isinstance(value, (int, long))):
+        raise ValueError('%s must be an integer' % name)
+    return value
+
+
+# 批量审核评论，主体为 {"action": "disable", "ids": [...], "user": 用户id,
+# "post": 文章id, "pattern": "正文中的文本"}，选出同时满足所有条件的评论
+@api_blueprint.route('/comments/moderate', methods=['POST'])
+def moderate_comments():
+    if not _is_admin(g.current_user):
+        return forbidden('Insufficient permissions')
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return bad_request('expected a JSON object')
+    action = data.get('action')
+    if action not in ACTIONS:
+        return bad_request('action must be one of %s' % ', '.join(ACTIONS))
+    ids = data.get('ids')
+    pattern = data.get('pattern')
+    try:
+        if ids is not None and not (
+                isinstance(ids, list) and
+                all(isinstance(id, (int, long)) and not isinstance(id, bool)
+                    for id in ids)):
+            raise ValueError('ids must be a list of integers')
+        if pattern is not None and not isinstance(pattern, basestring):
+            raise ValueError('pattern must be a string')
+        count = moderate(action, ids=ids,
+                         user_id=_optional_int(data, 'user'),
+                         post_id=_optional_int(data, 'post'),
+                         pattern=pattern)
+    except ValueError as e:
+        return bad_request(e.args[0])
+    db.session.commit()
+    return json_response({'action': action, 'count': count})
+
+
+# 查禁某个用户的全部评论
+@api_blueprint.route('/users/<int:id>/comments/disable', methods=['POST'])
+def disable_comments_by_user(id):
+    if not _is_admin(g.current_user):
+        return forbidden('Insufficient permissions')
+    user = User.query.get_or_404(id)
+    count = disable_user_comments(user.id)
+    db.session.commit()
+    return json_response({'action': 'disable', 'count': count})
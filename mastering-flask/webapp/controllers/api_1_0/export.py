@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from flask import request, current_app, stream_with_context
+from ...export import EXPORTS, FORMATS, export, parse_since
+from . import api_blueprint
+from .errors import bad_request
+
+
+# 流式导出整张表，例如 /api/v1.0/export/posts?format=csv&since=2018-01-01
+@api_blueprint.route('/export/<kind>')
+def export_data(kind):
+    format = request.args.get('format', 'ndjson')
+    if kind not in EXPORTS:
+        return bad_request('unknown export: %s' % kind)
+    if format not in FORMATS:
+        return bad_request('unknown format: %s' % format)
+    since = request.args.get('since')
+    try:
+        since = parse_since(since) if since else None
+    except ValueError:
+        return bad_request('invalid since: %s' % since)
+
+    lines = export(kind, format, since, current_app.config['EXPORT_BATCH_SIZE'])
+    return current_app.response_class(
+        stream_with_context(lines), mimetype=FORMATS[format],
+        headers={'Content-Disposition':
+                 'attachment; filename=%s.%s' % (kind, format)})
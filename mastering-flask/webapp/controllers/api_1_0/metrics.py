@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+from flask import current_app
+from ...taskmetrics import collect, prometheus
+from . import api_blueprint
+from .errors import service_unavailable
+
+
+# 所有worker进程的Celery任务指标，Prometheus的文本格式
+@api_blueprint.route('/metrics/tasks')
+def task_metrics():
+    try:
+        totals = collect()
+    except RuntimeError as e:
+        # 没有共享缓存时看不到worker的指标，不返回空的结果
+        return service_unavailable(str(e))
+    return current_app.response_class(
+        prometheus(totals), mimetype='text/plain; version=0.0.4')
@@ -1,40 +1,44 @@
 # -*- coding: utf-8 -*-
-from flask import jsonify, request, g, url_for, current_app
+from flask import request, g, url_for, current_app
 from flask_principal import Permission, UserNeed
 from ...models import db, Post
+from ...pagination import paginate
+from ...serializers import page_response
+from ...pagecache import validators, post_tag, POSTS
 from ...extensions import admin_permission
+from ...encoding import json_response
 from . import api_blueprint
 from .errors import forbidden
 
 
 @api_blueprint.route('/posts/')
 def get_posts():
-    page = request.args.get('page', 1, type=int)
-    pagination = Post.query.paginate(
-        page,
-        per_page=current_app.config['PAGINATION_POST_PER_PAGE'],
-        error_out=False
+    pagination = paginate(
+        Post.listing(),
+        [Post.publish_date, Post.id],
+        current_app.config['PAGINATION_POST_PER_PAGE'],
+        cursor_mode='page' not in request.args,
+        with_total=request.args.get('count', 1, type=int) != 0
     )
     posts = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_posts', page=page-1, _external=True)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_posts', page=page+1, _external=True)
-
-    return jsonify({
-        'posts': [post.to_json() for post in posts],
-        'prev': prev,
-        'next': next,
-        'count': pagination.total
-    })
+    # 列表中的文章和列表本身都没有变化时，不再序列化
+    checks = validators(POSTS, *[post_tag(post.id) for post in posts])
+    response = checks.not_modified()
+    if response:
+        return response
+    return checks.apply(page_response(
+        'posts', posts, pagination, 'api.get_posts'))
 
 
 @api_blueprint.route('/posts/<int:id>')
 def get_post(id):
+    # 校验值只依赖文章的id，304时不访问数据库
+    checks = validators(post_tag(id))
+    response = checks.not_modified()
+    if response:
+        return response
     post = Post.query.get_or_404(id)
-    return jsonify(post.to_json())
+    return checks.apply(json_response(post.to_json()))
 
 
 @api_blueprint.route('/posts/', methods=['POST'])
@@ -47,7 +51,7 @@ def new_post():
     # 1. 新建的资源，
     # 2. 201状态码，
     # 3. 把Location首部的值设为刚创建的这个资源的URL
-    return jsonify(post.to_json()), 201, \
+    return json_response(post.to_json()), 201, \
         {'Location': url_for('api.get_post', id=post.id, _external=True)}
 
 
@@ -64,4 +68,4 @@ def edit_post(id):
     post.text = request.json.get('text', post.text)
     db.session.add(post)
     db.session.commit()
-    return jsonify(post.to_json())
+    return json_response(post.to_json())
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from flask import request, current_app
+from ...search import search as search_posts
+from ...pagination import pagination_urls
+from ...serializers import external_url
+from ...encoding import json_response
+from . import api_blueprint
+from .errors import bad_request
+
+
+@api_blueprint.route('/search')
+def search():
+    q = request.args.get('q', '').strip()
+    if not q:
+        return bad_request('missing search query')
+    pagination = search_posts(
+        q,
+        request.args.get('page', 1, type=int),
+        current_app.config['PAGINATION_SEARCH_PER_PAGE']
+    )
+    prev, next = pagination_urls(pagination, 'api.search', q=q)
+
+    return json_response({
+        'results': [{
+            'type': hit.kind,
+            'url': external_url('api.get_comment', hit.id)
+            if hit.kind == 'comment'
+            else external_url('api.get_post', hit.id),
+            'post': external_url('api.get_post', hit.post_id),
+            'title': hit.post.title,
+            'snippet': unicode(hit.snippet),
+            'score': hit.score
+        } for hit in pagination.items],
+        'prev': prev,
+        'next': next,
+        'count': pagination.total
+    })
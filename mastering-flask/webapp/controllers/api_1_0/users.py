@@ -1,63 +1,54 @@
 # -*- coding: utf-8 -*-
-from flask import jsonify, request, current_app, url_for
+from flask import request, current_app
 from ...models import User, Post
+from ...pagination import paginate
+from ...serializers import page_response
+from ...pagecache import validators, post_tag, user_tag
+from ...encoding import json_response
 from . import api_blueprint
 
 
 @api_blueprint.route('/users/<int:id>')
 def get_user(id):
+    checks = validators(user_tag(id))
+    response = checks.not_modified()
+    if response:
+        return response
     user = User.query.get_or_404(id)
-    return jsonify(user.to_json())
+    return checks.apply(json_response(user.to_json()))
 
 
 @api_blueprint.route('/users/<int:id>/posts/')
 def get_user_posts(id):
     user = User.query.get_or_404(id)
-    page = request.args.get('page', 1, type=int)
-    pagination = user.posts.order_by(Post.publish_date.desc()).paginate(
-        page,
-        per_page=current_app.config['PAGINATION_POST_PER_PAGE'],
-        error_out=False
+    pagination = paginate(
+        Post.listing(user.posts),
+        [Post.publish_date, Post.id],
+        current_app.config['PAGINATION_POST_PER_PAGE'],
+        cursor_mode='page' not in request.args,
+        with_total=request.args.get('count', 1, type=int) != 0,
+        total=user.post_count
     )
     posts = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_user_posts', id=id, page=page-1, _external=True)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_user_posts', id=id, page=page+1, _external=True)
-
-    return jsonify({
-        'posts': [post.to_json() for post in posts],
-        'prev': prev,
-        'next': next,
-        'count': pagination.total
-    })
+    # 用户发表或删除文章时用户的标签失效
+    checks = validators(user_tag(id), *[post_tag(post.id) for post in posts])
+    response = checks.not_modified()
+    if response:
+        return response
+    return checks.apply(page_response(
+        'posts', posts, pagination, 'api.get_user_posts', id=id))
 
 
 @api_blueprint.route('/users/<int:id>/timeline/')
 def get_user_following_posts(id):
     user = User.query.get_or_404(id)
-    page = request.args.get('page', 1, type=int)
-    pagination = user.following_posts.order_by(
-        Post.publish_date.desc()
-    ).paginate(
-        page,
-        per_page=current_app.config['PAGINATION_POST_PER_PAGE'],
-        error_out=False
+    pagination = paginate(
+        Post.listing(user.following_posts),
+        [Post.publish_date, Post.id],
+        current_app.config['PAGINATION_POST_PER_PAGE'],
+        cursor_mode='page' not in request.args,
+        with_total=request.args.get('count', 1, type=int) != 0
     )
     posts = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_user_following_posts', id=id, page=page-1,
-                       _external=True)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_user_following_posts', id=id, page=page+1,
-                       _external=True)
-    return jsonify({
-        'posts': [post.to_json() for post in posts],
-        'prev': prev,
-        'next': next,
-        'count': pagination.total
-    })
+    return page_response('posts', posts, pagination,
+                         'api.get_user_following_posts', id=id)
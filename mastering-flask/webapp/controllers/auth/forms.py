@@ -34,7 +34,8 @@ class LoginForm(FlaskForm):
                 return False
 
         # check the password match or not
-        if not user.check_password(self.password.data):
+        # 工作因子过期时顺便重新散列，由login视图提交
+        if not user.check_password(self.password.data, rehash=True):
             self.username_or_email.errors.append('Invalid username or password')
             return False
 
@@ -4,11 +4,12 @@ from flask import redirect, request, url_for, flash, \
 from flask_login import login_user, logout_user, login_required, current_user
 from flask_principal import Identity, AnonymousIdentity, identity_changed, \
     IdentityContext
-from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from .forms import LoginForm, RegisterForm, ChangepasswordForm, \
     PasswordResetRequestForm, PasswordResetForm, ChangeEmailForm
 from ...models import db, User, Role
 from ...email import send_email
+from ...activity import touch_last_seen
+from ...tokens import get_serializer
 from ...extensions import admin_permission
 from . import auth_blueprint
 
@@ -29,8 +30,9 @@ def context():
 @auth_blueprint.before_app_request
 def before_request():
     if current_user.is_authenticated:
-        # before_app_request处理程序会在每次请求前运行，所以在这里实现刷新last_seen字段的需求
-        current_user.update_last_seen()
+        # before_app_request处理程序会在每次请求前运行，所以在这里实现刷新last_seen字段的需求。
+        # 访问时间先记录在内存中，定期批量写入数据库，请求中不再执行UPDATE和commit
+        touch_last_seen(current_user)
 
         if not current_user.confirmed \
                 and request.endpoint \
@@ -63,6 +65,9 @@ def login():
             # if user is not None:
             login_user(user, form.remember.data)
 
+        # 登录时密码可能按新的工作因子重新散列了
+        db.session.commit()
+
         # identity changed
         identity_changed.send(current_app._get_current_object(),
                               identity=Identity(user.id))
@@ -185,7 +190,7 @@ def password_reset(token):
     form = PasswordResetForm()
     if form.validate_on_submit():
         # 如果邮箱对应的用户不存在，则不能重置密码
-        s = Serializer(current_app.config['SECRET_KEY'])
+        s = get_serializer()
         try:
             data = s.loads(token)
         except:
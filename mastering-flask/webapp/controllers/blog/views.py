@@ -5,8 +5,14 @@ from flask import render_template, redirect, url_for, abort, flash, current_app,
 from flask_login import login_required, current_user
 from flask_principal import Permission, UserNeed
 from flask_sqlalchemy import get_debug_queries
-from sqlalchemy import func, desc
-from ...models import db, Post, Tag, posts_tags_table, Comment, User
+from ...models import db, Post, Tag, Comment, User, Follow
+from ...pagination import paginate
+from ...sidebar import sidebar_data
+from ...search import search as search_posts
+from ...digest import week_range
+from ...moderation import moderate, disable_user_comments
+from ...pagecache import cached_page, depends_on, depends_on_posts, \
+    post_tag, user_tag, author_tag, tag_tag, POSTS
 from .forms import CommentForm, PostForm, ProfileEditForm
 from ...extensions import admin_permission, poster_permission, cache
 from . import blog_blueprint
@@ -23,38 +29,9 @@ def after_request(response):
     return response
 
 
-# @cache.cached(timeout=7200, key_prefix='sidebar_data')
-def sidebar_data():
-    """侧边栏函数
-    每个页面都有一个侧边栏，显示5篇最新的文章，以及5个最常用的标签
-    """
-
-    recent = Post.query.order_by(
-        Post.publish_date.desc()
-    ).limit(
-        current_app.config['TOP_POSTS_NUM']
-    ).all()
-    # 下面的查询对应的SQL语句为
-    # SELECT tags.id AS tags_id, tags.title AS tags_title,
-    #        count(posts_tags.post_id) AS total
-    # FROM tags JOIN posts_tags
-    # ON tags.id = posts_tags.tag_id
-    # GROUP BY tags.id, tags.title
-    # ORDER BY total DESC
-    # LIMIT ? OFFSET ?
-    top_tags = db.session.query(
-        Tag, func.count(posts_tags_table.c.post_id).label('total')
-    ).join(posts_tags_table).group_by(Tag).order_by(desc('total')).limit(
-        current_app.config['TOP_TAGS_NUM']
-    ).all()
-
-    return recent, top_tags
-
-
 @blog_blueprint.route('/')
-# @cache.cached(timeout=60)
+@cached_page
 def home():
-    page = request.args.get('page', 1, type=int)
     # 决定显示所有博客文章还是只显示所关注用户文章的选项,存储在cookie的show_following字段中
     show_following = False
     if current_user.is_authenticated:
@@ -62,13 +39,16 @@ def home():
     if show_following:
         query = current_user.following_posts
     else:
+        depends_on(POSTS)
         query = Post.query
-    pagination = query.order_by(Post.publish_date.desc()).paginate(
-        page,
-        per_page=current_app.config['PAGINATION_POST_PER_PAGE'],
-        error_out=False
+    pagination = paginate(
+        Post.listing(query, full_text=False),
+        [Post.publish_date, Post.id],
+        current_app.config['PAGINATION_POST_PER_PAGE'],
+        with_total=False
     )
     posts = pagination.items
+    depends_on_posts(posts)
     recent, top_tags = sidebar_data()
 
     return render_template('home.html', posts=posts, recent=recent,
@@ -77,8 +57,9 @@ def home():
 
 
 @blog_blueprint.route('/post/<int:post_id>', methods=['GET', 'POST'])
-#@cache.cached(timeout=60)
+@cached_page
 def post(post_id):
+    depends_on(post_tag(post_id))
     post = Post.query.get_or_404(post_id)
     form = CommentForm()
     if form.validate_on_submit():
@@ -94,17 +75,26 @@ def post(post_id):
         flash('Your comment has been published.', category='success')
         return redirect(url_for('.post', post_id=post_id, page=-1))
 
-    page = request.args.get('page', 1, type=int)
-    # -1为一个特殊的页数，值为-1时，会计算评论的总量和总页数，求出评论的最后一页
-    if page == -1:
-        page = (post.comments.count() - 1) / \
-               current_app.config['PAGINATION_COMMENTS_PER_PAGE'] + 1
-    pagination = post.comments.order_by(Comment.date.asc()).paginate(
-        page,
-        per_page=current_app.config['PAGINATION_COMMENTS_PER_PAGE'],
-        error_out=False
+    # 管理员能看到被查禁的评论；其他人的查询在SQL中过滤掉它们，
+    # 总数就是文章的评论计数，不需要COUNT
+    query = post.comments
+    total = None
+    if not admin_permission.can():
+        query = query.filter(Comment.disabled == False)
+        total = post.comment_count
+    # page为-1时显示评论的最后一页，刚发表的评论就在这一页上
+    pagination = paginate(
+        query,
+        [Comment.date, Comment.id],
+        current_app.config['PAGINATION_COMMENTS_PER_PAGE'],
+        descending=False,
+        with_total=False,
+        last=request.args.get('page', 1, type=int) == -1,
+        total=total
     )
     comments = pagination.items
+    depends_on(author_tag(post.user_id),
+               *[author_tag(c.user_id) for c in comments if c.user_id])
     tags = post.tags
     recent, top_tags = sidebar_data()
 
@@ -160,33 +150,52 @@ def edit_post(post_id):
 
 
 @blog_blueprint.route('/tag/<string:tag_name>')
-# @cache.cached(timeout=60)
+@cached_page
 def tag(tag_name):
-    page = request.args.get('page', 1, type=int)
     tag = Tag.query.filter_by(title=tag_name).first_or_404()
-    pagination = tag.posts.order_by(Post.publish_date.desc()).paginate(
-        page,
-        per_page=current_app.config['PAGINATION_POST_PER_PAGE'],
-        error_out = False
+    depends_on(tag_tag(tag.id))
+    pagination = paginate(
+        Post.listing(tag.posts, full_text=False),
+        [Post.publish_date, Post.id],
+        current_app.config['PAGINATION_POST_PER_PAGE'],
+        with_total=False
     )
     posts = pagination.items
+    depends_on_posts(posts)
     recent, top_tags = sidebar_data()
 
     return render_template('tag.html', tag=tag, posts=posts, recent=recent,
                            top_tags=top_tags, pagination=pagination)
 
 
+@blog_blueprint.route('/search')
+def search():
+    q = request.args.get('q', '').strip()
+    pagination = search_posts(
+        q,
+        request.args.get('page', 1, type=int),
+        current_app.config['PAGINATION_SEARCH_PER_PAGE']
+    )
+    recent, top_tags = sidebar_data()
+
+    return render_template('search.html', q=q, hits=pagination.items,
+                           recent=recent, top_tags=top_tags,
+                           pagination=pagination)
+
+
 @blog_blueprint.route('/user/<string:username>')
-# @cache.cached(timeout=60)
+@cached_page
 def user(username):
-    page = request.args.get('page', 1, type=int)
     user = User.query.filter_by(username=username).first_or_404()
-    pagination = user.posts.order_by(Post.publish_date.desc()).paginate(
-        page,
-        per_page=current_app.config['PAGINATION_POST_PER_PAGE'],
-        error_out=False
+    depends_on(user_tag(user.id))
+    pagination = paginate(
+        Post.listing(user.posts, full_text=False),
+        [Post.publish_date, Post.id],
+        current_app.config['PAGINATION_POST_PER_PAGE'],
+        total=user.post_count
     )
     posts = pagination.items
+    depends_on_posts(posts)
     recent, top_tags = sidebar_data()
 
     return render_template('user.html', user=user, posts=posts, recent=recent,
@@ -215,28 +224,11 @@ def edit_profile():
 @blog_blueprint.route('/digest')
 @cache.cached(timeout=60)
 def digest_func():
-    # 找出这周的起始和结束日
-    # 取出当前时间的年，周
-    year, week = datetime.datetime.utcnow().isocalendar()[0:2]
-    # date赋值为当年的1月1号
-    date = datetime.date(year, 1, 1)
-    # date.weekday()：判断当年的1月1号是周几，如果是周一，则为0，周二为1，以此类推
-    # 如果当年的1月1号>3，即为周五或周六或周日，则日期加上该周剩余的几天，即当年的1月1号所在的周
-    #  划归为上一年。
-    # 如果当年的1月1号<=3，则日期减去这几天，即将上一年的几天也算作该周。
-    # 从而得到当年的第一周的起始日期，赋给date变量
-    if date.weekday() > 3:
-        date = date + datetime.timedelta(7 - date.weekday())
-    else:
-        date = date - datetime.timedelta(date.weekday())
-    # delta为当前时间所在的周数(week)减一，乘以7，得到总天数
-    delta = datetime.timedelta(days=(week - 1) * 7)
-    # 日期加上一个间隔,返回一个新的日期对象，days=6 表示周日
-    start, end = date + delta, date + delta + datetime.timedelta(days=6)
-
+    # 这周的起止时间：[周一0点, 下周一0点)
+    start, end = week_range()
     posts = Post.query.filter(
         Post.publish_date >= start,
-        Post.publish_date <= end
+        Post.publish_date < end
     ).all()
 
     if len(posts) == 0:
@@ -281,11 +273,11 @@ def followers(username):
     if user is None:
         flash('Invalid User.', category='error')
         return redirect(url_for('.home'))
-    page = request.args.get('page', 1, type=int)
-    pagination = user.followers.paginate(
-        page=page,
-        per_page=current_app.config['PAGINATION_FOLLOWERS_PER_PAGE'],
-        error_out=False
+    pagination = paginate(
+        user.followers,
+        [Follow.timestamp, Follow.follower_id],
+        current_app.config['PAGINATION_FOLLOWERS_PER_PAGE'],
+        total=user.follower_count
     )
     follows = [{'user': item.follower, 'timestamp': item.timestamp}
                for item in pagination.items]
@@ -300,11 +292,11 @@ def followed_by(username):
     if user is None:
         flash('Invalid User.', category='error')
         return redirect(url_for('.home'))
-    page = request.args.get('page', 1, type=int)
-    pagination = user.followings.paginate(
-        page=page,
-        per_page=current_app.config['PAGINATION_FOLLOWERS_PER_PAGE'],
-        error_out=False
+    pagination = paginate(
+        user.followings,
+        [Follow.timestamp, Follow.following_id],
+        current_app.config['PAGINATION_FOLLOWERS_PER_PAGE'],
+        total=user.following_count
     )
     follows = [{'user': item.following, 'timestamp': item.timestamp}
                for item in pagination.items]
@@ -336,31 +328,49 @@ def show_following():
     return resp
 
 
-@blog_blueprint.route('/moderate/enable/<int:comment_id>')
-@login_required
-@admin_permission.require(http_exception=403)
-def moderate_enable(comment_id):
-    comment = Comment.query.get_or_404(comment_id)
-    comment.disabled = False
-    db.session.add(comment)
+def _moderate_comment(action, comment_id):
+    # 使用批量审核的UPDATE语句，不加载评论对象
+    post_id = db.session.query(Comment.post_id).filter_by(
+        id=comment_id).scalar()
+    if post_id is None:
+        abort(404)
+    moderate(action, ids=[comment_id])
     db.session.commit()
     return redirect(url_for(
         '.post',
-        post_id=comment.post.id,
+        post_id=post_id,
         page=request.args.get('page', -1, type=int))
     )
 
 
+@blog_blueprint.route('/moderate/enable/<int:comment_id>')
+@login_required
+@admin_permission.require(http_exception=403)
+def moderate_enable(comment_id):
+    return _moderate_comment('enable', comment_id)
+
+
 @blog_blueprint.route('/moderate/disable/<int:comment_id>')
 @login_required
 @admin_permission.require(http_exception=403)
 def moderate_disable(comment_id):
-    comment = Comment.query.get_or_404(comment_id)
-    comment.disabled = True
-    db.session.add(comment)
-    db.session.commit()
+    return _moderate_comment('disable', comment_id)
+
+
+# 查禁评论者的全部评论，然后回到原来的文章页面
+@blog_blueprint.route('/moderate/disable-user/<int:comment_id>')
+@login_required
+@admin_permission.require(http_exception=403)
+def moderate_disable_user(comment_id):
+    row = db.session.query(Comment.post_id, Comment.user_id).filter_by(
+        id=comment_id).first()
+    if row is None:
+        abort(404)
+    if row.user_id is not None:
+        disable_user_comments(row.user_id)
+        db.session.commit()
     return redirect(url_for(
         '.post',
-        post_id=comment.post.id,
+        post_id=row.post_id,
         page=request.args.get('page', -1, type=int))
     )
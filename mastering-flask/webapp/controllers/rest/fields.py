@@ -1,28 +1,27 @@
 # -*- coding: utf-8 -*-
-from HTMLParser import HTMLParser
 from flask_restful import fields
-
-
-class HTMLStripper(HTMLParser):
-    def __init__(self):
-        self.reset()
-        self.fed = []
-
-    def handle_data(self, data):
-        self.fed.append(data)
-
-    def get_data(self):
-        return ''.join(self.fed)
-
-
-def strip_tags(html):
-    s = HTMLStripper()
-    s.feed(html)
-
-    return s.get_data()
+from ...rendering import strip_tags
 
 
 class HTMLField(fields.Raw):
-    def format(self, value):
-        return strip_tags(str(value))
+    """
+    HTML输出为纯文本。
+    Arguments:
+        plain: 保存时已经计算好的纯文本属性，有值时直接输出，不再解析HTML
+    """
+
+    def __init__(self, plain=None, **kwargs):
+        super(HTMLField, self).__init__(**kwargs)
+        self.plain = plain
+
+    def output(self, key, obj):
+        if self.plain:
+            value = getattr(obj, self.plain, None)
+            if value is not None:
+                return value
+        return super(HTMLField, self).output(key, obj)
 
+    def format(self, value):
+        if not isinstance(value, basestring):
+            value = unicode(value)
+        return strip_tags(value)
@@ -53,6 +53,24 @@ post_post_parser.add_argument(
     action='append'
 )
 
+# 批量创建文章: {"token": ..., "posts": [{"title", "text", "tags"}, ...]}
+post_batch_parser = reqparse.RequestParser()
+post_batch_parser.add_argument(
+    'token',
+    type=str,
+    required=True,
+    location='json',
+    help='Auth token is required to create posts'
+)
+post_batch_parser.add_argument(
+    'posts',
+    type=dict,
+    action='append',
+    required=True,
+    location='json',
+    help='A list of posts is required'
+)
+
 
 # PUT request
 post_put_parser = reqparse.RequestParser()
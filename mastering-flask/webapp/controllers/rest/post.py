@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*-
 import datetime
 
-from flask import abort
-from flask_restful import Resource, fields, marshal_with
+from flask import abort, current_app
+from flask_restful import Resource, fields, marshal
 from .fields import HTMLField
 from .parsers import post_get_parser, post_post_parser, post_put_parser, \
-    post_delete_parser
-from ...models import Post, User, Tag, db
+    post_delete_parser, post_batch_parser
+from ...models import Post, User, db
+from ...tagging import resolve_tags, add_tags, normalize_titles
+from ...pagecache import validators, post_tag, user_tag, author_tag, POSTS
 
 nested_tag_fields = {
     'id': fields.Integer(),
@@ -16,20 +18,28 @@ nested_tag_fields = {
 post_fields = {
     'author': fields.String(attribute=lambda x: x.user.username),
     'title': fields.String(),
-    'text': HTMLField(),
+    'text': HTMLField(plain='text_plain'),
     'publish_date': fields.DateTime(dt_format='iso8601'),
     'tags': fields.List(fields.Nested(nested_tag_fields))
 }
 
 
+def _respond(data, tags):
+    # 校验值没有变化时返回304，不再执行marshal
+    checks = validators(*tags)
+    response = checks.not_modified()
+    if response:
+        return response
+    return marshal(data, post_fields), 200, checks.headers()
+
+
 class PostApi(Resource):
-    @marshal_with(post_fields)
     def get(self, post_id=None):
         if post_id:
             post = Post.query.get(post_id)
             if not post:
                 abort(404)
-            return post
+            return _respond(post, [post_tag(post.id), author_tag(post.user_id)])
         else:
             args = post_get_parser.parse_args()
             page = args['page'] or 1
@@ -39,13 +49,16 @@ class PostApi(Resource):
                 if not user:
                     abort(404)
 
-                posts = user.posts.order_by(
-                    Post.publish_date.desc()).paginate(page, 30)
+                posts = Post.listing(user.posts).paginate(page, 30)
+                tags = [user_tag(user.id)]
             else:
-                posts = Post.query.order_by(
-                    Post.publish_date.desc()).paginate(page, 30)
+                posts = Post.listing().paginate(page, 30)
+                tags = [POSTS]
 
-            return posts.items
+            for post in posts.items:
+                tags.append(post_tag(post.id))
+                tags.append(author_tag(post.user_id))
+            return _respond(posts.items, tags)
 
     def post(self, post_id=None):
         if post_id:
@@ -62,15 +75,8 @@ class PostApi(Resource):
             new_post.publish_date = datetime.datetime.utcnow()
             new_post.text = args['text']
 
-            if args['tags']:
-                for item in args['tags']:
-                    tag = Tag.query.filter_by(title=item).first()
-                    # 标签若存在则添加，如果不存在则创建并添加
-                    if tag:
-                        new_post.tags.append(tag)
-                    else:
-                        new_tag = Tag(item)
-                        new_post.tags.append(new_tag)
+            # 标签若存在则添加，如果不存在则创建并添加
+            new_post.tags = resolve_tags(args['tags'])
 
             db.session.add(new_post)
             db.session.commit()
@@ -101,13 +107,7 @@ class PostApi(Resource):
             post.text = args['text']
 
         if args['tags']:
-            for item in args['tags']:
-                tag = Tag.query.filter_by(title=item).first()
-                if tag:
-                    post.tags.append(tag)
-                else:
-                    new_tag = Tag(item)
-                    post.tags.append(new_tag)
+            add_tags(post, args['tags'])
 
         db.session.add(post)
         db.session.commit()
@@ -132,3 +132,47 @@ class PostApi(Resource):
         db.session.delete(post)
         db.session.commit()
         return "", 204
+
+
+def _valid_item(item):
+    # 批量创建的每篇文章都要有标题和正文，标签为字符串列表
+    if not isinstance(item, dict):
+        return False
+    tags = item.get('tags') or []
+    return isinstance(item.get('title'), basestring) and item['title'] \
+        and isinstance(item.get('text'), basestring) and item['text'] \
+        and isinstance(tags, list) \
+        and all(isinstance(title, basestring) for title in tags)
+
+
+class PostBatchApi(Resource):
+    """一次请求创建多篇文章，所有文章的标签一起解析，只提交一次"""
+
+    def post(self):
+        args = post_batch_parser.parse_args(strict=True)
+        user = User.verify_auth_token(args['token'])
+        if not user:
+            abort(401)
+
+        items = args['posts']
+        if not items or len(items) > current_app.config['API_BATCH_LIMIT']:
+            abort(400)
+        if not all(_valid_item(item) for item in items):
+            abort(400)
+
+        tags = dict((tag.title, tag) for tag in resolve_tags(
+            [title for item in items for title in item.get('tags') or []]))
+        now = datetime.datetime.utcnow()
+        posts = []
+        for item in items:
+            post = Post(title=item['title'])
+            post.user = user
+            post.publish_date = now
+            post.text = item['text']
+            post.tags = [tags[title]
+                         for title in normalize_titles(item.get('tags'))]
+            posts.append(post)
+        db.session.add_all(posts)
+        db.session.commit()
+
+        return [post.id for post in posts], 201
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+每周摘要邮件
+
+以前的digest任务调用/digest视图函数渲染一封HTML邮件(为了在任务中使用url_for，
+Celery的worker把SERVER_NAME改成了localhost:5000)，用.all()取出本周的所有文章，
+再用写死的SMTP帐号发给写死的收件人列表。现在分成三步：
+1. build_digest()按(publish_date, id)分批读取本周的文章(只用Core查询需要的列)，
+   按作者整理成{作者id: [文章, ...]}保存到缓存中，本周的文章只计算一次；
+   链接在SITE_URL对应的请求上下文中生成；
+2. recipient_chunks()按id分批列出关注了本周有新文章的作者、已确认email的用户，
+   每批DIGEST_CHUNK_SIZE个，由digest任务交给send_digest子任务；
+3. send_digests()为一批收件人一次查出关注关系，每人的摘要只包含他关注的作者的文章，
+   用一个SMTP连接发送整批邮件。发送中途出错时抛出DigestError，
+   其中是还没有发送的收件人，重试时不会重复发送。
+发送之前先在digest_deliveries表中记录(周, 收件人)并提交，已经有记录的收件人跳过，
+digest任务重新执行或被重复调度时每人每周仍然只收到一封；发送失败时删除未发送部分的记录。
+缓存中没有摘要时(例如缓存为进程内缓存、或已经过期)子任务会重新计算一次。
+"""
+import datetime
+from flask import current_app, render_template, url_for
+from flask_mail import Message
+from sqlalchemy import and_, exists, not_
+from sqlalchemy.exc import IntegrityError
+from .caching import get_cache
+from .extensions import mail
+from .models import db, Post, User, Follow, DigestDelivery
+from .pagination import _seek_filter
+from .rendering import excerpt, render_html
+
+# 摘要在缓存中的键，参数为本周一的日期
+DIGEST_KEY = 'digest:%s'
+
+
+class DigestError(Exception):
+    """发送摘要失败，remaining为还没有发送的收件人id"""
+
+    def __init__(self, remaining, error):
+        super(DigestError, self).__init__(str(error))
+        self.remaining = remaining
+        self.error = error
+
+
+def week_range(now=None):
+    """now所在的ISO周的起止时间[周一0点, 下周一0点)"""
+    today = (now or datetime.datetime.utcnow()).date()
+    monday = today - datetime.timedelta(days=today.weekday())
+    start = datetime.datetime.combine(monday, datetime.time())
+    return start, start + datetime.timedelta(days=7)
+
+
+def site_context():
+    """以SITE_URL为主机名的请求上下文，邮件中的链接和模板在其中生成"""
+    return current_app.test_request_context(
+        '/', base_url=current_app.config['SITE_URL'])
+
+
+def week_posts(start, end, batch_size=500):
+    """按(publish_date, id)分批读取[start, end)之间发表的文章"""
+    posts = Post.__table__
+    keys = [posts.c.publish_date, posts.c.id]
+    columns = [posts.c.id, posts.c.title, posts.c.user_id,
+               posts.c.publish_date, posts.c.render_version,
+               # 还没有渲染过的文章才需要正文
+               db.func.coalesce(posts.c.excerpt, posts.c.text).label('excerpt')]
+    last = None
+    while True:
+        where = [posts.c.publish_date >= start, posts.c.publish_date < end]
+        if last is not None:
+            where.append(_seek_filter(keys, last, False))
+        rows = db.session.execute(
+            db.select(columns).where(and_(*where))
+            .order_by(*keys).limit(batch_size)).fetchall()
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            break
+        last = [rows[-1].publish_date, rows[-1].id]
+
+
+def build_digest(start, end):
+    """
+    整理[start, end)之间的文章，保存到缓存中并返回。
+    返回值为{作者id: [文章, ...]}，每篇文章是只包含摘要需要的字段的dict。
+    """
+    config = current_app.config
+    authors = {}
+    with site_context():
+        for row in week_posts(start, end, config['DIGEST_BATCH_SIZE']):
+            text = row.excerpt
+            if not row.render_version:
+                text = excerpt(render_html(text))
+            authors.setdefault(row.user_id, []).append({
+                'id': row.id,
+                'title': row.title,
+                'excerpt': text,
+                'publish_date': row.publish_date,
+                'url': url_for('blog.post', post_id=row.id, _external=True)
+            })
+    get_cache().set(DIGEST_KEY % start.date().isoformat(), authors,
+                    timeout=config['DIGEST_CACHE_TIMEOUT'])
+    return authors
+
+
+def load_digest(start):
+    """取出start开始的一周的摘要，缓存中没有时重新计算"""
+    authors = get_cache().get(DIGEST_KEY % start.date().isoformat())
+    if authors is None:
+        authors = build_digest(start, start + datetime.timedelta(days=7))
+    return authors
+
+
+def _week_authors(start, end):
+    # 本周发表过文章的作者
+    posts = Post.__table__
+    return db.select([posts.c.user_id]).where(
+        and_(posts.c.publish_date >= start, posts.c.publish_date < end))
+
+
+def _subscribed():
+    users = User.__table__
+    return and_(users.c.confirmed == True, users.c.email != None)
+
+
+def recipient_chunks(start, end, chunk_size=500):
+    """按id分批生成收件人id的列表：关注了本周发表过文章的作者的用户"""
+    users = User.__table__
+    follows = Follow.__table__
+    follows_author = exists().where(and_(
+        follows.c.follower_id == users.c.id,
+        follows.c.following_id.in_(_week_authors(start, end))))
+    last = 0
+    while True:
+        ids = [row[0] for row in db.session.execute(
+            db.select([users.c.id])
+            .where(and_(users.c.id > last, _subscribed(), follows_author))
+            .order_by(users.c.id).limit(chunk_size))]
+        if ids:
+            yield ids
+        if len(ids) < chunk_size:
+            break
+        last = ids[-1]
+
+
+def _digest_messages(authors, week, user_ids):
+    """为user_ids中本周还没有收到摘要的收件人生成邮件，返回[(用户id, Message), ...]"""
+    users = User.__table__
+    follows = Follow.__table__
+    deliveries = DigestDelivery.__table__
+    config = current_app.config
+    sent = exists().where(and_(deliveries.c.week == week,
+                               deliveries.c.user_id == users.c.id))
+    recipients = db.session.execute(
+        db.select([users.c.id, users.c.username, users.c.email])
+        .where(and_(users.c.id.in_(user_ids), _subscribed(), not_(sent)))
+        .order_by(users.c.id)).fetchall()
+    following = {}
+    for follower_id, following_id in db.session.execute(
+            db.select([follows.c.follower_id, follows.c.following_id])
+            .where(and_(follows.c.follower_id.in_(user_ids),
+                        follows.c.following_id.in_(list(authors))))):
+        following.setdefault(follower_id, []).append(following_id)
+
+    messages = []
+    for user in recipients:
+        posts = [post for author_id in following.get(user.id, ())
+                 for post in authors[author_id]]
+        if not posts:
+            continue
+        posts.sort(key=lambda post: (post['publish_date'], post['id']),
+                   reverse=True)
+        msg = Message(config['MAIL_SUBJECT_PREFIX'] + ' Weekly Digest',
+                      sender=config['MAIL_SENDER'], recipients=[user.email])
+        msg.body = render_template('blog/email/digest.txt',
+                                   user=user, posts=posts)
+        msg.html = render_template('blog/email/digest.html',
+                                   user=user, posts=posts)
+        messages.append((user.id, msg))
+    return messages
+
+
+def _claim(week, user_ids):
+    """记录本周发给user_ids的摘要，其中有收件人已经被其他任务记录时返回False"""
+    try:
+        db.session.execute(DigestDelivery.__table__.insert(),
+                           [{'week': week, 'user_id': user_id}
+                            for user_id in user_ids])
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    return True
+
+
+def _release(week, user_ids):
+    # 没有发送出去的邮件删除记录，重试时重新发送
+    deliveries = DigestDelivery.__table__
+    db.session.execute(deliveries.delete().where(and_(
+        deliveries.c.week == week, deliveries.c.user_id.in_(user_ids))))
+    db.session.commit()
+
+
+def send_digests(start, user_ids):
+    """用一个SMTP连接给一批收件人发送start开始的一周的摘要，返回发送的邮件数"""
+    authors = load_digest(start)
+    if not authors:
+        return 0
+    week = start.date()
+    while True:
+        with site_context():
+            messages = _digest_messages(authors, week, user_ids)
+        # 记录冲突时重新排除已经被其他任务认领的收件人
+        if not messages or _claim(week, [user_id for user_id, msg in messages]):
+            break
+    sent = 0
+    try:
+        if messages:
+            with mail.connect() as conn:
+                for user_id, msg in messages:
+                    conn.send(msg)
+                    sent += 1
+    except Exception as e:
+        remaining = [user_id for user_id, msg in messages[sent:]]
+        _release(week, remaining)
+        raise DigestError(remaining, e)
+    return sent
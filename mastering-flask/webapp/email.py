@@ -1,13 +1,155 @@
 # -*- coding: utf-8 -*-
-from threading import Thread
+"""
+邮件的异步发送
+
+以前send_email为每封邮件启动一个新线程，mail.send每次都新建一个SMTP连接，
+注册高峰时会同时出现几百个线程和SMTP连接，发送失败的邮件也就丢掉了。现在：
+1. 模板在请求中渲染好，邮件放进大小为MAIL_QUEUE_SIZE的发送队列，
+   由MAIL_QUEUE_WORKERS个常驻线程发送；队列满时记录错误并丢弃这封邮件；
+2. 每个线程用Flask-Mail的connect()打开一个SMTP连接后连续发送队列中的邮件，
+   最多MAIL_BATCH_SIZE封，或者队列空闲MAIL_IDLE_TIMEOUT秒后才关闭连接；
+3. 发送失败的邮件等待 MAIL_RETRY_DELAY * 2^n 秒后重新放入队列，
+   最多重试MAIL_MAX_RETRIES次，出错的连接关闭后重新建立；
+4. MAIL_BACKEND为'celery'时交给Celery的send_mail任务发送，重试由Celery负责。
+MAIL_QUEUE_WORKERS为0时在请求线程中直接发送。
+"""
+import atexit
+import Queue
+import threading
 from flask import current_app, render_template
 from flask_mail import Message
 from .extensions import mail
 
+# 线程等待新邮件的间隔，关闭队列后最多这么久线程就会退出
+POLL_INTERVAL = 0.5
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+
+class MailQueue(object):
+    def __init__(self, app):
+        self.app = app
+        self.sent = 0
+        self.failed = 0
+        self._queue = Queue.Queue(app.config['MAIL_QUEUE_SIZE'])
+        self._workers = []
+        self._closed = threading.Event()
+        self._lock = threading.Lock()
+        app.extensions['mail_queue'] = self
+        atexit.register(self.close)
+
+    def _start(self):
+        # 第一次发送时才启动线程，避免预先fork的服务器把线程带到子进程中
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(self.app.config['MAIL_QUEUE_WORKERS']):
+                worker = threading.Thread(target=self._work,
+                                          name='mail-queue-%d' % i)
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+
+    def put(self, msg, attempt=0):
+        """把邮件放入发送队列，attempt为已经重试的次数"""
+        if not self._workers:
+            self._start()
+        try:
+            self._queue.put_nowait((msg, attempt))
+        except Queue.Full:
+            self.app.logger.error('Mail queue is full, dropping mail to %s',
+                                  ', '.join(msg.recipients))
+            self._count('failed')
+
+    def join(self):
+        """等待队列中的邮件都处理完，不包括等待重试的邮件"""
+        self._queue.join()
+
+    def close(self, timeout=5):
+        """发送完队列中剩下的邮件后停止所有线程"""
+        self._closed.set()
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _take(self, timeout):
+        try:
+            return self._queue.get(timeout=timeout)
+        except Queue.Empty:
+            return None
+
+    def _work(self):
+        with self.app.app_context():
+            while not (self._closed.is_set() and self._queue.empty()):
+                item = self._take(POLL_INTERVAL)
+                if item is not None:
+                    self._deliver(item)
+
+    def _deliver(self, item):
+        """用一个SMTP连接发送item，以及之后陆续放入队列的邮件"""
+        batch_size = self.app.config['MAIL_BATCH_SIZE']
+        idle = self.app.config['MAIL_IDLE_TIMEOUT']
+        conn = None
+        try:
+            for i in range(batch_size):
+                msg, attempt = item
+                try:
+                    if conn is None:
+                        conn = self._connect()
+                    conn.send(msg)
+                except Exception:
+                    # 连接可能已经断开，下一封邮件重新连接
+                    conn = _close(conn)
+                    self._retry(msg, attempt)
+                else:
+                    self._count('sent')
+                finally:
+                    self._queue.task_done()
+                # 达到MAIL_BATCH_SIZE后不再多取一封，
+                # 否则队列已满时把它放回去会让唯一的线程一直阻塞
+                if i == batch_size - 1:
+                    break
+                item = self._take(idle)
+                if item is None:
+                    break
+        finally:
+            _close(conn)
+
+    def _connect(self):
+        conn = mail.connect().__enter__()
+        if conn.host:
+            # 服务器没有响应时不要让线程一直等下去
+            conn.host.sock.settimeout(self.app.config['MAIL_TIMEOUT'])
+        return conn
+
+    def _retry(self, msg, attempt):
+        if attempt >= self.app.config['MAIL_MAX_RETRIES']:
+            self.app.logger.exception('Failed to send mail to %s',
+                                      ', '.join(msg.recipients))
+            self._count('failed')
+            return
+        self.app.logger.warning('Failed to send mail to %s, retrying',
+                                ', '.join(msg.recipients))
+        delay = self.app.config['MAIL_RETRY_DELAY'] * 2 ** attempt
+        timer = threading.Timer(delay, self.put, (msg, attempt + 1))
+        timer.daemon = True
+        timer.start()
+
+
+def _close(conn):
+    if conn is not None:
+        try:
+            conn.__exit__(None, None, None)
+        except Exception:
+            pass
+    return None
+
+
+def message_data(msg):
+    """Celery任务的参数，只包含可以序列化的字段"""
+    return {'subject': msg.subject, 'sender': msg.sender,
+            'recipients': msg.recipients, 'body': msg.body, 'html': msg.html}
 
 
 def send_email(to, subject, template, **kwargs):
@@ -16,6 +158,11 @@ def send_email(to, subject, template, **kwargs):
                   sender=app.config['MAIL_SENDER'], recipients=[to])
     msg.body = render_template(template + '.txt', **kwargs)
     msg.html = render_template(template + '.html', **kwargs)
-    thr = Thread(target=send_async_email, args=[app, msg])
-    thr.start()
-    return thr
+    if app.config['MAIL_BACKEND'] == 'celery':
+        from .tasks import send_mail
+        send_mail.delay(message_data(msg))
+    elif app.config['MAIL_QUEUE_WORKERS']:
+        app.extensions['mail_queue'].put(msg)
+    else:
+        mail.send(msg)
+    return msg
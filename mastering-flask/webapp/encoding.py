@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+API响应的JSON编码
+
+这个版本的flask.jsonify对非Ajax请求默认缩进输出，使用标准库的编码器，
+日期时间还要经过JSONEncoder.default()一个个转换。这里：
+1. 编码器可以替换：JSON_BACKEND为None时依次尝试orjson、ujson，都没有安装时
+   使用标准库json；也可以指定为'orjson'、'ujson'或'json'；
+2. 输出不缩进、分隔符后面不加空格；
+3. 日期时间编码为与以前相同的HTTP日期格式(RFC 1123)，
+   不支持自定义类型的编码器在编码前先把数据转换一遍；
+4. 条目很多的列表分段编码，用流式响应逐个输出，不需要先拼出整个字符串。
+"""
+import datetime
+import json
+import uuid
+from flask import current_app, stream_with_context
+from werkzeug.http import http_date
+
+# 不设置JSON_BACKEND时依次尝试的编码器
+BACKENDS = ('orjson', 'ujson', 'json')
+MIMETYPE = 'application/json'
+
+
+def _default(o):
+    # 与flask.json.JSONEncoder.default()的转换规则相同
+    if isinstance(o, datetime.date):
+        return http_date(o.timetuple())
+    if isinstance(o, uuid.UUID):
+        return str(o)
+    if hasattr(o, '__html__'):
+        return unicode(o.__html__())
+    raise TypeError('%r is not JSON serializable' % (o,))
+
+
+def _prepare(o):
+    """把数据中JSON不支持的对象转换掉，用于没有default参数的编码器"""
+    if isinstance(o, dict):
+        return dict((k, _prepare(v)) for k, v in o.iteritems())
+    if isinstance(o, (list, tuple)):
+        return [_prepare(v) for v in o]
+    if o is None or isinstance(o, (basestring, int, long, float, bool)):
+        return o
+    return _default(o)
+
+
+def _orjson():
+    import orjson
+
+    def dumps(o, ensure_ascii):
+        # orjson总是输出UTF-8；日期时间交给default，保持以前的格式
+        return orjson.dumps(o, default=_default,
+                            option=orjson.OPT_PASSTHROUGH_DATETIME)
+    return dumps
+
+
+def _ujson():
+    import ujson
+
+    def dumps(o, ensure_ascii):
+        return ujson.dumps(_prepare(o), ensure_ascii=ensure_ascii,
+                           escape_forward_slashes=False)
+    return dumps
+
+
+def _json():
+    def dumps(o, ensure_ascii):
+        return json.dumps(o, ensure_ascii=ensure_ascii, default=_default,
+                          separators=(',', ':'))
+    return dumps
+
+
+_loaders = {'orjson': _orjson, 'ujson': _ujson, 'json': _json}
+
+
+def load_backend(name=None):
+    """返回(编码器名称, dumps函数)，name为None时使用第一个能导入的编码器"""
+    for candidate in ([name] if name else BACKENDS):
+        try:
+            return candidate, _loaders[candidate]()
+        except ImportError:
+            if name:
+                raise
+    raise RuntimeError('no JSON backend available')
+
+
+def _backend():
+    app = current_app._get_current_object()
+    backend = app.extensions.get('json_backend')
+    if backend is None:
+        backend = app.extensions.setdefault(
+            'json_backend', load_backend(app.config['JSON_BACKEND']))
+    return backend
+
+
+def dumps(o):
+    """用当前应用配置的编码器把o编码为紧凑的JSON"""
+    return _backend()[1](o, current_app.config['JSON_AS_ASCII'])
+
+
+def json_response(data, status=200, headers=None):
+    """代替flask.jsonify，返回紧凑编码的JSON响应"""
+    return current_app.response_class(dumps(data), status=status,
+                                      headers=headers, mimetype=MIMETYPE)
+
+
+def output_json(data, code, headers=None):
+    """Flask-RESTful的application/json输出函数"""
+    return json_response(data, code, headers)
+
+
+def _stream_list(name, items, rest):
+    # 把{name: [...], ...}拆开，列表中的条目一个个编码输出
+    yield '{%s:[' % dumps(name)
+    for i, item in enumerate(items):
+        if i:
+            yield ','
+        yield dumps(item.to_json())
+    yield ']'
+    for key, value in rest.items():
+        yield ',%s:%s' % (dumps(key), dumps(value))
+    yield '}'
+
+
+def list_response(name, items, rest, status=200, headers=None):
+    """
+    列表接口的响应：{name: [item.to_json(), ...], **rest}。
+    条目数不少于JSON_STREAM_MIN_ITEMS时使用流式响应。
+    """
+    items = list(items)
+    threshold = current_app.config['JSON_STREAM_MIN_ITEMS']
+    if threshold and len(items) >= threshold:
+        return current_app.response_class(
+            stream_with_context(_stream_list(name, items, rest)),
+            status=status, headers=headers, mimetype=MIMETYPE)
+    data = dict(rest)
+    data[name] = [item.to_json() for item in items]
+    return json_response(data, status, headers)
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+文章、评论、用户、关注关系的批量导出
+
+第三方集成以前一页页地抓取 /api/v1.0/posts/ 和 /api/v1.0/comments/，每一页都要
+重新执行COUNT和OFFSET。这里按主键用游标分批读取整张表(每批batch_size行，
+只使用Core查询，不创建ORM对象)，一边读取一边写出，内存占用与表的大小无关：
+    NDJSON: 每行一个JSON对象
+    CSV: 第一行为列名
+since参数只导出时间字段不早于since的行(包括等于since的行，重复的行按主键去重)，
+用于增量导出：文章为publish_date，评论为date，用户为register_time，
+关注为timestamp。时间使用ISO 8601格式(UTC)。
+"""
+import csv
+import datetime
+import io
+from sqlalchemy import and_
+from .encoding import dumps
+from .models import db, Post, Comment, User, Follow, _visible_comment
+from .pagination import _seek_filter
+
+# 导出的表: (表, 增量导出使用的时间字段, 导出的字段)
+# 用户只导出公开的资料，不包括email和密码散列
+EXPORTS = {
+    'posts': (Post.__table__, 'publish_date',
+              ('id', 'title', 'text', 'publish_date', 'user_id',
+               'comment_count')),
+    'comments': (Comment.__table__, 'date',
+                 ('id', 'name', 'text', 'date', 'post_id', 'user_id')),
+    'users': (User.__table__, 'register_time',
+              ('id', 'username', 'name', 'location', 'about_me',
+               'register_time', 'last_seen', 'post_count', 'comment_count',
+               'follower_count', 'following_count')),
+    'follows': (Follow.__table__, 'timestamp',
+                ('follower_id', 'following_id', 'timestamp')),
+}
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def parse_since(value):
+    """解析since参数，支持 2018-01-02、2018-01-02T03:04:05[.ffffff]"""
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError('invalid since: %s' % value)
+
+
+def export_rows(kind, since=None, batch_size=1000):
+    """按主键顺序逐行生成kind表的数据(字段名, 值)列表"""
+    table, time_column, names = EXPORTS[kind]
+    columns = [table.c[name] for name in names]
+    keys = list(table.primary_key.columns)
+    conditions = []
+    if since is not None:
+        conditions.append(table.c[time_column] >= since)
+    if kind == 'comments':
+        # 被查禁的评论不导出
+        conditions.append(_visible_comment(table.c.disabled))
+
+    last = None
+    while True:
+        where = list(conditions)
+        if last is not None:
+            where.append(_seek_filter(keys, last, False))
+        query = db.select(columns).order_by(*keys).limit(batch_size)
+        if where:
+            query = query.where(and_(*where))
+        rows = db.session.execute(query).fetchall()
+        for row in rows:
+            yield zip(names, row)
+        if len(rows) < batch_size:
+            break
+        last = [rows[-1][key.name] for key in keys]
+
+
+def _plain(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield dumps(dict((k, _plain(v)) for k, v in row)) + '\n'
+
+
+def _csv_value(value):
+    value = _plain(value)
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def csv_lines(kind, rows):
+    buf = io.BytesIO()
+    writer = csv.writer(buf)
+
+    def flush():
+        data = buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        return data
+
+    writer.writerow(EXPORTS[kind][2])
+    yield flush()
+    for row in rows:
+        writer.writerow([_csv_value(v) for k, v in row])
+        yield flush()
+
+
+def export(kind, format='ndjson', since=None, batch_size=1000):
+    """返回导出内容的生成器，每次生成一行"""
+    if kind not in EXPORTS:
+        raise ValueError('unknown export: %s' % kind)
+    if format not in FORMATS:
+        raise ValueError('unknown format: %s' % format)
+    rows = export_rows(kind, since, batch_size)
+    if format == 'csv':
+        return csv_lines(kind, rows)
+    return ndjson_lines(rows)
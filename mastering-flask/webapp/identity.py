@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+登录用户的缓存
+
+Flask-Login的load_user每个请求都要查询一次users表，Flask-Principal的
+on_identity_loaded还要再查询一次roles。这里把用户的常用字段和角色保存成一个
+简单的字典(快照)放在缓存中，请求开始时用session.merge(load=False)把快照还原成
+session中的User对象，不访问数据库；快照之外的字段在第一次访问时才会查询。
+
+快照的key中带有版本号，用户的角色、email、确认状态等字段变化时，
+在事务提交后给这个用户换一个新的版本号，旧的快照不会再被读到。
+和直接删除缓存相比，版本号可以避免其他请求把提交前读到的旧数据重新写回缓存。
+"""
+import binascii
+import os
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import joinedload, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from .caching import get_cache
+from .extensions import login_manager
+from .models import db, User, Role, roles_users_table
+
+# 快照中保存的字段，这些字段变化时快照失效
+SNAPSHOT_COLUMNS = ('id', 'username', 'confirmed', 'gravatar_hash',
+                    'last_seen')
+
+
+def _version_key(user_id):
+    return 'user_snapshot_version:%d' % user_id
+
+
+def _snapshot_key(user_id, version):
+    return 'user_snapshot:%d:%s' % (user_id, version)
+
+
+def _new_version():
+    return binascii.hexlify(os.urandom(8))
+
+
+def _current_version(store, user_id):
+    version = store.get(_version_key(user_id))
+    if version is None:
+        # 版本号丢失(例如被LRU淘汰)时换一个新的，不会再读到之前的快照
+        version = _new_version()
+        store.set(_version_key(user_id), version, timeout=0)
+    return version
+
+
+def make_snapshot(user):
+    snapshot = dict((name, getattr(user, name)) for name in SNAPSHOT_COLUMNS)
+    snapshot['roles'] = [(role.id, role.name) for role in user.roles]
+    return snapshot
+
+
+def _detached(cls, values):
+    # 不调用__init__构造对象，set_committed_value设置的值不会被当作修改
+    obj = cls.__mapper__.class_manager.new_instance()
+    for name, value in values.items():
+        set_committed_value(obj, name, value)
+    make_transient_to_detached(obj)
+    return obj
+
+
+def restore_snapshot(snapshot):
+    """把快照还原为当前session中的User对象"""
+    values = dict(snapshot)
+    roles = [_detached(Role, {'id': id, 'name': name})
+             for id, name in values.pop('roles')]
+    user = _detached(User, values)
+    set_committed_value(user, 'roles', roles)
+    return db.session.merge(user, load=False)
+
+
+def load_cached_user(user_id):
+    store = get_cache()
+    key = _snapshot_key(user_id, _current_version(store, user_id))
+    snapshot = store.get(key)
+    if snapshot is not None:
+        return restore_snapshot(snapshot)
+
+    user = User.query.options(joinedload(User.roles)).get(user_id)
+    if user is not None:
+        store.set(key, make_snapshot(user),
+                  timeout=current_app.config['USER_CACHE_TIMEOUT'])
+    return user
+
+
+def invalidate_user(user_id):
+    get_cache().set(_version_key(user_id), _new_version(), timeout=0)
+
+
+# 加载用户的回调函数load_user, 接收以Unicode字符串形式表示的用户标识符
+# Flask-Login会把结果保存在请求上下文中，同一个请求内只调用一次
+@login_manager.user_loader
+def load_user(userid):
+    # 字符串userid转为int再查询
+    return load_cached_user(int(userid))
+
+
+def _changed_users(session):
+    changed = set()
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            changed.add(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, User):
+            attrs = inspect(obj).attrs
+            for name in SNAPSHOT_COLUMNS + ('email', 'roles'):
+                if attrs[name].history.has_changes():
+                    changed.add(obj.id)
+                    break
+    # 角色改名或删除时，拥有该角色的用户都要失效
+    roles = [obj.id for obj in session.dirty | session.deleted
+             if isinstance(obj, Role) and obj.id is not None]
+    if roles:
+        changed.update(user_id for user_id, in session.connection().execute(
+            db.select([roles_users_table.c.user_id]).where(
+                roles_users_table.c.role_id.in_(roles))))
+    return changed
+
+
+@event.listens_for(db.session, 'after_flush')
+def _track_user_changes(session, flush_context):
+    changed = _changed_users(session)
+    if changed:
+        session.info.setdefault('changed_users', set()).update(changed)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_users_on_commit(session):
+    changed = session.info.pop('changed_users', None)
+    if changed and has_app_context():
+        for user_id in changed:
+            invalidate_user(user_id)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_user_changes(session):
+    session.info.pop('changed_users', None)
@@ -1,14 +1,19 @@
 # -*- coding: utf-8 -*-
+import collections
 import datetime
 import hashlib
 import random
-from flask import current_app, request, url_for
+from flask import current_app, request
 from flask_login import UserMixin, AnonymousUserMixin
 from flask_sqlalchemy import SQLAlchemy
-from itsdangerous import TimedJSONWebSignatureSerializer as Serializer, \
-    SignatureExpired, BadSignature
-from .extensions import bcrypt, cache, login_manager
+from sqlalchemy import event, func, inspect, or_, select
+from sqlalchemy.orm import defer, joinedload, subqueryload
+from sqlalchemy.orm.util import identity_key
+from .extensions import cache, login_manager
 from .exceptions import ValidationError
+from .tokens import get_serializer, revoke_user_tokens, verify_token
+from .passwords import hash_password, check_password
+from .serializers import external_url
 
 db = SQLAlchemy()
 
@@ -32,6 +37,13 @@ roles_users_table = db.Table(
 # follows table
 class Follow(db.Model):
     __tablename__ = 'follows'
+    # 关注者/被关注者列表按(timestamp, 对方id)做游标分页
+    __table_args__ = (
+        db.Index('ix_follows_following_id_timestamp',
+                 'following_id', 'timestamp'),
+        db.Index('ix_follows_follower_id_timestamp',
+                 'follower_id', 'timestamp'),
+    )
     follower_id = db.Column(db.Integer(), db.ForeignKey('users.id'),
                             primary_key=True)
     following_id = db.Column(db.Integer(), db.ForeignKey('users.id'),
@@ -39,6 +51,31 @@ class Follow(db.Model):
     timestamp = db.Column(db.DateTime(), default=datetime.datetime.utcnow)
 
 
+# 关注时间线：开启TIMELINE_FANOUT后，发表文章时把文章写入每个关注者的时间线(写扩散)，
+# 读取时间线时按user_id直接取出，不需要关联follows表再排序
+class TimelineEntry(db.Model):
+    __tablename__ = 'timelines'
+    __table_args__ = (
+        db.Index('ix_timelines_user_id_publish_date',
+                 'user_id', 'publish_date', 'post_id'),
+    )
+    user_id = db.Column(db.Integer(), db.ForeignKey('users.id'),
+                        primary_key=True)
+    post_id = db.Column(db.Integer(), db.ForeignKey('posts.id'),
+                        primary_key=True, index=True)
+    author_id = db.Column(db.Integer(), db.ForeignKey('users.id'))
+    publish_date = db.Column(db.DateTime())
+
+
+# 每周摘要的发送记录：每周每个收件人一条，digest任务重复执行时不会重复发送
+class DigestDelivery(db.Model):
+    __tablename__ = 'digest_deliveries'
+    week = db.Column(db.Date(), primary_key=True)
+    user_id = db.Column(db.Integer(), db.ForeignKey('users.id'),
+                        primary_key=True)
+    sent_at = db.Column(db.DateTime(), default=datetime.datetime.utcnow)
+
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
 
@@ -56,6 +93,20 @@ class User(UserMixin, db.Model):
     last_seen = db.Column(db.DateTime(), default=datetime.datetime.utcnow)
     # 把email的MD5散列值保存在数据库
     gravatar_hash = db.Column(db.String(32))
+    # 冗余保存的计数，由文件末尾的after_flush事件在同一个事务中维护，
+    # 显示或序列化用户时不再需要执行COUNT查询
+    post_count = db.Column(db.Integer(), default=0, server_default='0',
+                           nullable=False)
+    comment_count = db.Column(db.Integer(), default=0, server_default='0',
+                              nullable=False)
+    follower_count = db.Column(db.Integer(), default=0, server_default='0',
+                               nullable=False)
+    following_count = db.Column(db.Integer(), default=0, server_default='0',
+                                nullable=False)
+    # 关注者超过TIMELINE_FANOUT_LIMIT时没有做写扩散，有些关注者的时间线中缺少他的文章，
+    # 读取时间线时要合并进来；关注者减少后仍然保留，rebuild_timeline时重新计算
+    timeline_pull = db.Column(db.Boolean(), default=False, server_default='0',
+                              nullable=False)
     # user-post relations
     posts = db.relationship('Post', backref='user', lazy='dynamic')
     # NOTE：狗书中的user-role没有使用扩展, 是一对多的关系，
@@ -97,17 +148,21 @@ class User(UserMixin, db.Model):
 
     @password.setter
     def password(self, password):
-        self.password_hash = bcrypt.generate_password_hash(password)
+        self.password_hash = hash_password(password)
+        # 修改密码后，之前签发的API令牌全部失效
+        if self.id is not None:
+            revoke_user_tokens(self.id)
 
-    def check_password(self, password):
-        return bcrypt.check_password_hash(self.password_hash, password)
+    # bcrypt在线程池中执行，参数含义见passwords.check_password
+    def check_password(self, password, cache=False, rehash=False):
+        return check_password(self, password, cache=cache, rehash=rehash)
 
     def generate_confirmation_token(self, expiration=3600):
-        s = Serializer(current_app.config['SECRET_KEY'], expiration)
+        s = get_serializer(expiration)
         return s.dumps({'confirm': self.id})
 
     def confirm(self, token):
-        s = Serializer(current_app.config['SECRET_KEY'])
+        s = get_serializer()
         try:
             data = s.loads(token)
         except:
@@ -123,11 +178,11 @@ class User(UserMixin, db.Model):
         return True
 
     def generate_reset_token(self, email, expiration=3600):
-        s = Serializer(current_app.config['SECRET_KEY'], expiration)
+        s = get_serializer(expiration)
         return s.dumps({'reset': self.id, 'email': email})
 
     def reset_password(self, token, new_password):
-        s = Serializer(current_app.config['SECRET_KEY'])
+        s = get_serializer()
         try:
             data = s.loads(token)
         except:
@@ -143,11 +198,11 @@ class User(UserMixin, db.Model):
         return True
 
     def generate_email_change_token(self, new_email, expiration=3600):
-        s = Serializer(current_app.config['SECRET_KEY'], expiration)
+        s = get_serializer(expiration)
         return s.dumps({'change_email': self.id, 'new_email': new_email})
 
     def change_email(self, token):
-        s = Serializer(current_app.config['SECRET_KEY'])
+        s = get_serializer()
         try:
             data = s.loads(token)
         except:
@@ -186,6 +241,22 @@ class User(UserMixin, db.Model):
 
     @property
     def following_posts(self):
+        if current_app.config['TIMELINE_FANOUT']:
+            # 写扩散的时间线中直接保存了文章id；曾经因为关注者太多而没有做写扩散的作者，
+            # 他们的文章在读取时再合并进来。
+            # 两部分都写成IN子查询，避免UNION把整个时间线物化后再排序
+            pushed = db.session.query(TimelineEntry.post_id).filter(
+                TimelineEntry.user_id == self.id)
+            popular = db.session.query(Follow.following_id).join(
+                User, User.id == Follow.following_id
+            ).filter(
+                Follow.follower_id == self.id,
+                User.timeline_pull == True
+            )
+            return Post.query.filter(or_(
+                Post.id.in_(pushed.subquery()),
+                Post.user_id.in_(popular.subquery())
+            ))
         return Post.query.join(
             Follow, Follow.following_id == Post.user_id
         ).filter(Follow.follower_id == self.id)
@@ -273,37 +344,31 @@ class User(UserMixin, db.Model):
 
     # 生成一个签名令牌，用于RESTful API
     def generate_auth_token(self, expiration=600):
-        s = Serializer(current_app.config['SECRET_KEY'],
-                       expires_in=expiration)
+        s = get_serializer(expiration)
         return s.dumps({'id': self.id}).decode('ascii')
 
     # 解码令牌，用于RESTful API
+    # 令牌到用户id的映射和用户快照都有缓存，重复使用同一令牌时不需要访问数据库
     @staticmethod
-    # @cache.memoize(timeout=60)
     def verify_auth_token(token):
-        s = Serializer(current_app.config['SECRET_KEY'])
-
-        try:
-            data = s.loads(token)
-        except SignatureExpired:
+        user_id = verify_token(token)
+        if user_id is None:
             return None
-        except BadSignature:
-            return None
-
-        user = User.query.get(data['id'])
-        return user
+        # identity模块依赖本模块，只能在这里导入
+        from .identity import load_cached_user
+        return load_cached_user(user_id)
 
     # 将资源序列化为JSON
     def to_json(self):
         json_user = {
-            'url': url_for('api.get_user', id=self.id, _external=True),
+            'url': external_url('api.get_user', self.id),
             'username': self.username,
             'member_since': self.register_time,
             'last_seen': self.last_seen,
-            'posts': url_for('api.get_user_posts', id=self.id, _external=True),
-            'following_posts': url_for('api.get_user_following_posts',
-                                       id=self.id, _external=True),
-            'post_count': self.posts.count()
+            'posts': external_url('api.get_user_posts', self.id),
+            'following_posts': external_url('api.get_user_following_posts',
+                                            self.id),
+            'post_count': self.post_count
         }
         return json_user
 
@@ -317,13 +382,6 @@ class AnonymousUser(AnonymousUserMixin):
 login_manager.anonymous_user = AnonymousUser
 
 
-# 加载用户的回调函数load_user, 接收以Unicode字符串形式表示的用户标识符
-@login_manager.user_loader
-def load_user(userid):
-    # 字符串userid转为int再查询
-    return User.query.get(int(userid))
-
-
 class Role(db.Model):
     __tablename__ = 'roles'
 
@@ -354,13 +412,26 @@ class Role(db.Model):
 
 class Post(db.Model):
     __tablename__ = 'posts'
+    # 用户文章列表按(publish_date, id)做游标分页
+    __table_args__ = (
+        db.Index('ix_posts_user_id_publish_date', 'user_id', 'publish_date'),
+    )
 
     id = db.Column(db.Integer(), primary_key=True)
     title = db.Column(db.String(255))
     text = db.Column(db.Text())
+    # 正文预先渲染的结果，由rendering模块在正文被赋值时生成：
+    # 去掉HTML标签后的纯文本、清理后的HTML、列表中显示的摘要和渲染规则的版本
+    text_plain = db.Column(db.Text())
+    text_html = db.Column(db.Text())
+    excerpt = db.Column(db.Text())
+    render_version = db.Column(db.Integer())
     publish_date = db.Column(
         db.DateTime(), index=True, default=datetime.datetime.utcnow)
     user_id = db.Column(db.Integer(), db.ForeignKey('users.id'))
+    # 未被查禁的评论数，和User中的计数一样由after_flush事件维护
+    comment_count = db.Column(db.Integer(), default=0, server_default='0',
+                              nullable=False)
     comments = db.relationship('Comment', backref='post', lazy='dynamic')
     tags = db.relationship('Tag', secondary=posts_tags_table,
                            backref=db.backref('posts', lazy='dynamic'))
@@ -371,6 +442,23 @@ class Post(db.Model):
     def __repr__(self):
         return "<Post '{}'>".format(self.title)
 
+    # 文章列表的公共查询：按发布时间倒序，作者通过JOIN一并取出，标签用一次子查询批量加载。
+    # 这样渲染_posts.html或序列化一页文章时，不会再为每篇文章单独查询users和tags表，
+    # 无论每页显示多少篇文章，查询次数都是固定的。
+    # 只显示摘要的页面用full_text=False，不读取正文和渲染后的全文
+    @staticmethod
+    def listing(query=None, full_text=True):
+        if query is None:
+            query = Post.query
+        query = query.options(
+            joinedload(Post.user),
+            subqueryload(Post.tags)
+        )
+        if not full_text:
+            query = query.options(defer(Post.text), defer(Post.text_plain),
+                                  defer(Post.text_html))
+        return query.order_by(Post.publish_date.desc())
+
     @staticmethod
     def generate_fake(count=100):
         import forgery_py
@@ -393,15 +481,13 @@ class Post(db.Model):
     # 将资源序列化为JSON
     def to_json(self):
         json_post = {
-            'url': url_for('api.get_post', id=self.id, _external=True),
+            'url': external_url('api.get_post', self.id),
             'title': self.title,
             'text': self.text,
             'publish_date': self.publish_date,
-            'author': url_for('api.get_user', id=self.user_id,
-                              _external=True),
-            'comments': url_for('api.get_post_comments', id=self.id,
-                                _external=True),
-            'comment_count': self.comments.count()
+            'author': external_url('api.get_user', self.user_id),
+            'comments': external_url('api.get_post_comments', self.id),
+            'comment_count': self.comment_count
         }
         return json_post
 
@@ -420,13 +506,23 @@ class Post(db.Model):
 
 class Comment(db.Model):
     __tablename__ = 'comments'
+    # 文章评论列表只显示未被查禁的评论，按(date, id)做游标分页
+    __table_args__ = (
+        db.Index('ix_comments_post_id_disabled_date',
+                 'post_id', 'disabled', 'date'),
+    )
 
     id = db.Column(db.Integer(), primary_key=True)
     name = db.Column(db.String(255))
     text = db.Column(db.Text())
     date = db.Column(db.DateTime(), index=True, default=datetime.datetime.utcnow)
-    disabled = db.Column(db.Boolean())  # 查禁不当评论
-    user_id = db.Column(db.Integer(), db.ForeignKey('users.id'))
+    # 查禁不当评论；active_history保证修改时能拿到旧值，以便维护评论计数
+    disabled = db.column_property(
+        db.Column(db.Boolean(), default=False, server_default='0',
+                  nullable=False),
+        active_history=True)
+    # 批量审核按评论者选出评论
+    user_id = db.Column(db.Integer(), db.ForeignKey('users.id'), index=True)
     post_id = db.Column(db.Integer(), db.ForeignKey('posts.id'))
 
     def __init__(self, name):
@@ -457,13 +553,13 @@ class Comment(db.Model):
 
     def to_json(self):
         json_comment = {
-            'url': url_for('api.get_comment', id=self.id, _external=True),
+            'url': external_url('api.get_comment', self.id),
             'name': self.name,
             'text': self.text,
             'date': self.date,
             'disabled': self.disabled,
-            'author': url_for('api.get_user', id=self.user_id, _external=True),
-            'post': url_for('api.get_post', id=self.post_id, _external=True)
+            'author': external_url('api.get_user', self.user_id),
+            'post': external_url('api.get_post', self.post_id)
         }
         return json_comment
 
@@ -483,7 +579,8 @@ class Tag(db.Model):
     __tablename__ = 'tags'
 
     id = db.Column(db.Integer(), primary_key=True)
-    title = db.Column(db.String(255))
+    # 唯一索引保证并发创建同名标签时只有一个能写入，见tagging模块
+    title = db.Column(db.String(255), index=True, unique=True)
 
     def __init__(self, title):
         self.title = title
@@ -495,10 +592,127 @@ class Tag(db.Model):
     def generate_fake(count=10):
         from random import seed
         import forgery_py
+        from .tagging import resolve_tags
 
         seed()
-        for i in xrange(count):
-            t = Tag(title=forgery_py.lorem_ipsum.word())
-            db.session.add(t)
+        # 标题唯一，随机生成的重复单词和已有的标签只保留一个
+        resolve_tags([forgery_py.lorem_ipsum.word() for i in xrange(count)])
+
+        db.session.commit()
+
 
+# ******************* 冗余计数的维护 ***************************************** #
+
+def _visible_comment(comment_disabled):
+    # disabled不允许为NULL(迁移时旧数据的NULL改成了False)，
+    # 用等值条件才能使用(post_id, disabled, date)索引
+    return comment_disabled == False
+
+
+def _counter_definitions():
+    """返回(model, 计数字段, 实际数量的关联子查询)的列表"""
+    posts = Post.__table__
+    comments = Comment.__table__
+    follows = Follow.__table__
+    users = User.__table__
+    return [
+        (User, users.c.post_count,
+         select([func.count(posts.c.id)]).where(
+             posts.c.user_id == users.c.id).as_scalar()),
+        (User, users.c.comment_count,
+         select([func.count(comments.c.id)]).where(
+             (comments.c.user_id == users.c.id) &
+             _visible_comment(comments.c.disabled)).as_scalar()),
+        (User, users.c.follower_count,
+         select([func.count()]).select_from(follows).where(
+             follows.c.following_id == users.c.id).as_scalar()),
+        (User, users.c.following_count,
+         select([func.count()]).select_from(follows).where(
+             follows.c.follower_id == users.c.id).as_scalar()),
+        (Post, posts.c.comment_count,
+         select([func.count(comments.c.id)]).where(
+             (comments.c.post_id == posts.c.id) &
+             _visible_comment(comments.c.disabled)).as_scalar()),
+    ]
+
+
+def check_counters(repair=False):
+    """
+    重新统计所有冗余计数字段，返回{'users.post_count': 不一致的行数, ...}。
+    repair为True时用一条UPDATE语句把不一致的计数批量修正过来。
+    """
+    drift = {}
+    for model, column, actual in _counter_definitions():
+        table = model.__table__
+        mismatch = column != actual
+        drift[str(column)] = db.session.execute(
+            select([func.count()]).select_from(table).where(mismatch)
+        ).scalar()
+        if repair and drift[str(column)]:
+            db.session.execute(
+                table.update().where(mismatch).values({column.name: actual}))
+    if repair:
         db.session.commit()
+    return drift
+
+
+def _count_changes(session):
+    """统计一次flush对各计数字段的影响，返回{(model, id): {字段名: 变化量}}"""
+    deltas = collections.defaultdict(collections.Counter)
+
+    def add(model, id, column, delta):
+        if id is not None:
+            deltas[(model, id)][column] += delta
+
+    def count(obj, delta):
+        if isinstance(obj, Post):
+            add(User, obj.user_id, 'post_count', delta)
+        elif isinstance(obj, Comment):
+            if not obj.disabled:
+                add(User, obj.user_id, 'comment_count', delta)
+                add(Post, obj.post_id, 'comment_count', delta)
+        elif isinstance(obj, Follow):
+            add(User, obj.following_id, 'follower_count', delta)
+            add(User, obj.follower_id, 'following_count', delta)
+
+    for obj in session.new:
+        count(obj, 1)
+    for obj in session.deleted:
+        count(obj, -1)
+    # 查禁或恢复评论同样会改变计数
+    for obj in session.dirty:
+        if not isinstance(obj, Comment):
+            continue
+        history = inspect(obj).attrs.disabled.history
+        if not history.added or not history.deleted:
+            continue
+        delta = int(not history.added[0]) - int(not history.deleted[0])
+        if delta:
+            add(User, obj.user_id, 'comment_count', delta)
+            add(Post, obj.post_id, 'comment_count', delta)
+    return deltas
+
+
+# after_flush时所有新对象都已经拿到了主键和外键，而session.new/dirty/deleted以及属性的
+# 修改历史仍然是flush之前的状态。计数用 SET x = x + n 在同一个事务中更新，并发写入也不会丢失。
+@event.listens_for(db.session, 'after_flush')
+def _update_counters(session, flush_context):
+    changed = session.info.setdefault('changed_counters', [])
+    for (model, id), columns in _count_changes(session).items():
+        columns = dict((k, v) for k, v in columns.items() if v)
+        if not columns:
+            continue
+        table = model.__table__
+        session.connection().execute(
+            table.update().where(table.c.id == id).values(
+                dict((k, table.c[k] + v) for k, v in columns.items())))
+        changed.append((model, id, list(columns)))
+
+
+# 数据库中的计数已经变了，让内存中对应对象的计数字段失效，下次访问时重新加载
+@event.listens_for(db.session, 'after_flush_postexec')
+def _expire_counters(session, flush_context):
+    for model, id, columns in session.info.pop('changed_counters', []):
+        obj = session.identity_map.get(identity_key(model, id))
+        if obj is not None:
+            session.expire(obj, columns)
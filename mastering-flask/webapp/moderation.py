@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+评论的批量审核
+
+以前管理员只能在文章页面上一条条地点击Enable/Disable，每次都要加载评论、
+commit再重定向，处理一波垃圾评论要几百个来回。moderate()按条件选出评论：
+    ids: 评论id的列表
+    user_id: 评论者
+    post_id: 所属文章
+    pattern: 正文中包含的文本(不区分大小写)
+多个条件同时满足，然后用一条UPDATE(或DELETE)语句查禁、恢复或删除所有选中的评论。
+disable_user_comments()是查禁某个用户全部评论的快捷方式。
+
+Core语句不会触发session事件，这里一并处理ORM写入时由事件完成的工作：
+文章和用户的评论计数、全文索引，以及事务提交后整页缓存的失效。
+需要处理的评论先用一条查询取出(id, post_id, user_id)，再按(文章, 评论者)分组执行
+UPDATE或DELETE。查询和修改之间其他事务可能已经改变了评论的状态，所以修改语句中
+再次带上状态条件，计数按每组语句实际影响的行数(rowcount)调整。
+"""
+import collections
+from sqlalchemy import and_, not_, select
+from sqlalchemy.orm.util import identity_key
+from .models import db, Post, Comment, User, _visible_comment
+from .bulk import _add_counts
+from .search import index_comments
+from .pagecache import invalidate_after_commit, post_tag, user_tag, \
+    comment_tag, COMMENTS
+
+comments = Comment.__table__
+
+ACTIONS = ('enable', 'disable', 'delete')
+# 修改和重建索引时每条语句中的评论id数，SQLite的参数个数有上限
+CHUNK_SIZE = 500
+
+
+def _like_pattern(text):
+    # LIKE中的通配符按普通字符匹配
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return u'%' + escaped + u'%'
+
+
+def selection(ids=None, user_id=None, post_id=None, pattern=None):
+    """选出评论的条件，没有任何条件时抛出ValueError"""
+    conditions = []
+    if ids is not None:
+        conditions.append(comments.c.id.in_(list(ids) or [None]))
+    if user_id is not None:
+        conditions.append(comments.c.user_id == user_id)
+    if post_id is not None:
+        conditions.append(comments.c.post_id == post_id)
+    if pattern:
+        conditions.append(comments.c.text.ilike(_like_pattern(pattern),
+                                                escape='\\'))
+    if not conditions:
+        raise ValueError('no comments selected')
+    return and_(*conditions)
+
+
+def _state_filter(action):
+    # 只处理状态会改变的评论：查禁可见的评论、恢复被查禁的评论
+    visible = _visible_comment(comments.c.disabled)
+    if action == 'enable':
+        return not_(visible)
+    if action == 'disable':
+        return visible
+    return None
+
+
+def _chunks(ids):
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+
+def _apply(conn, action, ids):
+    """
+    修改ids中仍然满足状态条件的评论，返回(处理的评论数, 可见评论数的变化)
+    """
+    visible = _visible_comment(comments.c.disabled)
+    count = delta = 0
+    for chunk in _chunks(ids):
+        selected = comments.c.id.in_(chunk)
+        if action == 'delete':
+            # 计数只包含未被查禁的评论，先删除可见的评论以得到它们的数量
+            deleted = conn.execute(comments.delete().where(
+                and_(selected, visible))).rowcount
+            delta -= deleted
+            count += deleted + conn.execute(
+                comments.delete().where(selected)).rowcount
+        else:
+            changed = conn.execute(comments.update().where(
+                and_(selected, _state_filter(action))).values(
+                    disabled=action == 'disable')).rowcount
+            count += changed
+            delta += changed if action == 'enable' else -changed
+    return count, delta
+
+
+def moderate(action, ids=None, user_id=None, post_id=None, pattern=None):
+    """
+    对选中的评论执行action('enable'、'disable'或'delete')，返回处理的评论数。
+    和其他修改一起在调用方的事务中提交。
+    """
+    if action not in ACTIONS:
+        raise ValueError('unknown action: %s' % action)
+    where = selection(ids, user_id, post_id, pattern)
+    state = _state_filter(action)
+    if state is not None:
+        where = and_(where, state)
+
+    session = db.session()
+    conn = session.connection()
+    rows = conn.execute(select([comments.c.id, comments.c.post_id,
+                                comments.c.user_id])
+                        .where(where)).fetchall()
+    if not rows:
+        return 0
+    groups = collections.defaultdict(list)
+    for row in rows:
+        groups[row.post_id, row.user_id].append(row.id)
+    total = 0
+    posts = collections.Counter()
+    users = collections.Counter()
+    for (post_id, user_id), group in groups.items():
+        count, delta = _apply(conn, action, group)
+        total += count
+        posts[post_id] += delta
+        users[user_id] += delta
+    _add_counts(session, Post, 'comment_count',
+                dict((id, n) for id, n in posts.items() if n))
+    _add_counts(session, User, 'comment_count',
+                dict((id, n) for id, n in users.items() if n))
+
+    comment_ids = [row.id for row in rows]
+    for chunk in _chunks(comment_ids):
+        index_comments(conn, chunk)
+    for id in comment_ids:
+        obj = session.identity_map.get(identity_key(Comment, id))
+        if obj is not None:
+            if action == 'delete':
+                session.expunge(obj)
+            else:
+                session.expire(obj, ['disabled'])
+    tags = set([COMMENTS])
+    tags.update(comment_tag(id) for id in comment_ids)
+    tags.update(post_tag(row.post_id) for row in rows
+                if row.post_id is not None)
+    tags.update(user_tag(row.user_id) for row in rows
+                if row.user_id is not None)
+    invalidate_after_commit(session, *tags)
+    return total
+
+
+def disable_user_comments(user_id):
+    """查禁user_id的所有评论，返回查禁的评论数"""
+    return moderate('disable', user_id=user_id)
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+匿名访问者的整页缓存
+
+以前home、post、tag、user几个视图上的@cache.cached(timeout=60)都被注释掉了：
+缓存的页面在文章或评论变化后要过一分钟才更新，而且登录用户看到的页面(编辑按钮、
+评论表单)也会被缓存下来给别人看到。现在：
+1. 只缓存匿名用户的GET请求，key为完整的URL；登录用户、带有闪现消息的请求
+   以及修改了session的响应都不经过缓存；
+2. 视图渲染时用depends_on()记录页面依赖的标签(文章、用户、标签、侧边栏)，
+   缓存中和页面一起保存每个标签当时的版本号；
+3. 模型变化时由session事件在事务提交后给相关标签换一个新的版本号，
+   读取缓存时只要有一个标签的版本号变了，页面就作废。新发表一条评论只会让
+   显示了这篇文章的页面失效。
+缓存命中时不执行视图，也不访问数据库。页面的ETag和Last-Modified同样由标签的版本号
+计算(见conditional模块)，浏览器带着匹配的校验值再次请求时直接返回304。
+版本号必须保存在所有进程共享的缓存中，否则其他进程看不到失效，
+没有共享缓存的多进程部署不启用整页缓存(见caching.cache_is_shared)。
+"""
+import binascii
+import functools
+import hashlib
+import os
+import time
+from flask import current_app, g, has_app_context, request, session
+from flask_login import current_user
+from sqlalchemy import event, inspect
+from .caching import get_cache, cache_is_shared
+from .conditional import Validators, NoValidators
+from .models import db, User, Post, Comment, Tag, posts_tags_table, \
+    _count_changes
+
+# 所有页面都依赖的标签，用于清空整个页面缓存
+ALL_PAGES = '*'
+# 首页文章列表，文章的发表、删除和发布时间变化时失效
+POSTS = 'posts'
+# 全部评论的列表，评论的发表和删除时失效
+COMMENTS = 'comments'
+# 响应中这些头部不保存到缓存中
+SKIP_HEADERS = ('Set-Cookie', 'Content-Length')
+
+
+def post_tag(post_id):
+    return 'post:%d' % post_id
+
+
+def user_tag(user_id):
+    return 'user:%d' % user_id
+
+
+def author_tag(user_id):
+    # 只显示用户名和头像的地方(文章列表、评论)依赖这个标签，
+    # 发表评论等引起的计数变化不会让这些页面失效
+    return 'author:%d' % user_id
+
+
+def comment_tag(comment_id):
+    return 'comment:%d' % comment_id
+
+
+def tag_tag(tag_id):
+    return 'tag:%d' % tag_id
+
+
+def _version_key(tag):
+    return 'page_tag_version:%s' % tag
+
+
+def _page_key(url):
+    if isinstance(url, unicode):
+        url = url.encode('utf-8')
+    return 'page:' + hashlib.sha1(url).hexdigest()
+
+
+def _new_version():
+    # 版本号的前半部分是产生的时间，用作Last-Modified
+    return '%x-%s' % (int(time.time()), binascii.hexlify(os.urandom(6)))
+
+
+def version_time(version):
+    try:
+        return int(version.split('-', 1)[0], 16)
+    except (AttributeError, ValueError):
+        # 无法识别的版本号当作刚刚产生的
+        return int(time.time())
+
+
+def _versions(store, tags):
+    """返回标签当前的版本号，版本号丢失时换一个新的"""
+    tags = list(tags)
+    versions = {}
+    if not tags:
+        return versions
+    for tag, version in zip(tags, store.get_many(
+            *[_version_key(tag) for tag in tags])):
+        if version is None:
+            version = _new_version()
+            store.set(_version_key(tag), version, timeout=0)
+        versions[tag] = version
+    return versions
+
+
+def _validators(versions, variant=None):
+    return Validators(versions, [version_time(v) for v in versions.values()],
+                      variant)
+
+
+def validators(*tags, **kwargs):
+    """
+    返回依赖这些标签的资源的ETag和Last-Modified，没有共享缓存时不使用校验值；
+    内容随用户身份变化时用关键字参数variant区分
+    """
+    if not cache_is_shared():
+        return NoValidators()
+    return _validators(_versions(get_cache(), tags), kwargs.get('variant'))
+
+
+def depends_on(*tags):
+    """记录当前页面依赖的标签，应在查询对应的数据之前调用"""
+    pending = getattr(g, 'page_tags', None)
+    if pending is None:
+        return
+    store = get_cache()
+    new = [tag for tag in tags if tag not in pending]
+    pending.update(_versions(store, new))
+
+
+def depends_on_posts(posts):
+    """列表页面依赖其中的每篇文章和文章的作者"""
+    tags = []
+    for post in posts:
+        tags.append(post_tag(post.id))
+        tags.append(author_tag(post.user_id))
+    depends_on(*tags)
+
+
+def invalidate_pages(*tags):
+    """让依赖这些标签的缓存页面全部失效"""
+    store = get_cache()
+    for tag in tags:
+        store.set(_version_key(tag), _new_version(), timeout=0)
+
+
+def _cacheable():
+    return request.method == 'GET' \
+        and current_app.config['PAGE_CACHE_TIMEOUT'] \
+        and not current_user.is_authenticated \
+        and '_flashes' not in session \
+        and cache_is_shared()
+
+
+def _fresh(store, entry):
+    tags = entry['tags']
+    current = _versions(store, tags)
+    return all(current[tag] == version for tag, version in tags.items())
+
+
+def _respond(response, tags):
+    # 浏览器中保存的页面仍然有效时返回304，否则给响应加上校验值
+    checks = _validators(tags)
+    return checks.not_modified() or checks.apply(response)
+
+
+def cached_page(f):
+    """视图装饰器：匿名用户的GET请求使用整页缓存"""
+    @functools.wraps(f)
+    def decorated(*args, **kwargs):
+        if not _cacheable():
+            return f(*args, **kwargs)
+
+        store = get_cache()
+        key = _page_key(request.url)
+        entry = store.get(key)
+        if entry is not None and _fresh(store, entry):
+            response = current_app.response_class(
+                entry['body'], headers=entry['headers'])
+            response.headers['X-Page-Cache'] = 'HIT'
+            return _respond(response, entry['tags'])
+
+        g.page_tags = {}
+        depends_on(ALL_PAGES)
+        response = current_app.make_response(f(*args, **kwargs))
+        tags, g.page_tags = g.page_tags, None
+        if response.status_code == 200 and not session.modified \
+                and not response.direct_passthrough:
+            store.set(key, {
+                'body': response.get_data(),
+                'headers': [(k, v) for k, v in response.headers
+                            if k not in SKIP_HEADERS],
+                'tags': tags
+            }, timeout=current_app.config['PAGE_CACHE_TIMEOUT'])
+        response.headers['X-Page-Cache'] = 'MISS'
+        if response.status_code != 200:
+            return response
+        return _respond(response, tags)
+    return decorated
+
+
+def _history_ids(obj, name):
+    # 关联属性修改前后涉及的所有对象的id
+    history = inspect(obj).attrs[name].history
+    return [o.id for o in history.sum() if o is not None]
+
+
+def _changed_tags(session):
+    """根据这次flush中变化的对象，返回需要失效的标签"""
+    tags = set()
+    post_ids = set()
+    user_ids = set()
+    author_ids = set()
+    comment_ids = set()
+    tag_ids = set()
+    # 自身被修改或删除的标签
+    renamed_tag_ids = set()
+    for obj in session.new | session.deleted:
+        if isinstance(obj, Post):
+            tags.update([POSTS, post_tag(obj.id)])
+            user_ids.add(obj.user_id)
+            # 只使用已经加载的标签，被删除的文章不再查询
+            tag_ids.update(t.id for t in obj.__dict__.get('tags', ()))
+        elif isinstance(obj, Comment):
+            tags.add(COMMENTS)
+            post_ids.add(obj.post_id)
+            comment_ids.add(obj.id)
+        elif isinstance(obj, User):
+            user_ids.add(obj.id)
+            author_ids.add(obj.id)
+        elif isinstance(obj, Tag):
+            renamed_tag_ids.add(obj.id)
+    for obj in session.dirty:
+        if not session.is_modified(obj):
+            continue
+        if isinstance(obj, Post):
+            tags.add(post_tag(obj.id))
+            attrs = inspect(obj).attrs
+            if any(attrs[name].history.has_changes()
+                   for name in ('publish_date', 'user_id', 'tags')):
+                # 文章在列表中的位置或所属的列表变了
+                tags.add(POSTS)
+                user_ids.add(obj.user_id)
+                user_ids.update(_history_ids(obj, 'user'))
+                tag_ids.update(_history_ids(obj, 'tags'))
+        elif isinstance(obj, Comment):
+            post_ids.add(obj.post_id)
+            post_ids.update(_history_ids(obj, 'post'))
+            comment_ids.add(obj.id)
+        elif isinstance(obj, User):
+            user_ids.add(obj.id)
+            attrs = inspect(obj).attrs
+            if attrs.username.history.has_changes() or \
+                    attrs.gravatar_hash.history.has_changes():
+                author_ids.add(obj.id)
+        elif isinstance(obj, Tag):
+            renamed_tag_ids.add(obj.id)
+    # 冗余计数由Core语句更新，对应的对象不在session.dirty中
+    for model, id in _count_changes(session):
+        if model is User:
+            user_ids.add(id)
+        elif model is Post:
+            post_ids.add(id)
+    renamed_tag_ids.discard(None)
+    tag_ids.update(renamed_tag_ids)
+    if renamed_tag_ids:
+        # 标签改名或删除时，显示了这个标签的文章页面也要失效
+        post_ids.update(id for id, in session.connection().execute(
+            db.select([posts_tags_table.c.post_id]).where(
+                posts_tags_table.c.tag_id.in_(renamed_tag_ids))))
+    for ids, make_tag in ((post_ids, post_tag), (user_ids, user_tag),
+                          (author_ids, author_tag), (tag_ids, tag_tag),
+                          (comment_ids, comment_tag)):
+        ids.discard(None)
+        tags.update(make_tag(id) for id in ids)
+    return tags
+
+
+def invalidate_after_commit(session, *tags):
+    """事务提交后让这些标签失效，用于session事件看不到的Core语句"""
+    session.info.setdefault('page_tags', set()).update(tags)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _track_page_changes(session, flush_context):
+    tags = _changed_tags(session)
+    if tags:
+        invalidate_after_commit(session, *tags)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_pages_on_commit(session):
+    tags = session.info.pop('page_tags', None)
+    if tags and has_app_context():
+        invalidate_pages(*tags)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_page_changes(session):
+    session.info.pop('page_tags', None)
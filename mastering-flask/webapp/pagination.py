@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+基于游标(keyset/seek)的分页
+
+Flask-SQLAlchemy的paginate()使用LIMIT/OFFSET，并且每次都要执行一次COUNT(*)，
+页数越靠后，数据库需要跳过的行就越多。游标分页记住上一页最后一行的排序键，
+下一页直接用 WHERE (publish_date, id) < (?, ?) 定位，无论翻到第几页耗时都一样。
+"""
+import base64
+import datetime
+import json
+from flask import current_app, request, url_for
+from flask_sqlalchemy import Pagination
+from sqlalchemy import DateTime, and_, or_
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+def _decode_value(column, value):
+    if value is not None and isinstance(column.type, DateTime):
+        for fmt in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S'):
+            try:
+                return datetime.datetime.strptime(value, fmt)
+            except ValueError:
+                pass
+        raise ValueError('invalid datetime in cursor')
+    return value
+
+
+def encode_cursor(direction, values):
+    """把翻页方向和排序键的值编码为不透明的游标字符串"""
+    data = [direction] + [_encode_value(v) for v in values]
+    token = base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')))
+    return token.rstrip('=')
+
+
+def decode_cursor(token, columns):
+    """解码游标，返回(direction, values)；游标无效时返回(None, None)"""
+    try:
+        token = str(token)
+        data = json.loads(base64.urlsafe_b64decode(
+            token + '=' * (-len(token) % 4)))
+        direction, values = data[0], data[1:]
+        if direction not in ('next', 'prev') or len(values) != len(columns):
+            return None, None
+        return direction, [_decode_value(c, v) for c, v in zip(columns, values)]
+    except (TypeError, ValueError, IndexError, UnicodeError):
+        return None, None
+
+
+def _seek_filter(columns, values, descending):
+    # (a, b) < (x, y) 展开为 a < x OR (a = x AND b < y)，不依赖数据库对行值比较的支持
+    clauses = []
+    for i, column in enumerate(columns):
+        equals = [columns[j] == values[j] for j in range(i)]
+        if descending:
+            clauses.append(and_(*(equals + [column < values[i]])))
+        else:
+            clauses.append(and_(*(equals + [column > values[i]])))
+    return or_(*clauses)
+
+
+def _ordering(columns, descending):
+    return [c.desc() if descending else c.asc() for c in columns]
+
+
+class KeysetPagination(object):
+    """
+    游标分页的结果对象，接口与Flask-SQLAlchemy的Pagination类似。
+    Arguments:
+        query: 要分页的查询
+        columns: 排序键，最后一列必须能唯一确定一行（通常是主键）
+        per_page: 每页的条数
+        cursor: 上一次返回的prev_cursor或next_cursor，为None时返回第一页
+        descending: 排序键是否倒序
+        with_total: 是否额外执行COUNT(*)得到总数，否则total为None
+        last: 没有游标时直接返回最后一页
+        total: 已知的总数（例如冗余保存的计数），给出时不再执行COUNT(*)
+    """
+
+    def __init__(self, query, columns, per_page, cursor=None, descending=True,
+                 with_total=True, last=False, total=None):
+        self.query = query
+        self.columns = columns
+        self.per_page = per_page
+        self.descending = descending
+
+        direction, values = (None, None)
+        if cursor:
+            direction, values = decode_cursor(cursor, columns)
+        if direction is None and last:
+            direction = 'prev'
+        backwards = direction == 'prev'
+
+        # 向前翻页时按相反顺序取数据，取完再反转回来
+        q = query.order_by(None).order_by(
+            *_ordering(columns, descending != backwards))
+        if values is not None:
+            q = q.filter(_seek_filter(columns, values, descending != backwards))
+        # 多取一行，用来判断后面是否还有数据，不需要COUNT(*)
+        rows = q.limit(per_page + 1).all()
+        more = len(rows) > per_page
+        rows = rows[:per_page]
+        if backwards:
+            rows.reverse()
+            self.has_prev = more
+            self.has_next = values is not None
+        else:
+            self.has_next = more
+            self.has_prev = values is not None
+        self.items = rows
+
+        self.total = total
+        if total is None and with_total:
+            self.total = query.order_by(None).count()
+
+    def _keys(self, item):
+        return [getattr(item, c.key) for c in self.columns]
+
+    @property
+    def prev_cursor(self):
+        if not self.has_prev or not self.items:
+            return None
+        return encode_cursor('prev', self._keys(self.items[0]))
+
+    @property
+    def next_cursor(self):
+        if not self.has_next or not self.items:
+            return None
+        return encode_cursor('next', self._keys(self.items[-1]))
+
+
+def paginate(query, columns, per_page, descending=True, cursor_mode=None,
+             with_total=True, last=False, total=None):
+    """
+    列表视图统一使用的分页入口。
+    请求中带有cursor参数，或者cursor_mode为True时使用游标分页；
+    否则仍然使用Flask-SQLAlchemy的page/OFFSET分页。
+    cursor_mode为None时由配置项PAGINATION_USE_CURSOR决定。
+    total为已知的总数时，两种分页方式都不再执行COUNT(*)。
+    """
+    if cursor_mode is None:
+        cursor_mode = current_app.config['PAGINATION_USE_CURSOR']
+    if cursor_mode or 'cursor' in request.args:
+        return KeysetPagination(query, columns, per_page,
+                                cursor=request.args.get('cursor'),
+                                descending=descending,
+                                with_total=with_total, last=last, total=total)
+
+    page = request.args.get('page', 1, type=int)
+    # -1为一个特殊的页数，值为-1时，会计算总量和总页数，求出最后一页
+    if last or page == -1:
+        if total is None:
+            total = query.order_by(None).count()
+        page = max((total - 1) // per_page + 1, 1)
+    query = query.order_by(None).order_by(*_ordering(columns, descending))
+    if total is None:
+        return query.paginate(page, per_page=per_page, error_out=False)
+    page = max(page, 1)
+    items = query.limit(per_page).offset((page - 1) * per_page).all()
+    return Pagination(query, page, per_page, total, items)
+
+
+def pagination_urls(pagination, endpoint, **kwargs):
+    """生成API中的prev和next链接，游标分页时链接中带的是游标而不是页数"""
+    if 'count' in request.args:
+        kwargs['count'] = request.args['count']
+    prev = None
+    next = None
+    if isinstance(pagination, KeysetPagination):
+        if pagination.prev_cursor:
+            prev = url_for(endpoint, cursor=pagination.prev_cursor,
+                           _external=True, **kwargs)
+        if pagination.next_cursor:
+            next = url_for(endpoint, cursor=pagination.next_cursor,
+                           _external=True, **kwargs)
+    else:
+        if pagination.has_prev:
+            prev = url_for(endpoint, page=pagination.prev_num, _external=True,
+                           **kwargs)
+        if pagination.has_next:
+            next = url_for(endpoint, page=pagination.next_num, _external=True,
+                           **kwargs)
+    return prev, next
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+密码的散列和校验
+
+bcrypt故意设计得很慢，以前直接在请求线程中执行：gevent服务器下会卡住整个hub，
+HTTP Basic认证的API每次请求都要重新计算一次。现在：
+1. bcrypt在大小为PASSWORD_POOL_SIZE的线程池中执行（bcrypt计算时会释放GIL），
+   gevent服务器使用gevent的线程池，只挂起当前的greenlet；
+   排队的请求超过PASSWORD_MAX_PENDING时直接返回503，不再无限堆积；
+2. Basic认证成功后，把(用户, 凭据摘要)在进程内缓存PASSWORD_CACHE_TIMEOUT秒，
+   摘要是以SECRET_KEY为密钥、对密码散列和明文密码计算的HMAC，不保存明文，
+   修改密码后散列变化，缓存自然失效；同一凭据的并发请求只计算一次bcrypt；
+3. 登录成功时，如果散列的工作因子与BCRYPT_LOG_ROUNDS不同，就用新的工作因子重新散列。
+PASSWORD_POOL_SIZE为0时在请求线程中直接计算，与以前的行为相同。
+"""
+import hashlib
+import hmac
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import abort, current_app
+from .caching import LRUCache
+from .extensions import bcrypt
+
+# Basic认证缓存使用的分段锁的个数
+STRIPES = 64
+
+
+class PasswordService(object):
+    def __init__(self, app):
+        self.app = app
+        self.successes = LRUCache(app.config['PASSWORD_CACHE_SIZE'],
+                                  app.config['PASSWORD_CACHE_TIMEOUT'])
+        self._pending = threading.BoundedSemaphore(
+            app.config['PASSWORD_MAX_PENDING'])
+        self._pool = None
+        self._stripes = None
+        self._lock = threading.Lock()
+        app.extensions['passwords'] = self
+
+    def _setup(self):
+        # 第一次使用时才创建线程池，避免预先fork的服务器把线程池带到子进程中
+        with self._lock:
+            if self._stripes is not None:
+                return
+            size = self.app.config['PASSWORD_POOL_SIZE']
+            if self.app.config['PASSWORD_POOL_GEVENT']:
+                from gevent.lock import Semaphore
+                from gevent.threadpool import ThreadPool
+                if size:
+                    self._pool = ThreadPool(size)
+                self._stripes = [Semaphore() for _ in range(STRIPES)]
+            else:
+                if size:
+                    self._pool = ThreadPoolExecutor(size)
+                self._stripes = [threading.Lock() for _ in range(STRIPES)]
+
+    def _stripe(self, key):
+        if self._stripes is None:
+            self._setup()
+        return self._stripes[hash(key) % STRIPES]
+
+    def run(self, func, *args):
+        """在线程池中执行func并等待结果"""
+        if not self.app.config['PASSWORD_POOL_SIZE']:
+            return func(*args)
+        if not self._pending.acquire(False):
+            self.app.logger.warning('Too many pending password checks')
+            abort(503)
+        try:
+            if self._stripes is None:
+                self._setup()
+            pool = self._pool
+            if self.app.config['PASSWORD_POOL_GEVENT']:
+                return pool.apply(func, args)
+            return pool.submit(func, *args).result()
+        finally:
+            self._pending.release()
+
+    def _cache_key(self, user, password):
+        if isinstance(password, unicode):
+            password = password.encode('utf-8')
+        digest = hmac.new(self.app.config['SECRET_KEY'],
+                          user.password_hash.encode('utf-8') + b':' + password,
+                          hashlib.sha256).hexdigest()
+        return '%d:%s' % (user.id, digest)
+
+    def check(self, user, password, cache=False, rehash=False):
+        if not user.password_hash or password is None:
+            return False
+        key = None
+        if cache and user.id is not None and \
+                self.app.config['PASSWORD_CACHE_TIMEOUT']:
+            key = self._cache_key(user, password)
+            if self.successes.get(key):
+                return True
+            # 同一凭据的并发请求排队，第一个请求计算完成后其余的直接命中缓存
+            with self._stripe(key):
+                if self.successes.get(key):
+                    return True
+                if not self.run(bcrypt.check_password_hash,
+                                user.password_hash, password):
+                    return False
+                self.successes.set(key, True)
+        elif not self.run(bcrypt.check_password_hash, user.password_hash,
+                          password):
+            return False
+
+        if rehash and needs_rehash(user.password_hash,
+                                   self.app.config['BCRYPT_LOG_ROUNDS']):
+            # 直接修改散列值，调用方提交session时写入；
+            # 密码本身没有变，不能通过password属性设置，否则会吊销用户的令牌
+            user.password_hash = self.hash(password)
+        return True
+
+    def hash(self, password):
+        return self.run(bcrypt.generate_password_hash, password,
+                        self.app.config['BCRYPT_LOG_ROUNDS'])
+
+
+def needs_rehash(password_hash, rounds):
+    # bcrypt散列的格式为 $2b$12$<salt+hash>，第三段为工作因子
+    try:
+        return int(password_hash.split('$')[2]) != rounds
+    except (IndexError, ValueError):
+        return False
+
+
+def _service():
+    # 单独运行的脚本(例如test_insert_data.py)没有通过create_app创建应用
+    return current_app.extensions.get('passwords')
+
+
+def hash_password(password):
+    service = _service()
+    if service is None:
+        return bcrypt.generate_password_hash(password)
+    return service.hash(password)
+
+
+def check_password(user, password, cache=False, rehash=False):
+    """
+    校验用户的密码。
+    cache: 是否使用校验成功的缓存，用于每次请求都带密码的HTTP Basic认证
+    rehash: 校验成功后，工作因子过期时是否重新散列，用于登录
+    """
+    service = _service()
+    if service is None:
+        return bcrypt.check_password_hash(user.password_hash, password)
+    return service.check(user, password, cache=cache, rehash=rehash)
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+文章正文的预先渲染
+
+以前每次请求都要重新处理正文：REST接口 /api/post 用HTMLParser把每篇文章的正文
+解析一遍，去掉HTML标签后输出；_posts.html对列表中的每篇文章执行
+post.text | truncate(500) | safe，截断时不管HTML标签，也没有过滤正文中的脚本。
+现在正文被赋值时(Post.text的set事件)一次性生成：
+    text_plain: 去掉HTML标签的纯文本，REST接口直接输出；
+    text_html: 正文转换并清理后的HTML，Markdown格式的正文转换为HTML，
+               再用bleach去掉白名单之外的标签和属性；
+    excerpt: 从text_html截取的摘要，截断后补全未闭合的标签，列表页面直接输出。
+渲染规则改变时增加RENDERER_VERSION，然后执行 `manage.py render_posts`，
+重新渲染render_version不是当前版本的文章(包括迁移之前已有的文章)。
+"""
+import re
+from HTMLParser import HTMLParser
+import bleach
+import markdown
+from sqlalchemy import and_, bindparam, event, or_
+from .models import db, Post
+
+# 渲染规则的版本，修改渲染规则后加一
+RENDERER_VERSION = 1
+# 摘要的长度(纯文本字符数)和截断后添加的后缀，与以前的truncate(500)相同
+EXCERPT_LENGTH = 500
+EXCERPT_END = u'...'
+# 正文中允许的标签和属性，CKEditor生成的常用格式都保留
+ALLOWED_TAGS = bleach.ALLOWED_TAGS + [
+    'p', 'br', 'hr', 'pre', 'div', 'span', 'img', 'u', 's', 'sub', 'sup',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'table', 'thead', 'tbody', 'tr', 'th', 'td'
+]
+ALLOWED_ATTRIBUTES = dict(bleach.ALLOWED_ATTRIBUTES, **{
+    'img': ['src', 'alt', 'title', 'width', 'height'],
+    'td': ['colspan', 'rowspan'],
+    'th': ['colspan', 'rowspan']
+})
+# 没有结束标签的元素
+VOID_TAGS = frozenset(['br', 'hr', 'img'])
+# 以HTML标签开头的正文是编辑器生成的HTML，其余的按Markdown转换
+_html_body = re.compile(r'\s*<[a-zA-Z!]')
+
+
+class HTMLStripper(HTMLParser):
+    def __init__(self):
+        self.reset()
+        self.fed = []
+
+    def handle_data(self, data):
+        self.fed.append(data)
+
+    def get_data(self):
+        return ''.join(self.fed)
+
+
+def strip_tags(html):
+    s = HTMLStripper()
+    s.feed(html)
+
+    return s.get_data()
+
+
+def plain_text(html):
+    """正文对应的纯文本，正文为None时返回None"""
+    if html is None:
+        return None
+    if not isinstance(html, basestring):
+        html = unicode(html)
+    return strip_tags(html)
+
+
+def render_html(text):
+    """把正文转换为清理过的HTML，正文为None时返回None"""
+    if text is None:
+        return None
+    if not isinstance(text, unicode):
+        text = unicode(text)
+    if not _html_body.match(text):
+        text = markdown.markdown(text, output_format='html5')
+    return bleach.clean(text, tags=ALLOWED_TAGS,
+                        attributes=ALLOWED_ATTRIBUTES, strip=True)
+
+
+class HTMLTruncator(HTMLParser):
+    """截取HTML的前length个文本字符，保留标签并在截断处补全结束标签"""
+
+    def __init__(self, length, end):
+        HTMLParser.__init__(self)
+        # 与Jinja2的truncate一样，后缀也算在长度中
+        self.remaining = length - len(end)
+        self.end = end
+        self.out = []
+        self.open_tags = []
+        self.truncated = False
+
+    def handle_starttag(self, tag, attrs):
+        if self.truncated:
+            return
+        self.out.append(self.get_starttag_text())
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if not self.truncated:
+            self.out.append(self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        if self.truncated or tag not in self.open_tags:
+            return
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.out.append(u'</%s>' % open_tag)
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if self.truncated:
+            return
+        if len(data) <= self.remaining:
+            self.out.append(data)
+            self.remaining -= len(data)
+            return
+        # 在最后一个完整的词之后截断
+        data = data[:self.remaining]
+        if u' ' in data:
+            data = data.rsplit(u' ', 1)[0]
+        self.out.append(data)
+        self._truncate()
+
+    def handle_entityref(self, name):
+        self._character(u'&%s;' % name)
+
+    def handle_charref(self, name):
+        self._character(u'&#%s;' % name)
+
+    def _character(self, text):
+        # 实体只算作一个字符
+        if self.truncated:
+            return
+        if self.remaining < 1:
+            self._truncate()
+            return
+        self.out.append(text)
+        self.remaining -= 1
+
+    def _truncate(self):
+        self.out.append(self.end)
+        self.out.extend(u'</%s>' % tag for tag in reversed(self.open_tags))
+        self.truncated = True
+
+
+def excerpt(html, length=EXCERPT_LENGTH, end=EXCERPT_END):
+    """HTML的摘要，文本不超过length个字符时原样返回"""
+    if html is None:
+        return None
+    truncator = HTMLTruncator(length, end)
+    truncator.feed(html)
+    truncator.close()
+    if not truncator.truncated:
+        return html
+    return u''.join(truncator.out)
+
+
+def render(text):
+    """正文的各种预先渲染结果，字段名与posts表的列名相同"""
+    html = render_html(text)
+    return {
+        'text_plain': plain_text(text),
+        'text_html': html,
+        'excerpt': excerpt(html),
+        'render_version': RENDERER_VERSION
+    }
+
+
+@event.listens_for(Post.text, 'set')
+def _render_text(target, value, oldvalue, initiator):
+    for name, rendered in render(value).items():
+        setattr(target, name, rendered)
+
+
+def render_posts(batch_size=500, force=False):
+    """
+    重新渲染不是当前版本的文章，返回处理的文章数。
+    force为True时重新渲染所有的文章。
+    """
+    posts = Post.__table__
+    update = posts.update().where(posts.c.id == bindparam('_id')).values(
+        text_plain=bindparam('_text_plain'),
+        text_html=bindparam('_text_html'),
+        excerpt=bindparam('_excerpt'),
+        render_version=bindparam('_render_version'))
+    stale = or_(posts.c.render_version == None,
+                posts.c.render_version != RENDERER_VERSION)
+    count = 0
+    last = 0
+    while True:
+        where = posts.c.id > last
+        if not force:
+            where = and_(where, stale)
+        rows = db.session.execute(
+            db.select([posts.c.id, posts.c.text]).where(where)
+            .order_by(posts.c.id).limit(batch_size)).fetchall()
+        if not rows:
+            break
+        params = []
+        for id, text in rows:
+            values = dict(('_' + k, v) for k, v in render(text).items())
+            values['_id'] = id
+            params.append(values)
+        db.session.execute(update, params)
+        db.session.commit()
+        count += len(rows)
+        last = rows[-1][0]
+    return count
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+文章和评论的全文检索
+
+以前只有Flask-Admin里的 LIKE '%term%' 全表扫描。这里使用SQLite的FTS5建立倒排索引：
+search_index表中每篇文章一行(标题、正文、标签)，每条未被查禁的评论一行(名称、内容)，
+查询时用bm25()排序，标题和标签的权重高于正文。
+
+索引由session的after_flush事件维护，和触发它的修改处于同一个事务；
+正文中的HTML标签在写入索引前去掉。`python manage.py reindex` 按批重建整个索引。
+kind、ref_id等UNINDEXED列上的条件需要扫描整个索引表，所以每行的rowid由
+(kind, ref_id)固定算出(见_rowid)，更新和删除都按rowid直接定位。
+FTS5只有SQLite才有，其他数据库退回到对文章标题和正文的LIKE查询。
+"""
+import collections
+import re
+from HTMLParser import HTMLParser
+from flask_sqlalchemy import Pagination
+from jinja2 import Markup, escape
+from sqlalchemy import Column, DDL, Integer, MetaData, Table, Text, event, \
+    func, inspect, literal_column, or_
+from .models import db, Post, Comment, Tag, posts_tags_table, _visible_comment
+
+# FTS5虚拟表不能由create_all创建，这里的Table只用来生成SQL语句，不属于db.metadata
+search_index = Table(
+    'search_index', MetaData(),
+    Column('rowid', Integer, primary_key=True),
+    Column('title', Text),
+    Column('body', Text),
+    Column('tags', Text),
+    Column('kind', Text),
+    Column('ref_id', Integer),
+    Column('post_id', Integer),
+)
+
+CREATE_INDEX_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+    "title, body, tags, kind UNINDEXED, ref_id UNINDEXED, post_id UNINDEXED, "
+    "tokenize='unicode61 remove_diacritics 2')"
+)
+DROP_INDEX_SQL = "DROP TABLE IF EXISTS search_index"
+
+# 测试中使用db.create_all()建库时同时创建索引表，正式环境由数据库迁移创建
+event.listen(db.metadata, 'after_create',
+             DDL(CREATE_INDEX_SQL).execute_if(dialect='sqlite'))
+event.listen(db.metadata, 'before_drop',
+             DDL(DROP_INDEX_SQL).execute_if(dialect='sqlite'))
+
+# rowid = ref_id * 2 + KINDS[kind]
+KINDS = {'post': 0, 'comment': 1}
+
+# 标题、正文、标签三列在bm25中的权重
+WEIGHTS = (10.0, 1.0, 5.0)
+# snippet()中高亮的标记，转义后再替换成HTML标签
+MARK_START = u'\x02'
+MARK_END = u'\x03'
+
+_html_tag = re.compile(r'<[^>]*>')
+_words = re.compile(r'\w+', re.UNICODE)
+
+SearchHit = collections.namedtuple(
+    'SearchHit', 'kind id post_id snippet score post comment')
+
+
+def strip_html(html):
+    """去掉HTML标签并还原实体，得到用于索引的纯文本"""
+    if not html:
+        return u''
+    return HTMLParser().unescape(_html_tag.sub(u' ', html))
+
+
+def match_expression(q):
+    """把用户输入转换为FTS5的查询：每个词加上引号，避免特殊字符被当作查询语法"""
+    words = _words.findall(q or u'')
+    return u' '.join(u'"%s"' % w for w in words)
+
+
+def _fts_enabled(conn):
+    return conn.dialect.name == 'sqlite'
+
+
+def _rowid(kind, ref_id):
+    return ref_id * 2 + KINDS[kind]
+
+
+def _delete_documents(conn, kind, ids):
+    conn.execute(search_index.delete().where(search_index.c.rowid.in_(
+        [_rowid(kind, id) for id in ids])))
+
+
+def _post_rows(conn, ids):
+    posts = Post.__table__
+    tags = Tag.__table__
+    tag_titles = collections.defaultdict(list)
+    for post_id, title in conn.execute(
+            db.select([posts_tags_table.c.post_id, tags.c.title]).select_from(
+                posts_tags_table.join(tags)
+            ).where(posts_tags_table.c.post_id.in_(ids))):
+        tag_titles[post_id].append(title or u'')
+    for id, title, text in conn.execute(
+            db.select([posts.c.id, posts.c.title, posts.c.text]).where(
+                posts.c.id.in_(ids))):
+        yield {'rowid': _rowid('post', id), 'kind': 'post', 'ref_id': id,
+               'post_id': id, 'title': title, 'body': strip_html(text),
+               'tags': u' '.join(tag_titles[id])}
+
+
+def _comment_rows(conn, ids):
+    comments = Comment.__table__
+    for id, post_id, name, text in conn.execute(
+            db.select([comments.c.id, comments.c.post_id, comments.c.name,
+                       comments.c.text]).where(db.and_(
+                comments.c.id.in_(ids),
+                # 所属文章被删除的评论不再出现在检索结果中
+                comments.c.post_id != None,
+                _visible_comment(comments.c.disabled)))):
+        yield {'rowid': _rowid('comment', id), 'kind': 'comment',
+               'ref_id': id, 'post_id': post_id, 'title': name,
+               'body': strip_html(text), 'tags': u''}
+
+
+def index_posts(conn, ids):
+    """重建指定文章的索引，文章已被删除时只删除索引"""
+    ids = list(ids)
+    if not ids or not _fts_enabled(conn):
+        return
+    _delete_documents(conn, 'post', ids)
+    rows = list(_post_rows(conn, ids))
+    if rows:
+        conn.execute(search_index.insert(), rows)
+
+
+def index_comments(conn, ids):
+    """重建指定评论的索引，被查禁或删除的评论从索引中去掉"""
+    ids = list(ids)
+    if not ids or not _fts_enabled(conn):
+        return
+    _delete_documents(conn, 'comment', ids)
+    rows = list(_comment_rows(conn, ids))
+    if rows:
+        conn.execute(search_index.insert(), rows)
+
+
+def reindex(batch_size=1000):
+    """按主键分批重建整个索引，每批提交一次，返回索引的行数"""
+    conn = db.session.connection()
+    if not _fts_enabled(conn):
+        return 0
+    conn.execute(search_index.delete())
+    db.session.commit()
+    for model, index in ((Post, index_posts), (Comment, index_comments)):
+        last_id = 0
+        while True:
+            conn = db.session.connection()
+            ids = [id for id, in conn.execute(
+                db.select([model.id]).where(model.id > last_id).order_by(
+                    model.id).limit(batch_size))]
+            if not ids:
+                break
+            index(conn, ids)
+            db.session.commit()
+            last_id = ids[-1]
+    return db.session.execute(
+        db.select([func.count()]).select_from(search_index)).scalar()
+
+
+def _highlight(snippet):
+    return Markup(escape(snippet or u'')
+                  .replace(MARK_START, Markup('<mark>'))
+                  .replace(MARK_END, Markup('</mark>')))
+
+
+def _fts_query(expression):
+    table = literal_column('search_index')
+    rank = func.bm25(table, *WEIGHTS).label('score')
+    snippet = func.snippet(table, -1, MARK_START, MARK_END, u'…', 16) \
+        .label('snippet')
+    return db.session.query(
+        search_index.c.kind, search_index.c.ref_id, search_index.c.post_id,
+        snippet, rank
+    ).filter(table.op('MATCH')(expression)).order_by(
+        rank, search_index.c.rowid)
+
+
+def _like_query(q):
+    # 没有FTS5时的退化方案：只查询文章，按发布时间排序
+    conditions = [or_(Post.title.contains(w), Post.text.contains(w))
+                  for w in _words.findall(q or u'')]
+    return db.session.query(
+        literal_column("'post'").label('kind'), Post.id.label('ref_id'),
+        Post.id.label('post_id'), Post.title.label('snippet'),
+        literal_column('0').label('score')
+    ).filter(*conditions).order_by(Post.publish_date.desc(), Post.id.desc())
+
+
+def search(q, page=1, per_page=20):
+    """
+    检索文章和评论，返回Flask-SQLAlchemy的Pagination对象，
+    items为SearchHit，其中的post和comment已经用两条查询批量加载好了。
+    """
+    expression = match_expression(q)
+    if not expression:
+        return Pagination(None, page, per_page, 0, [])
+    if _fts_enabled(db.session.connection()):
+        query = _fts_query(expression)
+    else:
+        query = _like_query(q)
+    pagination = query.paginate(page, per_page=per_page, error_out=False)
+
+    rows = pagination.items
+    post_ids = set(row.post_id for row in rows)
+    comment_ids = [row.ref_id for row in rows if row.kind == 'comment']
+    posts = dict((p.id, p) for p in Post.listing(
+        Post.query.filter(Post.id.in_(post_ids)))) if post_ids else {}
+    comments = dict((c.id, c) for c in Comment.query.filter(
+        Comment.id.in_(comment_ids))) if comment_ids else {}
+    pagination.items = [
+        SearchHit(row.kind, row.ref_id, row.post_id,
+                  _highlight(row.snippet), row.score,
+                  posts.get(row.post_id), comments.get(row.ref_id)
+                  if row.kind == 'comment' else None)
+        for row in rows if row.post_id in posts
+    ]
+    return pagination
+
+
+def _changed(obj, *names):
+    attrs = inspect(obj).attrs
+    return any(attrs[name].history.has_changes() for name in names)
+
+
+def _changed_documents(session):
+    """返回这次flush中需要重建索引的(文章id集合, 评论id集合, 删除的文章id集合)"""
+    post_ids = set()
+    comment_ids = set()
+    deleted_post_ids = set()
+    for obj in session.new | session.deleted:
+        if isinstance(obj, Post):
+            post_ids.add(obj.id)
+        elif isinstance(obj, Comment):
+            comment_ids.add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, Post):
+            deleted_post_ids.add(obj.id)
+    tag_ids = set()
+    for obj in session.dirty:
+        if isinstance(obj, Post):
+            if _changed(obj, 'title', 'text', 'tags'):
+                post_ids.add(obj.id)
+        elif isinstance(obj, Comment):
+            if _changed(obj, 'name', 'text', 'disabled', 'post_id'):
+                comment_ids.add(obj.id)
+        elif isinstance(obj, Tag):
+            if _changed(obj, 'title'):
+                tag_ids.add(obj.id)
+    # 标签改名时，使用该标签的文章都要重建索引
+    if tag_ids:
+        post_ids.update(id for id, in session.connection().execute(
+            db.select([posts_tags_table.c.post_id]).where(
+                posts_tags_table.c.tag_id.in_(tag_ids))))
+    post_ids.discard(None)
+    comment_ids.discard(None)
+    return post_ids, comment_ids, deleted_post_ids
+
+
+@event.listens_for(db.session, 'after_flush')
+def _update_search_index(session, flush_context):
+    post_ids, comment_ids, deleted_post_ids = _changed_documents(session)
+    if not (post_ids or comment_ids):
+        return
+    conn = session.connection()
+    if deleted_post_ids and _fts_enabled(conn):
+        # 文章删除后，它的评论也不再出现在检索结果中；
+        # 先从comments表取出评论的id，不按post_id扫描索引表
+        comments = Comment.__table__
+        comment_ids.update(id for id, in conn.execute(
+            db.select([comments.c.id]).where(
+                comments.c.post_id.in_(deleted_post_ids))))
+    index_posts(conn, post_ids)
+    index_comments(conn, comment_ids)
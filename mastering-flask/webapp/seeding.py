@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+"""
+批量生成模拟数据，用于压力测试
+
+各模型的generate_fake每个对象都要走一遍ORM，每个用户commit一次、bcrypt一次，
+随机取关联对象时还要执行 OFFSET 查询，生成十万行数据需要几个小时。这里：
+1. 使用Core的insert()，按batch_size条一批executemany写入，整个过程只有一个事务；
+2. 主键由这里直接分配，关联关系从内存中的id范围里随机选取，不需要回查数据库；
+3. 所有模拟用户共用一个事先计算好的密码散列，密码都是FAKE_PASSWORD；
+4. 使用独立的random.Random(seed)，相同的seed生成完全相同的数据，
+   时间都是相对于end往前推算的。
+Core写入不会触发session事件：冗余计数在生成时用数组统计，最后批量UPDATE；
+关注时间线、全文索引、侧边栏和页面缓存在数据写入后统一重建。
+"""
+import array
+import datetime
+import hashlib
+import random
+from flask import current_app
+from forgery_py.dictionaries_loader import get_dictionary
+from sqlalchemy import bindparam
+from .models import db, User, Role, Post, Comment, Tag, Follow, \
+    roles_users_table, posts_tags_table
+from .passwords import hash_password
+from .sidebar import invalidate_sidebar
+from .timeline import rebuild_timelines
+from .search import reindex
+from .rendering import render
+from .pagecache import invalidate_pages, ALL_PAGES
+
+FAKE_PASSWORD = 'password'
+# 可以用密码登录的几个固定账户: (用户名, 密码, 角色)
+ACCOUNTS = [
+    ('admin', 'admin', ('admin', 'poster', 'default')),
+    ('user01', 'user01', ('poster', 'default')),
+    ('user02', 'user02', ('poster', 'default')),
+]
+ROLES = [
+    ('admin', 'administrator role'),
+    ('poster', 'the registered user role'),
+    ('default', 'the unregistered user role'),
+]
+# 模拟数据的时间分布在end之前的这么多天内
+DAYS = 365
+# 没有指定end时使用的固定时间，保证每天生成的数据都相同
+DEFAULT_END = datetime.datetime(2018, 1, 1)
+
+
+def _words(name):
+    return [line.strip() for line in get_dictionary(name)]
+
+
+class Seeder(object):
+    def __init__(self, seed=0, batch_size=5000, end=None):
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.end = end or DEFAULT_END
+        self.conn = db.session.connection()
+        self.sentences = _words('lorem_ipsum')
+        self.words = sorted(set(
+            w.strip('.,').lower() for s in self.sentences for w in s.split()))
+        self.first_names = _words('male_first_names') + \
+            _words('female_first_names')
+        self.last_names = _words('last_names')
+        self.cities = _words('cities')
+        # 新用户和新文章的冗余计数，下标为 id - 第一个id
+        self.user_counts = {}
+        self.post_counts = array.array('l')
+
+    def insert(self, table, rows):
+        """按批写入rows，rows可以是生成器，返回写入的行数"""
+        return self.execute_many(table.insert(), rows)
+
+    def next_id(self, model):
+        return (self.conn.execute(
+            db.select([db.func.max(model.id)])).scalar() or 0) + 1
+
+    def date(self, seconds_ago=None):
+        if seconds_ago is None:
+            seconds_ago = self.rng.randint(0, DAYS * 86400)
+        return self.end - datetime.timedelta(seconds=seconds_ago)
+
+    def title(self):
+        return ' '.join(self.rng.sample(self.words, self.rng.randint(2, 5))) \
+            .capitalize()
+
+    def paragraph(self):
+        return ' '.join(self.rng.choice(self.sentences)
+                        for _ in range(self.rng.randint(1, 5)))
+
+    def roles(self):
+        table = Role.__table__
+        existing = dict(
+            (name, id) for id, name in self.conn.execute(
+                db.select([table.c.id, table.c.name])))
+        missing = [{'name': name, 'description': description}
+                   for name, description in ROLES if name not in existing]
+        if missing:
+            self.insert(table, missing)
+            return self.roles()
+        return existing
+
+    def user_row(self, id, username, email, password_hash):
+        return {
+            'id': id,
+            'username': username,
+            'email': email,
+            'password_hash': password_hash,
+            'confirmed': True,
+            'name': '%s %s' % (self.rng.choice(self.first_names),
+                               self.rng.choice(self.last_names)),
+            'location': self.rng.choice(self.cities),
+            'about_me': self.rng.choice(self.sentences),
+            'register_time': self.date(),
+            'last_seen': self.end,
+            'gravatar_hash': hashlib.md5(email.encode('utf-8')).hexdigest()
+        }
+
+    def users(self, count):
+        """生成count个用户，返回新用户的id范围"""
+        roles = self.roles()
+        users = User.__table__
+        existing = set(name for name, in self.conn.execute(
+            db.select([users.c.username]).where(
+                users.c.username.in_([a[0] for a in ACCOUNTS]))))
+        first = self.next_id(User)
+        fake_hash = hash_password(FAKE_PASSWORD)
+
+        accounts = [a for a in ACCOUNTS if a[0] not in existing][:count]
+        fixed = [(first + i, hash_password(password), role_names)
+                 for i, (username, password, role_names)
+                 in enumerate(accounts)]
+
+        def user_rows():
+            for i, (username, password, role_names) in enumerate(accounts):
+                yield self.user_row(first + i, username,
+                                    '%s@163.com' % username, fixed[i][1])
+            for id in xrange(first + len(accounts), first + count):
+                yield self.user_row(id, 'user%d' % id,
+                                    'user%d@example.com' % id, fake_hash)
+
+        def role_rows():
+            for id, _, role_names in fixed:
+                for name in role_names:
+                    yield {'user_id': id, 'role_id': roles[name]}
+            for id in xrange(first + len(accounts), first + count):
+                yield {'user_id': id, 'role_id': roles['poster']}
+                yield {'user_id': id, 'role_id': roles['default']}
+
+        self.insert(users, user_rows())
+        self.insert(roles_users_table, role_rows())
+        for column in ('post_count', 'comment_count', 'follower_count',
+                       'following_count'):
+            self.user_counts[column] = array.array('l', [0]) * count
+        return xrange(first, first + count)
+
+    def count(self, column, user_ids, user_id):
+        self.user_counts[column][user_id - user_ids[0]] += 1
+
+    def tags(self, count):
+        """生成count个标签的标题，返回(标签id的列表, 新增的行数)"""
+        table = Tag.__table__
+        words = self.rng.sample(self.words, min(count, len(self.words)))
+        # 单词用完后加上数字后缀，保证标题不重复
+        titles = words + ['%s%d' % (self.words[i % len(self.words)], i)
+                          for i in xrange(len(words), count)]
+        # tags.title上有唯一索引，再次运行时已经存在的标签直接使用
+        existing = dict((title, id) for id, title in self.conn.execute(
+            db.select([table.c.id, table.c.title])))
+        first = self.next_id(Tag)
+        new = [title for title in titles if title not in existing]
+        self.insert(table, ({'id': first + i, 'title': title}
+                            for i, title in enumerate(new)))
+        existing.update((title, first + i) for i, title in enumerate(new))
+        return [existing[title] for title in titles], len(new)
+
+    def posts(self, count, user_ids, tag_ids):
+        """生成文章和标签关联，返回(文章的id范围, 每篇文章发布时间距end的秒数)"""
+        first = self.next_id(Post)
+        ages = array.array('l')
+
+        self.post_counts = array.array('l', [0]) * count
+
+        def post_rows():
+            for id in xrange(first, first + count):
+                age = self.rng.randint(0, DAYS * 86400)
+                ages.append(age)
+                user_id = self.rng.choice(user_ids)
+                self.count('post_count', user_ids, user_id)
+                row = {
+                    'id': id,
+                    'title': self.title(),
+                    'text': self.paragraph(),
+                    'publish_date': self.date(age),
+                    'user_id': user_id
+                }
+                # Core写入不会触发Post.text的set事件，正文在这里渲染
+                row.update(render(row['text']))
+                yield row
+
+        self.insert(Post.__table__, post_rows())
+
+        # 标签关联使用单独的随机数序列，不影响文章本身的数据
+        rng = random.Random(self.rng.random())
+
+        def tag_rows():
+            for id in xrange(first, first + count):
+                k = rng.randint(1, min(3, len(tag_ids)))
+                for tag_id in rng.sample(tag_ids, k):
+                    yield {'post_id': id, 'tag_id': tag_id}
+
+        if tag_ids:
+            self.insert(posts_tags_table, tag_rows())
+        return xrange(first, first + count), ages
+
+    def comments(self, count, post_ids, ages, user_ids):
+        def comment_rows():
+            for _ in xrange(count):
+                i = self.rng.randrange(len(post_ids))
+                # 评论时间在文章发布之后
+                age = self.rng.randint(0, ages[i])
+                user_id = self.rng.choice(user_ids)
+                self.post_counts[i] += 1
+                self.count('comment_count', user_ids, user_id)
+                yield {
+                    'name': self.title(),
+                    'text': self.paragraph(),
+                    'date': self.date(age),
+                    'disabled': False,
+                    'post_id': post_ids[i],
+                    'user_id': user_id
+                }
+
+        return self.insert(Comment.__table__, comment_rows())
+
+    def follows(self, per_user, user_ids):
+        """每个用户平均关注per_user个其他用户"""
+        limit = min(per_user * 2, len(user_ids) - 1)
+
+        def follow_rows():
+            for id in user_ids:
+                k = self.rng.randint(0, limit)
+                for following_id in self.rng.sample(user_ids, k + 1):
+                    if following_id == id:
+                        continue
+                    self.count('following_count', user_ids, id)
+                    self.count('follower_count', user_ids, following_id)
+                    yield {'follower_id': id, 'following_id': following_id,
+                           'timestamp': self.date()}
+
+        if limit <= 0:
+            return 0
+        # sample多取一个再去掉自己，所以平均数略多于per_user
+        return self.insert(Follow.__table__, follow_rows())
+
+    def update_counters(self, user_ids, post_ids):
+        """用一条executemany的UPDATE写入统计好的计数，计数全为0的行跳过"""
+        columns = sorted(self.user_counts)
+        users = User.__table__
+        self.execute_many(
+            users.update().where(users.c.id == bindparam('_id')).values(
+                dict((c, bindparam(c)) for c in columns)),
+            (dict([('_id', id)] + [(c, self.user_counts[c][i])
+                                   for c in columns])
+             for i, id in enumerate(user_ids)
+             if any(self.user_counts[c][i] for c in columns)))
+        posts = Post.__table__
+        self.execute_many(
+            posts.update().where(posts.c.id == bindparam('_id')).values(
+                comment_count=bindparam('comment_count')),
+            ({'_id': id, 'comment_count': self.post_counts[i]}
+             for i, id in enumerate(post_ids) if self.post_counts[i]))
+
+    def execute_many(self, statement, rows):
+        batch = []
+        count = 0
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self.conn.execute(statement, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            self.conn.execute(statement, batch)
+            count += len(batch)
+        return count
+
+
+def seed_database(users=100, tags=10, posts=100, comments=1000, follows=10,
+                  seed=0, batch_size=5000, end=None):
+    """
+    批量写入模拟数据，返回各表写入的行数。
+    Arguments:
+        users, tags, posts, comments: 各表新增的行数
+        follows: 每个用户平均关注的人数
+        seed: 随机数种子，相同的种子生成相同的数据
+        batch_size: 每次executemany写入的行数
+        end: 模拟数据中最晚的时间，默认为DEFAULT_END
+    """
+    seeder = Seeder(seed, batch_size, end)
+    user_ids = seeder.users(users)
+    tag_ids, new_tags = seeder.tags(tags)
+    post_ids = xrange(0)
+    result = {'users': len(user_ids), 'tags': new_tags,
+              'posts': 0, 'comments': 0, 'follows': 0}
+    if user_ids:
+        post_ids, ages = seeder.posts(posts, user_ids, tag_ids)
+        result['posts'] = len(post_ids)
+        if post_ids:
+            result['comments'] = seeder.comments(comments, post_ids, ages,
+                                                 user_ids)
+        result['follows'] = seeder.follows(follows, user_ids)
+        seeder.update_counters(user_ids, post_ids)
+    db.session.commit()
+
+    # Core写入时不会触发session事件，时间线、检索索引和缓存在这里统一处理
+    if current_app.config['TIMELINE_FANOUT']:
+        rebuild_timelines()
+    reindex(batch_size)
+    try:
+        invalidate_sidebar()
+        invalidate_pages(ALL_PAGES)
+    except Exception:
+        # 数据已经提交，缓存(例如Redis)连接不上时只记录错误，缓存过期后自然更新
+        current_app.logger.exception('Failed to invalidate caches after seeding')
+    return result
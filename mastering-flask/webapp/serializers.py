@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+API资源的序列化
+
+to_json()中的每个链接以前都调用一次url_for(..., _external=True)，
+每次都要取得URL适配器、在路由表中查找endpoint并拼接主机名，
+一页30条评论就要调用上百次。API中的链接除了资源的id之外都相同，
+所以每个endpoint在同一个请求(应用上下文)中只用url_for生成一次URL模板，
+之后只需要把id填进去。
+"""
+from flask import g, has_request_context, request, url_for
+from .encoding import list_response
+from .pagination import pagination_urls
+
+# 生成模板时代替id的值，不会出现在正常的URL中
+_PLACEHOLDER = 9876543210123
+
+
+class UrlTemplate(object):
+    """endpoint的外部URL模板，只有一个整数参数id"""
+
+    def __init__(self, endpoint):
+        url = url_for(endpoint, id=_PLACEHOLDER, _external=True)
+        parts = url.split(str(_PLACEHOLDER))
+        self.endpoint = endpoint
+        # 主机名中恰好出现了占位值时，退回到每次调用url_for
+        self.parts = parts if len(parts) == 2 else None
+
+    def __call__(self, id):
+        if self.parts is None:
+            return url_for(self.endpoint, id=id, _external=True)
+        return '%s%d%s' % (self.parts[0], id, self.parts[1])
+
+
+def url_template(endpoint):
+    """返回endpoint的URL模板，同一个上下文中只生成一次"""
+    templates = g.get('url_templates')
+    if templates is None:
+        templates = g.url_templates = {}
+    # 测试中多个请求共用同一个应用上下文，请求的主机名可能不同
+    key = (endpoint, request.url_root if has_request_context() else None)
+    template = templates.get(key)
+    if template is None:
+        template = templates[key] = UrlTemplate(endpoint)
+    return template
+
+
+def external_url(endpoint, id):
+    """与url_for(endpoint, id=id, _external=True)的结果相同"""
+    return url_template(endpoint)(id)
+
+
+def _page_fields(pagination, endpoint, **kwargs):
+    prev, next = pagination_urls(pagination, endpoint, **kwargs)
+    return {'prev': prev, 'next': next, 'count': pagination.total}
+
+
+def serialize_page(name, items, pagination, endpoint, **kwargs):
+    """
+    把一页资源序列化为API列表接口的响应内容：
+    {name: [...], 'prev': ..., 'next': ..., 'count': ...}
+    """
+    data = _page_fields(pagination, endpoint, **kwargs)
+    data[name] = [item.to_json() for item in items]
+    return data
+
+
+def page_response(name, items, pagination, endpoint, **kwargs):
+    """与serialize_page()的内容相同，直接返回JSON响应，条目多时流式输出"""
+    return list_response(name, items,
+                         _page_fields(pagination, endpoint, **kwargs))
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+侧边栏数据的缓存
+
+每个页面都有一个侧边栏，显示最新的文章和最常用的标签。这两个查询的结果放在缓存中，
+缓存里保存的是普通的字典而不是ORM对象；文章或标签关联发生变化时，
+由SQLAlchemy的session事件在事务提交后删除缓存，下一次请求再重新查询。
+没有共享缓存的多进程部署中，删除缓存只对当前进程有效(见caching.cache_is_shared)，
+这时缓存时间缩短为SIDEBAR_LOCAL_CACHE_TIMEOUT秒，其他进程最多显示这么久的旧数据。
+"""
+from flask import current_app, has_app_context
+from sqlalchemy import event, func, inspect
+from .caching import get_cache, cache_is_shared
+from .pagecache import depends_on, invalidate_pages
+from .models import db, Post, Tag, posts_tags_table
+
+SIDEBAR_CACHE_KEY = 'sidebar_data'
+# 显示侧边栏的页面在整页缓存中依赖的标签
+SIDEBAR_PAGE_TAG = 'sidebar'
+
+
+def _load_sidebar_data():
+    recent = db.session.query(Post.id, Post.title).order_by(
+        Post.publish_date.desc(), Post.id.desc()
+    ).limit(
+        current_app.config['TOP_POSTS_NUM']
+    ).all()
+    # 下面的查询对应的SQL语句为
+    # SELECT tags.id, tags.title, count(posts_tags.post_id) AS total
+    # FROM tags JOIN posts_tags
+    # ON tags.id = posts_tags.tag_id
+    # GROUP BY tags.id, tags.title
+    # ORDER BY total DESC, tags.id
+    # LIMIT ? OFFSET ?
+    total = func.count(posts_tags_table.c.post_id).label('total')
+    top_tags = db.session.query(
+        Tag.id, Tag.title, total
+    ).join(posts_tags_table).group_by(Tag.id, Tag.title).order_by(
+        total.desc(), Tag.id
+    ).limit(
+        current_app.config['TOP_TAGS_NUM']
+    ).all()
+
+    recent = [{'id': id, 'title': title} for id, title in recent]
+    top_tags = [{'id': id, 'title': title, 'total': total}
+                for id, title, total in top_tags]
+    return recent, top_tags
+
+
+def sidebar_data():
+    """侧边栏函数，返回(recent, top_tags)，缓存命中时不访问数据库"""
+    depends_on(SIDEBAR_PAGE_TAG)
+    store = get_cache()
+    data = store.get(SIDEBAR_CACHE_KEY)
+    if data is None:
+        data = _load_sidebar_data()
+        store.set(SIDEBAR_CACHE_KEY, data, timeout=_cache_timeout())
+    return data
+
+
+def _cache_timeout():
+    if cache_is_shared():
+        return current_app.config['SIDEBAR_CACHE_TIMEOUT']
+    return current_app.config['SIDEBAR_LOCAL_CACHE_TIMEOUT']
+
+
+def invalidate_sidebar():
+    get_cache().delete(SIDEBAR_CACHE_KEY)
+    invalidate_pages(SIDEBAR_PAGE_TAG)
+
+
+def _sidebar_changed(session):
+    for obj in session.new | session.deleted:
+        if isinstance(obj, (Post, Tag)):
+            return True
+    for obj in session.dirty:
+        if isinstance(obj, Tag):
+            return True
+        if isinstance(obj, Post):
+            attrs = inspect(obj).attrs
+            for name in ('title', 'publish_date', 'tags'):
+                if attrs[name].history.has_changes():
+                    return True
+    return False
+
+
+# flush时只做标记，等事务真正提交后再删除缓存，
+# 避免其他请求在提交前把旧数据重新写回缓存
+def invalidate_sidebar_after_commit(session):
+    """事务提交后删除侧边栏的缓存，用于session事件看不到的Core语句"""
+    session.info['sidebar_changed'] = True
+
+
+@event.listens_for(db.session, 'after_flush')
+def _track_sidebar_changes(session, flush_context):
+    if _sidebar_changed(session):
+        invalidate_sidebar_after_commit(session)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_sidebar_on_commit(session):
+    if session.info.pop('sidebar_changed', False) and has_app_context():
+        invalidate_sidebar()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_sidebar_changes(session):
+    session.info.pop('sidebar_changed', None)
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+批量解析文章的标签
+
+PostApi以前对每个标签执行一次 Tag.query.filter_by(title=...).first()，
+不存在的标签逐个创建，两个请求同时创建同一个标签时会产生标题重复的标签；
+put还会把文章已有的标签再追加一遍。现在：
+1. 所有标题用一条IN查询取出已有的标签；
+2. 缺少的标签用一条executemany的INSERT一次写入，tags.title上有唯一索引，
+   INSERT忽略已经被其他请求写入的标题(SQLite的INSERT OR IGNORE、
+   PostgreSQL的ON CONFLICT DO NOTHING、MySQL的INSERT IGNORE)，
+   写入后再查询一次取得这些标签；
+3. 标题去掉首尾空白后去重，文章已有的标签不再重复添加。
+"""
+from sqlalchemy.dialects import postgresql
+from .models import db, Tag
+
+tags = Tag.__table__
+# 每条IN查询最多的标题数，不超过SQLite对参数个数的限制
+CHUNK_SIZE = 500
+
+
+def _chunks(items, size=CHUNK_SIZE):
+    for i in xrange(0, len(items), size):
+        yield items[i:i + size]
+
+
+def normalize_titles(titles):
+    """去掉首尾空白、空标题和重复的标题，保持原来的顺序"""
+    result = []
+    seen = set()
+    for title in titles or ():
+        if isinstance(title, str):
+            title = title.decode('utf-8')
+        title = (title or u'').strip()
+        if title and title not in seen:
+            seen.add(title)
+            result.append(title)
+    return result
+
+
+def _insert_missing(conn):
+    # 标题已经存在时忽略这一行，不会因为并发写入而违反唯一索引
+    dialect = conn.dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(tags).on_conflict_do_nothing(
+            index_elements=[tags.c.title])
+    if dialect == 'sqlite':
+        return tags.insert().prefix_with('OR IGNORE')
+    if dialect == 'mysql':
+        return tags.insert().prefix_with('IGNORE')
+    return tags.insert()
+
+
+def _load(titles):
+    found = {}
+    for chunk in _chunks(titles):
+        for tag in Tag.query.filter(Tag.title.in_(chunk)):
+            found[tag.title] = tag
+    return found
+
+
+def resolve_tags(titles):
+    """返回标题对应的Tag对象列表，不存在的标签批量创建"""
+    titles = normalize_titles(titles)
+    if not titles:
+        return []
+    found = _load(titles)
+    missing = [title for title in titles if title not in found]
+    if missing:
+        conn = db.session.connection()
+        conn.execute(_insert_missing(conn),
+                     [{'title': title} for title in missing])
+        found.update(_load(missing))
+    return [found[title] for title in titles]
+
+
+def add_tags(post, titles):
+    """给文章添加标签，已有的标签不重复添加"""
+    current = set(tag.id for tag in post.tags)
+    for tag in resolve_tags(titles):
+        if tag.id not in current:
+            current.add(tag.id)
+            post.tags.append(tag)
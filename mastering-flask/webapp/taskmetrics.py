@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Celery任务的监控指标
+
+以前看不到任务在队列中等了多久、执行了多久、失败和重试了多少次，
+每个任务还要push/pop一次完整的应用上下文。现在celery_runner中的任务基类
+由context_task()生成，每次执行时记录：
+    queue_wait: 从发布到开始执行的时间(发布时在消息头中加上sent_at，
+                设置了eta/countdown的消息不记录)
+    runtime: 任务本身的执行时间
+    context: 进入和离开应用上下文的时间
+    succeeded/failed/retried: 各种结果的次数
+指标先记在本进程的TaskMetrics中，每隔TASK_METRICS_INTERVAL秒写一行日志，
+并把本进程的累计值写入缓存；/api/v1.0/metrics/tasks把各个进程的值加起来，
+以Prometheus的文本格式输出。worker和Web进程之间需要共享缓存
+(见caching.cache_is_shared)，没有共享缓存时只写日志，接口返回503。
+CELERY_REUSE_APP_CONTEXT为True时，worker的每个线程只push一次应用上下文，
+任务结束后照常执行teardown(移除数据库session等)，但上下文留给下一个任务使用。
+"""
+import atexit
+import logging
+import os
+import socket
+import threading
+import time
+from celery.exceptions import Retry
+from celery.signals import before_task_publish
+from flask import _app_ctx_stack
+from .caching import get_cache, cache_is_shared
+
+logger = logging.getLogger(__name__)
+
+# 缓存中各个进程的指标的键，以及所有这些键的列表
+PROCESS_KEY = 'task_metrics:%s:%d'
+REGISTRY_KEY = 'task_metrics:processes'
+# 记录次数的结果和记录耗时的阶段
+STATES = ('succeeded', 'failed', 'retried')
+TIMINGS = ('queue_wait', 'runtime', 'context')
+
+
+class TaskMetrics(object):
+    def __init__(self, app):
+        self.app = app
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.time()
+        app.extensions['task_metrics'] = self
+        atexit.register(self._flush_at_exit)
+
+    @property
+    def key(self):
+        # prefork的子进程由fork产生，每次都要取当前的pid
+        return PROCESS_KEY % (socket.gethostname(), os.getpid())
+
+    def _task(self, name):
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = dict(
+                [(state, 0) for state in STATES] +
+                [(timing, [0, 0.0]) for timing in TIMINGS])
+        return stats
+
+    def count(self, name, state):
+        with self._lock:
+            self._task(name)[state] += 1
+
+    def observe(self, name, timing, seconds):
+        with self._lock:
+            total = self._task(name)[timing]
+            total[0] += 1
+            total[1] += seconds
+
+    def snapshot(self):
+        """本进程的累计值：{任务名: {结果: 次数, 阶段: [次数, 总秒数]}}"""
+        with self._lock:
+            return dict((name, dict((k, list(v) if isinstance(v, list) else v)
+                                    for k, v in stats.items()))
+                        for name, stats in self._stats.items())
+
+    def maybe_flush(self):
+        interval = self.app.config['TASK_METRICS_INTERVAL']
+        if interval and time.time() - self._last_flush >= interval:
+            self.flush()
+
+    def flush(self):
+        """写日志，并把本进程的累计值写入缓存，需要在应用上下文中调用"""
+        with self._lock:
+            self._last_flush = time.time()
+        stats = self.snapshot()
+        if not stats:
+            return
+        for name in sorted(stats):
+            logger.info('task %s %s', name, format_stats(stats[name]))
+        if not cache_is_shared():
+            return
+        store = get_cache()
+        timeout = self.app.config['TASK_METRICS_TIMEOUT']
+        key = self.key
+        store.set(key, stats, timeout=timeout)
+        # 去掉已经过期的进程；多个进程同时修改时可能丢掉一个，下次写入时会补上
+        keys = [k for k in store.get(REGISTRY_KEY) or []
+                if k != key and store.get(k) is not None]
+        store.set(REGISTRY_KEY, keys + [key], timeout=timeout)
+
+    def _flush_at_exit(self):
+        try:
+            with self.app.app_context():
+                self.flush()
+        except Exception:
+            pass
+
+
+def format_stats(stats):
+    """日志中的一行：各种结果的次数和各个阶段的平均耗时"""
+    parts = ['%s=%d' % (state, stats[state]) for state in STATES]
+    for timing in TIMINGS:
+        count, total = stats[timing]
+        if count:
+            parts.append('%s=%.6fs' % (timing, total / count))
+    return ' '.join(parts)
+
+
+def collect():
+    """缓存中所有进程的指标之和，没有共享缓存时抛出RuntimeError"""
+    if not cache_is_shared():
+        raise RuntimeError('task metrics require a shared cache (CACHE_TYPE)')
+    store = get_cache()
+    totals = {}
+    for stats in store.get_many(*(store.get(REGISTRY_KEY) or [])):
+        for name, values in (stats or {}).items():
+            total = totals.setdefault(name, dict(
+                [(state, 0) for state in STATES] +
+                [(timing, [0, 0.0]) for timing in TIMINGS]))
+            for state in STATES:
+                total[state] += values[state]
+            for timing in TIMINGS:
+                total[timing][0] += values[timing][0]
+                total[timing][1] += values[timing][1]
+    return totals
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def prometheus(totals):
+    """Prometheus的文本格式"""
+    lines = ['# HELP celery_task_total Finished task runs by outcome.',
+             '# TYPE celery_task_total counter']
+    for name in sorted(totals):
+        for state in STATES:
+            lines.append('celery_task_total{task="%s",state="%s"} %d'
+                         % (_label(name), state, totals[name][state]))
+    for timing in TIMINGS:
+        metric = 'celery_task_%s_seconds' % timing
+        lines.append('# HELP %s Task %s time.' % (metric, timing))
+        lines.append('# TYPE %s summary' % metric)
+        for name in sorted(totals):
+            count, total = totals[name][timing]
+            lines.append('%s_count{task="%s"} %d' % (metric, _label(name), count))
+            lines.append('%s_sum{task="%s"} %r' % (metric, _label(name), total))
+    return '\n'.join(lines) + '\n'
+
+
+@before_task_publish.connect
+def _stamp_sent_at(headers=None, **kwargs):
+    # 消息头中的字段在worker中成为task.request的属性
+    if headers is not None and headers.get('eta') is None:
+        headers['sent_at'] = time.time()
+
+
+_local = threading.local()
+
+
+def _enter(app):
+    """进入任务的应用上下文，返回(上下文, 是否复用)"""
+    top = _app_ctx_stack.top
+    if app.config['CELERY_REUSE_APP_CONTEXT']:
+        if top is not None and top is getattr(_local, 'context', None):
+            return top, True
+        if top is None:
+            ctx = _local.context = app.app_context()
+            ctx.push()
+            return ctx, True
+    ctx = app.app_context()
+    ctx.push()
+    return ctx, False
+
+
+def _leave(app, ctx, reused, exc):
+    if not reused:
+        ctx.pop(exc)
+        return
+    # 与pop时一样执行teardown，但保留上下文，只换掉g
+    app.do_teardown_appcontext(exc)
+    ctx.g = app.app_ctx_globals_class()
+
+
+def context_task(TaskBase, app):
+    """在app的应用上下文中执行并记录指标的任务基类"""
+
+    class ContextTask(TaskBase):
+        abstract = True
+
+        def __call__(self, *args, **kwargs):
+            metrics = app.extensions['task_metrics']
+            name = self.name
+            started = time.time()
+            sent_at = getattr(self.request, 'sent_at', None)
+            if sent_at is not None:
+                metrics.observe(name, 'queue_wait', max(started - sent_at, 0))
+            ctx, reused = _enter(app)
+            entered = time.time()
+            exc = None
+            try:
+                result = TaskBase.__call__(self, *args, **kwargs)
+            except Retry:
+                metrics.count(name, 'retried')
+                raise
+            except Exception as e:
+                exc = e
+                metrics.count(name, 'failed')
+                raise
+            finally:
+                finished = time.time()
+                metrics.observe(name, 'runtime', finished - entered)
+                metrics.maybe_flush()
+                _leave(app, ctx, reused, exc)
+                metrics.observe(name, 'context',
+                                entered - started + time.time() - finished)
+            metrics.count(name, 'succeeded')
+            return result
+
+    return ContextTask
@@ -1,9 +1,14 @@
 # -*- coding: utf-8 -*-
+# 包中有webapp/email.py，必须使用绝对导入才能导入标准库的email包
+from __future__ import absolute_import
+import datetime
 import time
-import smtplib
-from email.mime.text import MIMEText
-from .extensions import celery
-from .controllers.blog.views import digest_func
+from celery import group
+from flask import current_app
+from flask_mail import Message
+from .extensions import celery, mail
+from .digest import DigestError, week_range, build_digest, recipient_chunks, \
+    send_digests
 
 
 @celery.task()
@@ -20,30 +25,46 @@ def multiply(x, y):
     return x * y
 
 
-@celery.task(
-    bind=True,
-    ignore_result=True,
-    default_retry_delay=300,
-    max_retries=5
-)
-def digest(self):
-    mail_host = "smtp.163.com"     # 使用的邮箱的smtp服务器地址，这里是163的smtp地址
-    mail_user = "xxx@163.com"      # 用户名
-    mail_pass = "xxx"              # 密码
-    mailto_list = ["xxx@qq.com"]   # 收件人(列表)
-
-    msg = MIMEText(digest_func(), 'html')
-    # print(msg)
-    msg['Subject'] = "Weekly Digest"
-    msg['From'] = mail_user
-    msg['To'] = ';'.join(mailto_list)  # 将收件人列表以‘;’分隔
-
+@celery.task(bind=True, ignore_result=True)
+def send_mail(self, data):
+    """发送send_email渲染好的邮件，失败时按指数退避重试"""
     try:
-        smtp_server = smtplib.SMTP(mail_host)
-        # smtp_server.starttls()
-        smtp_server.login(mail_user, mail_pass)
-        smtp_server.sendmail(mail_user, mailto_list, msg.as_string())
-        smtp_server.close()
+        mail.send(Message(**data))
+    except Exception as e:
+        config = current_app.config
+        delay = config['MAIL_RETRY_DELAY'] * 2 ** self.request.retries
+        self.retry(exc=e, countdown=delay,
+                   max_retries=config['MAIL_MAX_RETRIES'])
+
+
+@celery.task(ignore_result=True)
+def digest():
+    """每周摘要：本周的文章只整理一次，收件人分批交给send_digest子任务"""
+    config = current_app.config
+    start, end = week_range()
+    if not build_digest(start, end):
         return
-    except Exception, e:
-        self.retry(exc=e)
+    week = start.date().isoformat()
+    # 每次派发DIGEST_GROUP_SIZE个子任务，不会一次生成几百个消息
+    batch = []
+    for user_ids in recipient_chunks(start, end, config['DIGEST_CHUNK_SIZE']):
+        batch.append(send_digest.s(week, user_ids))
+        if len(batch) >= config['DIGEST_GROUP_SIZE']:
+            group(batch).apply_async()
+            batch = []
+    if batch:
+        group(batch).apply_async()
+
+
+# 速率限制由配置中的CELERY_ANNOTATIONS设置
+@celery.task(bind=True, ignore_result=True)
+def send_digest(self, week, user_ids):
+    """给一批收件人发送摘要，失败时只重试还没有发送的收件人"""
+    start = datetime.datetime.strptime(week, '%Y-%m-%d')
+    try:
+        return send_digests(start, user_ids)
+    except DigestError as e:
+        config = current_app.config
+        delay = config['MAIL_RETRY_DELAY'] * 2 ** self.request.retries
+        self.retry(args=(week, e.remaining), exc=e.error, countdown=delay,
+                   max_retries=config['MAIL_MAX_RETRIES'])
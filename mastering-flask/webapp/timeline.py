@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+关注时间线的写扩散(fan-out on write)
+
+开启TIMELINE_FANOUT后：
+1. 发表文章时，用一条 INSERT ... SELECT 把文章写入作者所有关注者的时间线，
+   再把这些时间线裁剪到TIMELINE_SIZE条；
+2. 关注某人时，把他最近的文章补进自己的时间线；取消关注时删掉他的文章；
+3. 关注者超过TIMELINE_FANOUT_LIMIT的作者不做写扩散，并标记User.timeline_pull，
+   User.following_posts读取时间线时再把这些作者的文章合并进来。关注者减少到上限以下后
+   标记仍然保留，之前没有写入时间线的文章不会消失；rebuild_timeline时重新计算标记。
+所有写入都在after_flush事件中使用当前session的连接执行，和触发它的修改处于同一个事务。
+"""
+from flask import current_app, has_app_context
+from sqlalchemy import DateTime, and_, event, inspect, literal, select
+from .models import db, Follow, Post, TimelineEntry, User
+
+timelines = TimelineEntry.__table__
+follows = Follow.__table__
+posts = Post.__table__
+users = User.__table__
+
+
+def _fanout_allowed(author_id):
+    # 作者的关注者数目不超过上限时才做写扩散
+    return select([users.c.follower_count]).where(
+        users.c.id == author_id
+    ).as_scalar() <= current_app.config['TIMELINE_FANOUT_LIMIT']
+
+
+def _mark_pull(conn, author_id):
+    # 超过上限、这次没有做写扩散的作者改为读取时合并
+    conn.execute(users.update().where(and_(
+        users.c.id == author_id,
+        users.c.timeline_pull == False,
+        users.c.follower_count > current_app.config['TIMELINE_FANOUT_LIMIT']
+    )).values(timeline_pull=True))
+
+
+def _trim(conn, user_ids):
+    """把时间线裁剪到TIMELINE_SIZE条，user_ids为None时裁剪所有用户"""
+    newer = timelines.alias('newer')
+    boundary = select([newer.c.publish_date]).where(
+        newer.c.user_id == timelines.c.user_id
+    ).order_by(newer.c.publish_date.desc()).limit(1).offset(
+        current_app.config['TIMELINE_SIZE'] - 1
+    ).as_scalar()
+    where = timelines.c.publish_date < boundary
+    if user_ids is not None:
+        where = and_(timelines.c.user_id.in_(user_ids), where)
+    conn.execute(timelines.delete().where(where))
+
+
+def push_post(conn, post_id, author_id, publish_date):
+    """把一篇新文章写入作者所有关注者的时间线"""
+    followers = select([follows.c.follower_id]).where(
+        follows.c.following_id == author_id)
+    conn.execute(timelines.insert().from_select(
+        ['user_id', 'post_id', 'author_id', 'publish_date'],
+        select([
+            follows.c.follower_id,
+            literal(post_id),
+            literal(author_id),
+            literal(publish_date, DateTime)
+        ]).where(and_(
+            follows.c.following_id == author_id,
+            _fanout_allowed(author_id)
+        ))
+    ))
+    _mark_pull(conn, author_id)
+    _trim(conn, followers)
+
+
+def backfill(conn, user_id, author_id):
+    """关注作者后，把他最近的文章补进自己的时间线"""
+    conn.execute(timelines.delete().where(and_(
+        timelines.c.user_id == user_id, timelines.c.author_id == author_id)))
+    conn.execute(timelines.insert().from_select(
+        ['user_id', 'post_id', 'author_id', 'publish_date'],
+        select([
+            literal(user_id), posts.c.id, posts.c.user_id, posts.c.publish_date
+        ]).where(and_(
+            posts.c.user_id == author_id,
+            _fanout_allowed(author_id)
+        )).order_by(
+            posts.c.publish_date.desc()
+        ).limit(current_app.config['TIMELINE_SIZE'])
+    ))
+    _mark_pull(conn, author_id)
+    _trim(conn, [user_id])
+
+
+def prune(conn, user_id, author_id):
+    """取消关注后，从时间线中删掉该作者的文章"""
+    conn.execute(timelines.delete().where(and_(
+        timelines.c.user_id == user_id, timelines.c.author_id == author_id)))
+
+
+def rebuild_timelines():
+    """根据follows和posts表重建所有人的时间线，开启写扩散前执行一次"""
+    conn = db.session.connection()
+    limit = current_app.config['TIMELINE_FANOUT_LIMIT']
+    conn.execute(users.update().values(
+        timeline_pull=users.c.follower_count > limit))
+    conn.execute(timelines.delete())
+    conn.execute(timelines.insert().from_select(
+        ['user_id', 'post_id', 'author_id', 'publish_date'],
+        select([
+            follows.c.follower_id, posts.c.id, posts.c.user_id,
+            posts.c.publish_date
+        ]).select_from(
+            follows.join(posts, posts.c.user_id == follows.c.following_id)
+                   .join(users, users.c.id == follows.c.following_id)
+        ).where(users.c.timeline_pull == False)
+    ))
+    _trim(conn, None)
+    db.session.commit()
+    return db.session.query(TimelineEntry).count()
+
+
+@event.listens_for(db.session, 'after_flush')
+def _update_timelines(session, flush_context):
+    if not has_app_context() or not current_app.config['TIMELINE_FANOUT']:
+        return
+    conn = session.connection()
+    for obj in session.new:
+        if isinstance(obj, Post) and obj.user_id is not None:
+            push_post(conn, obj.id, obj.user_id, obj.publish_date)
+        elif isinstance(obj, Follow):
+            backfill(conn, obj.follower_id, obj.following_id)
+    for obj in session.deleted:
+        if isinstance(obj, Post):
+            conn.execute(timelines.delete().where(
+                timelines.c.post_id == obj.id))
+        elif isinstance(obj, Follow):
+            prune(conn, obj.follower_id, obj.following_id)
+        elif isinstance(obj, User):
+            conn.execute(timelines.delete().where(
+                timelines.c.user_id == obj.id))
+    # 修改文章后发布时间会被刷新，时间线中的排序键也要同步
+    for obj in session.dirty:
+        if isinstance(obj, Post) and \
+                inspect(obj).attrs.publish_date.history.has_changes():
+            conn.execute(timelines.update().where(
+                timelines.c.post_id == obj.id
+            ).values(publish_date=obj.publish_date))
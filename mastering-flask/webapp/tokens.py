@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+签名令牌的生成和验证
+
+TimedJSONWebSignatureSerializer对象每个应用、每种有效期只创建一次。
+API令牌验证通过后，令牌到用户id的映射保存在进程内的LRU缓存中，
+缓存时间不超过令牌本身剩余的有效期，同一个令牌再次请求时不需要重新解码和校验签名。
+
+令牌在过期之前可以被吊销：吊销单个令牌(注销)，或者吊销某个用户在某一时刻之前
+签发的所有令牌(修改密码)。配置了共享缓存时吊销记录保存在共享缓存中，
+所有进程都能看到；否则保存在进程内，记录在对应的令牌过期后失效。
+"""
+import hashlib
+import time
+from flask import current_app
+from itsdangerous import TimedJSONWebSignatureSerializer as Serializer, \
+    BadSignature
+from .caching import LRUCache, get_cache
+
+# 没有指定有效期时令牌的有效期(秒)，与itsdangerous的默认值相同
+DEFAULT_EXPIRES_IN = 3600
+
+
+class TokenState(object):
+    """每个应用各自持有的序列化器、已验证令牌和吊销记录"""
+
+    def __init__(self, app):
+        self.serializers = {}
+        self.verified = LRUCache(app.config['TOKEN_CACHE_SIZE'])
+        # 吊销记录不能被LRU淘汰，否则被吊销的令牌会重新生效
+        self.revoked = LRUCache(maxsize=None)
+
+
+def _state():
+    app = current_app._get_current_object()
+    state = app.extensions.get('auth_tokens')
+    if state is None:
+        state = app.extensions.setdefault('auth_tokens', TokenState(app))
+    return state
+
+
+def get_serializer(expires_in=None):
+    """返回当前应用中指定有效期的Serializer，同一有效期只创建一次"""
+    expires_in = expires_in or DEFAULT_EXPIRES_IN
+    serializers = _state().serializers
+    s = serializers.get(expires_in)
+    if s is None:
+        s = serializers.setdefault(expires_in, Serializer(
+            current_app.config['SECRET_KEY'], expires_in=expires_in))
+    return s
+
+
+def _revocations():
+    store = get_cache()
+    if isinstance(store, LRUCache):
+        return _state().revoked
+    return store
+
+
+def _token_key(token):
+    if isinstance(token, unicode):
+        token = token.encode('utf-8')
+    return 'revoked_token:' + hashlib.sha1(token).hexdigest()
+
+
+def _user_key(user_id):
+    return 'tokens_revoked_before:%d' % user_id
+
+
+def _decode(token):
+    """校验签名并返回(user_id, iat, exp)，令牌无效或过期时返回None"""
+    state = _state()
+    entry = state.verified.get(token)
+    if entry is None:
+        try:
+            data, header = get_serializer().loads(token, return_header=True)
+            entry = (data['id'], header['iat'], header['exp'])
+        except (BadSignature, KeyError, TypeError):
+            return None
+        remaining = entry[2] - time.time()
+        if remaining <= 0:
+            return None
+        state.verified.set(token, entry, timeout=remaining)
+    return entry
+
+
+def verify_token(token):
+    """返回令牌对应的用户id，令牌无效、过期或已被吊销时返回None"""
+    entry = _decode(token)
+    if entry is None:
+        return None
+    user_id, issued_at, expires = entry
+    revocations = _revocations()
+    if revocations.get(_token_key(token)):
+        return None
+    revoked_before = revocations.get(_user_key(user_id))
+    # iat只精确到秒，吊销时间也按整秒保存，与吊销同一秒签发的新令牌仍然有效
+    if revoked_before is not None and issued_at < revoked_before:
+        return None
+    return user_id
+
+
+def revoke_token(token):
+    """吊销单个令牌，吊销记录保存到令牌过期为止"""
+    entry = _decode(token)
+    if entry is None:
+        return False
+    _state().verified.delete(token)
+    _revocations().set(_token_key(token), True,
+                       timeout=max(int(entry[2] - time.time()) + 1, 1))
+    return True
+
+
+def revoke_user_tokens(user_id):
+    """吊销某个用户在此之前签发的所有API令牌"""
+    _revocations().set(_user_key(user_id), int(time.time()),
+                       timeout=current_app.config['TOKEN_MAX_AGE'])